@@ -9,6 +9,7 @@ import shutil
 import pickle
 
 from compass.config import add_config
+from compass.io import add_checksum
 
 
 def update_cache(step_paths, date_string=None, dry_run=False):
@@ -105,6 +106,7 @@ def update_cache(step_paths, date_string=None, dry_run=False):
                     except FileExistsError:
                         pass
                     shutil.copyfile(out_filename, output_path)
+                    add_checksum(cache_root, output_path)
 
         out_filename = f'{mpas_core}_cached_files.json'
         with open(out_filename, 'w') as data_file:
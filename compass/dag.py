@@ -0,0 +1,155 @@
+def build_dag(test_cases):
+    """
+    Build a directed acyclic graph (DAG) of the dependencies between steps
+    based on their inputs and outputs.  A step depends on another step if one
+    of its inputs is an output of the other step, either in the same test case
+    or in another test case (e.g. a forward step that uses the initial
+    condition from an ``init`` test case).  This function must be called after
+    the steps have been set up, since inputs and outputs are converted to
+    absolute paths in :py:meth:`compass.Step.process_inputs_and_outputs`.
+
+    Parameters
+    ----------
+    test_cases : dict of compass.TestCase
+        A dictionary of test cases that have been set up, with the relative
+        path in the work directory as keys
+
+    Returns
+    -------
+    dag : dict
+        A dictionary with the relative paths of steps as keys.  Each value is
+        a dictionary with the relative path of the ``test_case``, the name of
+        the ``step``, the relative paths of the steps the step depends on
+        (``dependencies``) and any inputs that are not produced by any step
+        (``external_inputs``).  Steps are in the order of the test cases and
+        the steps within them.
+    """
+    producers = dict()
+    for test_case in test_cases.values():
+        for step in test_case.steps.values():
+            for output in step.outputs:
+                producers[output] = step.path
+
+    dag = dict()
+    for test_case in test_cases.values():
+        for step in test_case.steps.values():
+            dependencies = list()
+            external_inputs = list()
+            for input_file in step.inputs:
+                if input_file in producers:
+                    producer = producers[input_file]
+                    if producer != step.path and \
+                            producer not in dependencies:
+                        dependencies.append(producer)
+                else:
+                    external_inputs.append(input_file)
+            dag[step.path] = {'test_case': test_case.path,
+                              'step': step.name,
+                              'dependencies': dependencies,
+                              'external_inputs': external_inputs}
+
+    return dag
+
+
+def get_subgraph(dag, test_case_path):
+    """
+    Get the part of a DAG with the steps in a given test case, including
+    their dependencies on steps in other test cases
+
+    Parameters
+    ----------
+    dag : dict
+        A DAG of steps from :py:func:`compass.dag.build_dag()`
+
+    test_case_path : str
+        The relative path of a test case in the work directory
+
+    Returns
+    -------
+    subgraph : dict
+        A DAG with only the steps in the test case
+    """
+    subgraph = dict()
+    for step_path, node in dag.items():
+        if node['test_case'] == test_case_path:
+            subgraph[step_path] = node
+    return subgraph
+
+
+def get_test_case_dependencies(dag):
+    """
+    Get the test cases that each test case in a DAG depends on because at
+    least one of its steps depends on a step in the other test case
+
+    Parameters
+    ----------
+    dag : dict
+        A DAG of steps from :py:func:`compass.dag.build_dag()`
+
+    Returns
+    -------
+    dependencies : dict of list of str
+        The relative paths of the test cases that each test case depends on,
+        with the relative paths of the test cases as keys
+    """
+    dependencies = dict()
+    for node in dag.values():
+        test_case_path = node['test_case']
+        if test_case_path not in dependencies:
+            dependencies[test_case_path] = list()
+        for step_path in node['dependencies']:
+            if step_path not in dag:
+                # the producer is not in this (sub)graph
+                continue
+            other = dag[step_path]['test_case']
+            if other != test_case_path and \
+                    other not in dependencies[test_case_path]:
+                dependencies[test_case_path].append(other)
+    return dependencies
+
+
+def get_levels(dag):
+    """
+    Sort the steps in a DAG into levels, where each step depends only on
+    steps in earlier levels.  The steps within a level are independent of one
+    another and could run concurrently.
+
+    Parameters
+    ----------
+    dag : dict
+        A DAG of steps from :py:func:`compass.dag.build_dag()`
+
+    Returns
+    -------
+    levels : list of list of str
+        The relative paths of the steps in each level
+
+    Raises
+    ------
+    ValueError
+        If the dependencies between steps are circular
+    """
+    remaining = list(dag)
+    finished = set()
+    levels = list()
+    while len(remaining) > 0:
+        level = list()
+        for step_path in remaining:
+            ready = True
+            for dependency in dag[step_path]['dependencies']:
+                if dependency in dag and dependency not in finished:
+                    ready = False
+                    break
+            if ready:
+                level.append(step_path)
+
+        if len(level) == 0:
+            raise ValueError('Circular dependencies between steps: '
+                             '{}'.format(', '.join(remaining)))
+
+        remaining = [step_path for step_path in remaining if step_path not
+                     in level]
+        finished.update(level)
+        levels.append(level)
+
+    return levels
@@ -1,13 +1,36 @@
 import os
+import json
+import hashlib
 import tempfile
+import threading
 import requests
+import requests.adapters
 import progressbar
 from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor, wait
 
 
-def download(url, dest_path, config, exceptions=True):
+# the number of bytes to read at a time when downloading files
+_chunk_size = 2**20
+
+# hashes of files that have already been computed, keyed by the real path,
+# size and modification time of each file
+_file_hashes = dict()
+
+# the name of the manifest of checksums in each database directory
+_checksums_filename = 'checksums.json'
+
+# a lock so threads don't update the same manifest of checksums at once
+_checksums_lock = threading.Lock()
+
+
+def download(url, dest_path, config, exceptions=True, session=None,
+             progress=True, database_dir=None):
     """
-    Download a file from a URL to the given path or path name
+    Download a file from a URL to the given path or path name.  The file is
+    downloaded to ``<dest_path>.part`` and renamed when the download is
+    complete.  If a partial download already exists, the download is resumed
+    if the server supports it.
 
     Parameters
     ----------
@@ -25,6 +48,21 @@ def download(url, dest_path, config, exceptions=True):
     exceptions : bool, optional
         Whether to raise exceptions when the download fails
 
+    session : requests.Session, optional
+        A session to use for the download, e.g. to share a pool of
+        connections among many downloads.  By default, a new session is
+        created.
+
+    progress : bool, optional
+        Whether to display a progress bar during the download
+
+    database_dir : str, optional
+        The directory of the database that ``dest_path`` is in, if any.  If
+        the file already exists and has a checksum in the database's
+        manifest, it is verified against the checksum rather than checking
+        with the server, and it is downloaded again if it is corrupt.  The
+        checksum of a newly downloaded file is added to the manifest.
+
     Returns
     -------
     dest_path : str
@@ -39,6 +77,23 @@ def download(url, dest_path, config, exceptions=True):
     check_size = config.getboolean('download', 'check_size')
     verify = config.getboolean('download', 'verify')
 
+    if database_dir is not None and os.path.exists(dest_path):
+        verified = verify_database_file(database_dir, dest_path)
+        if verified is None:
+            # there is no checksum for this file yet
+            pass
+        elif verified:
+            # the file is known to be good, so there's no need to check with
+            # the server
+            return dest_path
+        elif not do_download:
+            raise OSError(f'File does not match its checksum and downloading '
+                          f'is disabled: {dest_path}')
+        else:
+            print(f'{dest_path} does not match its checksum, so it will be '
+                  f'downloaded again')
+            os.remove(dest_path)
+
     if not do_download:
         if not os.path.exists(dest_path):
             raise OSError(f'File not found and downloading is disabled: '
@@ -48,9 +103,8 @@ def download(url, dest_path, config, exceptions=True):
     if not check_size and os.path.exists(dest_path):
         return dest_path
 
-    session = requests.Session()
-    if not verify:
-        session.verify = False
+    if session is None:
+        session = requests.Session()
 
     # dest_path contains full path, so we need to make the relevant
     # subdirectories if they do not exist already
@@ -60,8 +114,20 @@ def download(url, dest_path, config, exceptions=True):
     except OSError:
         pass
 
+    part_path = f'{dest_path}.part'
+    if os.path.exists(part_path) and not os.path.exists(dest_path):
+        # try to resume the previous download
+        resume_size = os.path.getsize(part_path)
+    else:
+        resume_size = 0
+
+    headers = dict()
+    if resume_size > 0:
+        headers['Range'] = f'bytes={resume_size}-'
+
     try:
-        response = session.get(url, stream=True)
+        response = session.get(url, stream=True, verify=verify,
+                               headers=headers)
         total_size = response.headers.get('content-length')
     except requests.exceptions.RequestException:
         if exceptions:
@@ -70,6 +136,15 @@ def download(url, dest_path, config, exceptions=True):
             print(f'  {url} could not be reached!')
             return None
 
+    if resume_size > 0 and response.status_code == 416:
+        # the range is not satisfiable, most likely because the partial file
+        # is already complete (or is corrupt), so start over
+        response.close()
+        os.remove(part_path)
+        return download(url, dest_path, config, exceptions=exceptions,
+                        session=session, progress=progress,
+                        database_dir=database_dir)
+
     try:
         response.raise_for_status()
     except requests.exceptions.HTTPError as e:
@@ -80,15 +155,32 @@ def download(url, dest_path, config, exceptions=True):
             print(e)
             return None
 
+    if response.status_code != 206:
+        # the server sent the whole file
+        resume_size = 0
+
+    sha = hashlib.sha256()
+    if resume_size > 0:
+        # we append to the partial file and the checksum includes the part we
+        # already downloaded
+        mode = 'ab'
+        with open(part_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(_chunk_size), b''):
+                sha.update(chunk)
+    else:
+        mode = 'wb'
+
     if total_size is None:
         # no content length header
         if not os.path.exists(dest_path):
             dest_dir = os.path.dirname(dest_path)
-            with open(dest_path, 'wb') as f:
+            with open(part_path, mode) as f:
                 print(f'Downloading {in_file_name}\n'
                       f'  to {dest_dir}...')
                 try:
-                    f.write(response.content)
+                    content = response.content
+                    sha.update(content)
+                    f.write(content)
                 except requests.exceptions.RequestException:
                     if exceptions:
                         raise
@@ -96,14 +188,21 @@ def download(url, dest_path, config, exceptions=True):
                         print(f'  {in_file_name} failed!')
                         return None
                 else:
-                    print('  {in_file_name} done.')
+                    print(f'  {in_file_name} done.')
+            os.replace(part_path, dest_path)
+            if database_dir is not None:
+                add_checksum(database_dir, dest_path, sha.hexdigest())
     else:
         # we can do the download in chunks and use a progress bar, yay!
 
-        total_size = int(total_size)
+        total_size = int(total_size) + resume_size
         if os.path.exists(dest_path) and \
                 total_size == os.path.getsize(dest_path):
             # we already have the file, so just return
+            response.close()
+            if database_dir is not None:
+                # the file is the right size but has no checksum yet
+                add_checksum(database_dir, dest_path)
             return dest_path
 
         if out_file_name == in_file_name:
@@ -111,20 +210,32 @@ def download(url, dest_path, config, exceptions=True):
         else:
             file_names = f'{in_file_name} as {out_file_name}'
         dest_dir = os.path.dirname(dest_path)
-        print(f'Downloading {file_names} ({_sizeof_fmt(total_size)})\n'
-              f'  to {dest_dir}')
-        widgets = [progressbar.Percentage(), ' ', progressbar.Bar(),
-                   ' ', progressbar.ETA()]
-        bar = progressbar.ProgressBar(widgets=widgets,
-                                      max_value=total_size).start()
-        size = 0
-        with open(dest_path, 'wb') as f:
+        if resume_size > 0:
+            print(f'Resuming download of {file_names} '
+                  f'({_sizeof_fmt(total_size)}) at '
+                  f'{_sizeof_fmt(resume_size)}\n'
+                  f'  to {dest_dir}')
+        else:
+            print(f'Downloading {file_names} ({_sizeof_fmt(total_size)})\n'
+                  f'  to {dest_dir}')
+        if progress:
+            widgets = [progressbar.Percentage(), ' ', progressbar.Bar(),
+                       ' ', progressbar.ETA()]
+            bar = progressbar.ProgressBar(widgets=widgets,
+                                          max_value=total_size).start()
+        else:
+            bar = None
+        size = resume_size
+        with open(part_path, mode) as f:
             try:
-                for data in response.iter_content(chunk_size=4096):
+                for data in response.iter_content(chunk_size=_chunk_size):
                     size += len(data)
+                    sha.update(data)
                     f.write(data)
-                    bar.update(size)
-                bar.finish()
+                    if bar is not None:
+                        bar.update(size)
+                if bar is not None:
+                    bar.finish()
             except requests.exceptions.RequestException:
                 if exceptions:
                     raise
@@ -133,9 +244,125 @@ def download(url, dest_path, config, exceptions=True):
                     return None
             else:
                 print(f'  {in_file_name} done.')
+        os.replace(part_path, dest_path)
+        if database_dir is not None:
+            add_checksum(database_dir, dest_path, sha.hexdigest())
     return dest_path
 
 
+class DownloadManager:
+    """
+    A manager for downloading many files concurrently, sharing a pool of
+    connections.  Downloads are queued with
+    :py:meth:`compass.io.DownloadManager.add` and performed with
+    :py:meth:`compass.io.DownloadManager.download_all`.
+
+    Attributes
+    ----------
+    threads : int
+        The number of files to download at the same time
+
+    downloads : dict
+        The queued downloads, with the absolute destination paths as keys and
+        the URL, config options and database directory for each download as
+        values
+    """
+
+    def __init__(self, threads=4):
+        """
+        Create a new download manager
+
+        Parameters
+        ----------
+        threads : int, optional
+            The number of files to download at the same time
+        """
+        self.threads = threads
+        self.downloads = dict()
+        self._callbacks = list()
+
+    def add(self, url, dest_path, config, database_dir=None):
+        """
+        Queue a file to be downloaded (if it has not already been queued)
+
+        Parameters
+        ----------
+        url : str
+            The URL (including file name) to download
+
+        dest_path : str
+            The path (including file name) where the downloaded file should be
+            saved
+
+        config : configparser.ConfigParser
+            Configuration options for the download
+
+        database_dir : str, optional
+            The directory of the database that ``dest_path`` is in, if any,
+            used to verify the file if it already exists
+
+        Returns
+        -------
+        dest_path : str
+            The absolute path where the file will be downloaded
+        """
+        dest_path = os.path.abspath(dest_path)
+        if dest_path not in self.downloads:
+            self.downloads[dest_path] = (url, config, database_dir)
+        return dest_path
+
+    def add_callback(self, callback, *args):
+        """
+        Add a function to call after all downloads have completed, e.g. to
+        fix permissions on the directories where files were downloaded
+
+        Parameters
+        ----------
+        callback : function
+            The function to call
+
+        args : list
+            The arguments to the function
+        """
+        self._callbacks.append((callback, args))
+
+    def download_all(self):
+        """
+        Download all the queued files (raising an exception if any of the
+        downloads fails) and then call any callbacks.  Files that already
+        exist in a database are verified against their checksums
+        concurrently, as part of the same process.
+        """
+        downloads = self.downloads
+        self.downloads = dict()
+        if len(downloads) > 0:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=self.threads, pool_maxsize=self.threads)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+
+            with ThreadPoolExecutor(max_workers=self.threads) as executor:
+                futures = list()
+                for dest_path, (url, config, database_dir) in \
+                        downloads.items():
+                    futures.append(executor.submit(
+                        download, url, dest_path, config, session=session,
+                        progress=False, database_dir=database_dir))
+                # raise the first exception (if any) once all downloads have
+                # finished
+                wait(futures)
+                for future in futures:
+                    future.result()
+
+            session.close()
+
+        callbacks = self._callbacks
+        self._callbacks = list()
+        for callback, args in callbacks:
+            callback(*args)
+
+
 def symlink(target, link_name, overwrite=True):
     """
     From https://stackoverflow.com/a/55742015/7728169
@@ -188,6 +415,155 @@ def symlink(target, link_name, overwrite=True):
         raise
 
 
+def get_file_hash(filename):
+    """
+    Compute the SHA-256 hash of the contents of a file.  The hash is reused if
+    it has already been computed and the file's size and modification time
+    haven't changed since then.
+
+    Parameters
+    ----------
+    filename : str
+        The file to hash (symlinks are followed)
+
+    Returns
+    -------
+    file_hash : str
+        The hash as a hexadecimal string
+    """
+    real_path = os.path.realpath(filename)
+    file_stat = os.stat(real_path)
+    key = (real_path, file_stat.st_size, file_stat.st_mtime_ns)
+    if key not in _file_hashes:
+        sha = hashlib.sha256()
+        with open(real_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(2**24), b''):
+                sha.update(chunk)
+        _file_hashes[key] = sha.hexdigest()
+    return _file_hashes[key]
+
+
+def read_checksums(database_dir):
+    """
+    Read the manifest of SHA-256 checksums for the files in a database
+
+    Parameters
+    ----------
+    database_dir : str
+        The directory of the database
+
+    Returns
+    -------
+    checksums : dict
+        The relative paths of files within the database as keys and
+        dictionaries with the ``sha256`` checksum, the ``size`` and the
+        modification time (``mtime_ns``) of the file when it was last
+        verified as values.  The dictionary is empty if there is no manifest
+        yet.
+    """
+    filename = os.path.join(database_dir, _checksums_filename)
+    try:
+        with open(filename) as data_file:
+            return json.load(data_file)
+    except (OSError, ValueError):
+        return dict()
+
+
+def add_checksum(database_dir, filename, file_hash=None):
+    """
+    Add the SHA-256 checksum of a file to the manifest for its database,
+    stamping the file as verified at its current size and modification time
+
+    Parameters
+    ----------
+    database_dir : str
+        The directory of the database
+
+    filename : str
+        The file within the database
+
+    file_hash : str, optional
+        The checksum of the file, if it is already known (e.g. because it
+        was computed during download)
+    """
+    if file_hash is None:
+        file_hash = get_file_hash(filename)
+    file_stat = os.stat(filename)
+    relative = _get_database_path(database_dir, filename)
+    _update_checksums(database_dir, {relative: {
+        'sha256': file_hash,
+        'size': file_stat.st_size,
+        'mtime_ns': file_stat.st_mtime_ns}})
+
+
+def verify_database_file(database_dir, filename):
+    """
+    Verify a file in a database against its checksum in the database's
+    manifest.  The file is only hashed if its modification time has changed
+    since it was last verified, so unchanged files are verified quickly.
+
+    Parameters
+    ----------
+    database_dir : str
+        The directory of the database
+
+    filename : str
+        The file within the database
+
+    Returns
+    -------
+    verified : bool or None
+        Whether the file matches its checksum, or ``None`` if the manifest
+        has no checksum for the file
+    """
+    relative = _get_database_path(database_dir, filename)
+    entry = read_checksums(database_dir).get(relative)
+    if entry is None:
+        return None
+
+    file_stat = os.stat(filename)
+    if file_stat.st_size != entry['size']:
+        return False
+    if file_stat.st_mtime_ns == entry['mtime_ns']:
+        return True
+
+    if get_file_hash(filename) != entry['sha256']:
+        return False
+
+    # stamp the file as verified so we don't need to hash it again
+    entry = dict(entry)
+    entry['mtime_ns'] = file_stat.st_mtime_ns
+    _update_checksums(database_dir, {relative: entry})
+    return True
+
+
+def _get_database_path(database_dir, filename):
+    """ The path of a file relative to its database directory """
+    return os.path.relpath(os.path.abspath(filename),
+                           os.path.abspath(database_dir))
+
+
+def _update_checksums(database_dir, entries):
+    """
+    Update entries in the manifest of checksums for a database, writing to a
+    temporary file and renaming it so the manifest is never partially written
+    """
+    filename = os.path.join(database_dir, _checksums_filename)
+    with _checksums_lock:
+        checksums = read_checksums(database_dir)
+        checksums.update(entries)
+        try:
+            handle, temp_filename = tempfile.mkstemp(dir=database_dir,
+                                                     suffix='.json')
+            with os.fdopen(handle, 'w') as data_file:
+                json.dump(checksums, data_file, indent=4, sort_keys=True)
+            os.replace(temp_filename, filename)
+        except OSError:
+            # we may not have write access to the database, in which case
+            # we just can't update the manifest
+            print(f'Warning: could not update checksums in {filename}')
+
+
 # From https://stackoverflow.com/a/1094933/7728169
 def _sizeof_fmt(num, suffix='B'):
     """
@@ -2,10 +2,13 @@ import argparse
 import re
 import sys
 import os
+import glob
+import pickle
 from importlib import resources
 from importlib.resources import contents
 
 from compass.mpas_cores import get_mpas_cores
+from compass.dag import build_dag, get_levels
 
 
 def list_cases(test_expr=None, number=None, verbose=False):
@@ -110,6 +113,67 @@ def list_suites(cores=None, verbose=False):
                             print("\t* {}".format(test))
 
 
+def list_dag(test_expr=None, verbose=False):
+    """
+    List the dependencies between steps in the test suite(s) or test case
+    that have been set up in the current directory.  Steps are grouped into
+    levels, where the steps in each level only depend on steps in earlier
+    levels and so could run concurrently.
+
+    Parameters
+    ----------
+    test_expr : str, optional
+        A regular expression for the paths of steps to list
+
+    verbose : bool, optional
+        Whether to also list the inputs to each step that are not produced by
+        any other step
+    """
+    dags = dict()
+    if os.path.exists('dag.pickle'):
+        with open('dag.pickle', 'rb') as handle:
+            dags['test case'] = pickle.load(handle)
+    else:
+        for filename in sorted(glob.glob('*.pickle')):
+            with open(filename, 'rb') as handle:
+                test_suite = pickle.load(handle)
+            if not isinstance(test_suite, dict) or \
+                    'test_cases' not in test_suite:
+                # not a suite pickle (e.g. step.pickle in a step's work dir)
+                continue
+            if 'dag' in test_suite:
+                dag = test_suite['dag']
+            else:
+                # the suite was set up before the DAG was added
+                dag = build_dag(test_suite['test_cases'])
+            dags['suite {}'.format(test_suite['name'])] = dag
+
+    if len(dags) == 0:
+        raise OSError('No test-suite or test-case pickle files were found. '
+                      'Are you sure this is a compass suite or test-case '
+                      'work directory?')
+
+    for name, dag in dags.items():
+        print('Step dependencies in {}:'.format(name))
+        for index, level in enumerate(get_levels(dag)):
+            lines = list()
+            for step_path in level:
+                if test_expr is not None and \
+                        re.match(test_expr, step_path) is None:
+                    continue
+                node = dag[step_path]
+                lines.append('    {}'.format(step_path))
+                for dependency in node['dependencies']:
+                    lines.append('      <- {}'.format(dependency))
+                if verbose:
+                    for input_file in node['external_inputs']:
+                        lines.append('      <- (external) {}'.format(
+                            input_file))
+            if len(lines) > 0:
+                print('  level {}:'.format(index))
+                print('\n'.join(lines))
+
+
 def main():
     parser = argparse.ArgumentParser(
         description='List the available test cases or machines',
@@ -124,15 +188,23 @@ def main():
                         help="List supported machines (instead of test cases)")
     parser.add_argument("--suites", dest="suites", action="store_true",
                         help="List test suites (instead of test cases)")
+    parser.add_argument("--dag", dest="dag", action="store_true",
+                        help="List the dependencies between steps in the "
+                             "test suite or test case set up in the current "
+                             "directory (instead of test cases)")
     parser.add_argument("-v", "--verbose", dest="verbose", action="store_true",
                         help="List details of each test case, not just the "
                              "path.  When applied to suites, verbose lists "
-                             "the tests contained in each suite.")
+                             "the tests contained in each suite.  When "
+                             "applied to the DAG, verbose lists inputs not "
+                             "produced by any step.")
     args = parser.parse_args(sys.argv[2:])
     if args.machines:
         list_machines()
     elif args.suites:
         list_suites(verbose=args.verbose)
+    elif args.dag:
+        list_dag(test_expr=args.test_expr, verbose=args.verbose)
     else:
         list_cases(test_expr=args.test_expr, number=args.number,
                    verbose=args.verbose)
@@ -1,8 +1,13 @@
 import os
+import shutil
+import tempfile
+import numpy
 import xarray
 
 from mpas_tools.logging import check_call
 
+from compass.io import symlink, get_file_hash
+
 
 def run_model(step, update_pio=True, partition_graph=True,
               graph_file='graph.info', namelist=None, streams=None):
@@ -69,7 +74,11 @@ def run_model(step, update_pio=True, partition_graph=True,
 
 def partition(cores, config, logger, graph_file='graph.info'):
     """
-    Partition the domain for the requested number of cores
+    Partition the domain for the requested number of cores.  If the
+    ``partition_cache`` config option in the ``[parallel]`` section is set,
+    partitions are cached in that directory, keyed by a hash of the graph file
+    and the number of cores, and a cached partition is symlinked instead of
+    running the partitioning executable again.
 
     Parameters
     ----------
@@ -88,9 +97,43 @@ def partition(cores, config, logger, graph_file='graph.info'):
 
     """
     if cores > 1:
-        executable = config.get('parallel', 'partition_executable')
-        args = [executable, graph_file, '{}'.format(cores)]
-        check_call(args, logger)
+        part_file = '{}.part.{}'.format(graph_file, cores)
+        # the partition may be a symlink to a cached partition for a previous
+        # graph file, which the partitioning executable must not write through
+        if os.path.lexists(part_file):
+            os.remove(part_file)
+
+        cache_dir = None
+        if config.has_option('parallel', 'partition_cache'):
+            cache_dir = config.get('parallel', 'partition_cache')
+        if cache_dir is None or cache_dir == '':
+            _run_partition(cores, config, logger, graph_file)
+            return
+
+        graph_hash = get_file_hash(graph_file)
+        cached_file = os.path.join(os.path.abspath(cache_dir), graph_hash[0:2],
+                                   graph_hash, 'graph.info.part.{}'.format(
+                                       cores))
+        if os.path.exists(cached_file):
+            logger.info('Using cached partition {}'.format(cached_file))
+            symlink(cached_file, part_file)
+            return
+
+        _run_partition(cores, config, logger, graph_file)
+
+        # copy the partition to a temporary file and rename it, so other
+        # processes never see a partial file.  Cached partitions are read-only
+        # so they can't be modified through a symlink
+        directory = os.path.dirname(cached_file)
+        try:
+            os.makedirs(directory)
+        except OSError:
+            pass
+        with tempfile.NamedTemporaryFile(dir=directory, delete=False) as f:
+            temp_file = f.name
+        shutil.copyfile(part_file, temp_file)
+        os.chmod(temp_file, 0o444)
+        os.replace(temp_file, cached_file)
 
 
 def make_graph_file(mesh_filename, graph_filename='graph.info',
@@ -119,36 +162,94 @@ def make_graph_file(mesh_filename, graph_filename='graph.info',
         nEdgesOnCell = ds.nEdgesOnCell.values
         cellsOnCell = ds.cellsOnCell.values - 1
         if weight_field is not None:
-            if weight_field in ds:
+            if weight_field not in ds:
                 raise ValueError('weight_field {} not found in {}'.format(
                     weight_field, mesh_filename))
             weights = ds[weight_field].values
         else:
             weights = None
 
-    nEdges = 0
-    for i in range(nCells):
-        for j in range(nEdgesOnCell[i]):
-            if cellsOnCell[i][j] != -1:
-                nEdges = nEdges + 1
+    maxEdges = cellsOnCell.shape[1]
+    # neighbors are valid if they are within nEdgesOnCell and not missing
+    neighbors_mask = numpy.logical_and(
+        numpy.arange(maxEdges)[numpy.newaxis, :] <
+        nEdgesOnCell[:, numpy.newaxis],
+        cellsOnCell >= 0)
 
-    nEdges = nEdges/2
+    nEdges = int(numpy.count_nonzero(neighbors_mask))
 
-    with open(graph_filename, 'w+') as graph:
-        if weights is None:
-            graph.write('{} {}\n'.format(nCells, nEdges))
+    nEdges = nEdges/2
 
-            for i in range(nCells):
-                for j in range(0, nEdgesOnCell[i]):
-                    if cellsOnCell[i][j] >= 0:
-                        graph.write('{} '.format(cellsOnCell[i][j]+1))
-                graph.write('\n')
-        else:
-            graph.write('{} {} 010\n'.format(nCells, nEdges))
-
-            for i in range(nCells):
-                graph.write('{} '.format(int(weights[i])))
-                for j in range(0, nEdgesOnCell[i]):
-                    if cellsOnCell[i][j] >= 0:
-                        graph.write('{} '.format(cellsOnCell[i][j] + 1))
-                graph.write('\n')
+    # each line is the (optional) weight of the cell followed by the 1-based
+    # indices of its neighbors
+    values = cellsOnCell + 1
+    mask = neighbors_mask
+    if weights is None:
+        header = '{} {}\n'.format(nCells, nEdges)
+    else:
+        header = '{} {} 010\n'.format(nCells, nEdges)
+        weights = weights.astype(int)
+        values = numpy.concatenate(
+            (weights[:, numpy.newaxis], values), axis=1)
+        mask = numpy.concatenate(
+            (numpy.ones((nCells, 1), bool), mask), axis=1)
+
+    # write the lines in chunks of cells to limit the memory used for the
+    # text
+    chunk_size = 100000
+    with open(graph_filename, 'wb+') as graph:
+        graph.write(header.encode('ascii'))
+        for start in range(0, nCells, chunk_size):
+            end = min(start + chunk_size, nCells)
+            graph.write(_format_graph_lines(values[start:end, :],
+                                            mask[start:end, :]))
+
+
+def _format_graph_lines(values, mask):
+    """
+    Format the lines of a graph file as ASCII text, each with the
+    non-negative integers in the corresponding row of ``values`` where
+    ``mask`` is ``True``, each followed by a space
+    """
+    counts = numpy.count_nonzero(mask, axis=1)
+    values = values[mask].astype(numpy.int64)
+    if numpy.any(values < 0):
+        raise ValueError('Only non-negative values can be written to a graph '
+                         'file.')
+
+    # the number of decimal digits in each value
+    digits = numpy.ones(values.shape, dtype=numpy.int64)
+    power = 10
+    while numpy.any(values >= power):
+        digits += values >= power
+        power *= 10
+
+    # each line is made up of the values (each followed by a space) and then a
+    # newline
+    line_ends = numpy.cumsum(counts + 1) - 1
+    is_value = numpy.ones(line_ends[-1] + 1, bool)
+    is_value[line_ends] = False
+    lengths = numpy.ones(is_value.shape, dtype=numpy.int64)
+    lengths[is_value] = digits + 1
+    starts = numpy.cumsum(lengths) - lengths
+
+    text = numpy.full(numpy.sum(lengths), ord(' '), dtype=numpy.uint8)
+    text[starts[line_ends]] = ord('\n')
+
+    # fill in the digits from last to first
+    value_ends = starts[is_value] + digits - 1
+    remainder = values
+    for index in range(int(numpy.amax(digits, initial=1))):
+        has_digit = digits > index
+        text[value_ends[has_digit] - index] = \
+            ord('0') + remainder[has_digit] % 10
+        remainder = remainder // 10
+
+    return text.tobytes()
+
+
+def _run_partition(cores, config, logger, graph_file):
+    """ Run the partitioning executable """
+    executable = config.get('parallel', 'partition_executable')
+    args = [executable, graph_file, '{}'.format(cores)]
+    check_call(args, logger)
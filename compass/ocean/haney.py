@@ -1,9 +1,13 @@
+import os
+
 import xarray
 import numpy
+import netCDF4
 import progressbar
 
 
-def compute_haney_number(ds_mesh, layer_thickness, ssh, show_progress=False):
+def compute_haney_number(ds_mesh, layer_thickness, ssh, show_progress=False,
+                         include_edges=True, time_chunk=1):
     """
     Compute the Haney number rx1 for each edge, and interpolate it to cells
 
@@ -21,10 +25,18 @@ def compute_haney_number(ds_mesh, layer_thickness, ssh, show_progress=False):
     show_progress : bool, optional
         Whether to show a progress bar
 
+    include_edges : bool, optional
+        Whether to return the Haney number on edges.  If ``False``, only the
+        (much smaller) Haney number on cells is kept in memory.
+
+    time_chunk : int, optional
+        The number of time indices to compute at once
+
     Returns
     -------
     haney_edge : xarray.DataArray
-        A data array with the Haney number at edges and layer interfaces
+        A data array with the Haney number at edges and layer interfaces, or
+        ``None`` if ``include_edges = False``
 
     haney_cell : xarray.DataArray
         A data array with the Haney number interpolated to cell centers and
@@ -34,16 +46,123 @@ def compute_haney_number(ds_mesh, layer_thickness, ssh, show_progress=False):
     nEdges = ds_mesh.sizes['nEdges']
     nCells = ds_mesh.sizes['nCells']
     nVertLevels = ds_mesh.sizes['nVertLevels']
-    if 'Time' in layer_thickness.dims:
+    has_time = 'Time' in layer_thickness.dims
+    if has_time:
         nTime = layer_thickness.sizes['Time']
     else:
         nTime = 1
         show_progress = False
 
-    cellsOnEdge = ds_mesh.cellsOnEdge - 1
-    minLevelCell = ds_mesh.minLevelCell - 1
-    maxLevelCell = ds_mesh.maxLevelCell - 1
-    edgesOnCell = ds_mesh.edgesOnCell - 1
+    if include_edges:
+        haney_edge = numpy.zeros((nTime, nEdges, nVertLevels))
+    else:
+        haney_edge = None
+    haney_cell = numpy.zeros((nTime, nCells, nVertLevels))
+
+    for t_start, t_end, edge_chunk, cell_chunk in _compute_haney_chunks(
+            ds_mesh, layer_thickness, ssh, include_edges, time_chunk,
+            t_start=0, show_progress=show_progress):
+        if include_edges:
+            haney_edge[t_start:t_end, :, :] = edge_chunk
+        haney_cell[t_start:t_end, :, :] = cell_chunk
+
+    if include_edges:
+        haney_edge = xarray.DataArray(haney_edge,
+                                      dims=('Time', 'nEdges', 'nVertLevels'))
+    haney_cell = xarray.DataArray(haney_cell,
+                                  dims=('Time', 'nCells', 'nVertLevels'))
+
+    if not has_time:
+        # don't need the time dimension
+        if include_edges:
+            haney_edge = haney_edge.isel(Time=0)
+        haney_cell = haney_cell.isel(Time=0)
+
+    return haney_edge, haney_cell
+
+
+def write_haney_number(ds_mesh, layer_thickness, ssh, out_filename,
+                       ds_time=None, show_progress=False, include_edges=True,
+                       time_chunk=1):
+    """
+    Compute the Haney number rx1 for each edge, interpolate it to cells and
+    write both to a netCDF file one chunk of time indices at a time, so the
+    full time series never needs to be held in memory.  If the file already
+    exists, only time indices that are not yet in the file are computed and
+    appended to it.
+
+    Parameters
+    ----------
+    ds_mesh : xarray.Dataset
+        A dataset with the MPAS-Ocean mesh
+
+    layer_thickness : xarray.DataArray
+        A data array with layer thicknesses, which must have a ``Time``
+        dimension
+
+    ssh : xarray.DataArray
+        A data array with sea surface height
+
+    out_filename : str
+        The netCDF file to write ``haneyEdge`` and ``haneyCell`` to
+
+    ds_time : xarray.Dataset, optional
+        A dataset with variables that have only the ``Time`` dimension (e.g.
+        ``xtime_startMonthly``) to write to the file along with the Haney
+        number
+
+    show_progress : bool, optional
+        Whether to show a progress bar
+
+    include_edges : bool, optional
+        Whether to write out the Haney number on edges, or only on cells
+
+    time_chunk : int, optional
+        The number of time indices to compute and write at once
+    """
+    if ds_time is None:
+        ds_time = xarray.Dataset()
+
+    t_start = _open_haney_file(out_filename, ds_mesh, ds_time, include_edges)
+
+    for t_start, t_end, edge_chunk, cell_chunk in _compute_haney_chunks(
+            ds_mesh, layer_thickness, ssh, include_edges, time_chunk,
+            t_start=t_start, show_progress=show_progress):
+        with netCDF4.Dataset(out_filename, 'a') as nc_file:
+            if include_edges:
+                nc_file.variables['haneyEdge'][t_start:t_end, :, :] = \
+                    numpy.ma.masked_invalid(edge_chunk)
+            nc_file.variables['haneyCell'][t_start:t_end, :, :] = \
+                numpy.ma.masked_invalid(cell_chunk)
+            for var_name in ds_time.data_vars:
+                values = ds_time[var_name].isel(
+                    Time=slice(t_start, t_end)).values
+                if values.dtype.kind in ['S', 'U']:
+                    values = values.astype('U64')
+                nc_file.variables[var_name][t_start:t_end] = values
+
+
+def _compute_haney_chunks(ds_mesh, layer_thickness, ssh, include_edges,
+                          time_chunk, t_start, show_progress):
+    """
+    Compute the Haney number on edges and cells for chunks of time indices,
+    starting at ``t_start``, yielding the range of time indices and the
+    Haney number on edges (or ``None``) and cells for each chunk
+    """
+
+    nEdges = ds_mesh.sizes['nEdges']
+    nCells = ds_mesh.sizes['nCells']
+    nVertLevels = ds_mesh.sizes['nVertLevels']
+    if 'Time' in layer_thickness.dims:
+        nTime = layer_thickness.sizes['Time']
+    else:
+        nTime = 1
+
+    cellsOnEdge = ds_mesh.cellsOnEdge.values - 1
+    minLevelCell = ds_mesh.minLevelCell.values - 1
+    maxLevelCell = ds_mesh.maxLevelCell.values - 1
+    edgesOnCell = ds_mesh.edgesOnCell.values - 1
+    bottom_depth = ds_mesh.bottomDepth.values
 
     internal_mask = numpy.logical_and(cellsOnEdge[:, 0] >= 0,
                                       cellsOnEdge[:, 1] >= 1)
@@ -61,25 +180,19 @@ def compute_haney_number(ds_mesh, layer_thickness, ssh, show_progress=False):
                             maxLevelCell[cell1] < maxLevelEdge)
     maxLevelEdge[mask] = maxLevelCell[cell1][mask]
 
-    vert_index = \
-        xarray.DataArray.from_dict({'dims': ('nVertLevels',),
-                                    'data': numpy.arange(nVertLevels)})
+    vert_index = numpy.arange(nVertLevels)
 
-    cell_mask = numpy.logical_and(vert_index >= minLevelCell,
-                                  vert_index <= maxLevelCell)
+    cell_mask = numpy.logical_and(
+        vert_index >= minLevelCell[:, numpy.newaxis],
+        vert_index <= maxLevelCell[:, numpy.newaxis])
 
-    edge_mask = numpy.logical_and(vert_index >= minLevelEdge,
-                                  vert_index <= maxLevelEdge)
+    edge_mask = numpy.logical_and(
+        vert_index >= minLevelEdge[:, numpy.newaxis],
+        vert_index <= maxLevelEdge[:, numpy.newaxis])
 
     cell0 = cell0[internal_mask]
     cell1 = cell1[internal_mask]
 
-    haney_edge = xarray.DataArray(numpy.zeros((nTime, nEdges, nVertLevels)),
-                                  dims=('Time', 'nEdges', 'nVertLevels'))
-
-    haney_cell = xarray.DataArray(numpy.zeros((nTime, nCells, nVertLevels)),
-                                  dims=('Time', 'nCells', 'nVertLevels'))
-
     if show_progress:
         widgets = ['Haney number: ', progressbar.Percentage(), ' ',
                    progressbar.Bar(), ' ', progressbar.ETA()]
@@ -88,54 +201,127 @@ def compute_haney_number(ds_mesh, layer_thickness, ssh, show_progress=False):
     else:
         bar = None
 
-    for tIndex in range(nTime):
-
-        z_mid = numpy.zeros((nCells, nVertLevels+1))
-        if 'Time' in layer_thickness.dims:
-            local_thickness = layer_thickness.isel(Time=tIndex)
-        else:
-            local_thickness = layer_thickness
-        local_thickness = local_thickness.where(cell_mask, 0.).values
-        if 'Time' in ssh.dims:
-            local_ssh = ssh.isel(Time=tIndex)
-        else:
-            local_ssh = ssh
-        local_ssh = local_ssh.values
-        bottom_depth = ds_mesh.bottomDepth.values
-        z_bot = -bottom_depth
-        for zIndex in range(nVertLevels-1, -1, -1):
-            z_mid[:, zIndex+1] = z_bot + 0.5*local_thickness[:, zIndex]
-            z_bot += local_thickness[:, zIndex]
-        z_mid[:, 0] = local_ssh
-
-        dz_vert1 = z_mid[cell0, 0:-1] - z_mid[cell0, 1:]
-        dz_vert2 = z_mid[cell1, 0:-1] - z_mid[cell1, 1:]
-        dz_edge = z_mid[cell1, :] - z_mid[cell0, :]
-
-        dz_vert1[:, 0] *= 2
-        dz_vert2[:, 0] *= 2
-
-        rx1 = numpy.zeros((nEdges, nVertLevels))
+    for chunk_start in range(t_start, nTime, time_chunk):
+        chunk_end = min(chunk_start + time_chunk, nTime)
+        local_thickness = _get_time_chunk(
+            layer_thickness, chunk_start, chunk_end,
+            ('Time', 'nCells', 'nVertLevels'))
+        local_ssh = _get_time_chunk(ssh, chunk_start, chunk_end,
+                                    ('Time', 'nCells'))
+        nChunk = local_thickness.shape[0]
+
+        local_thickness = numpy.where(cell_mask, local_thickness, 0.)
+
+        # the elevation of the bottom of each layer, found by summing the
+        # thicknesses of the layers below it from the sea floor up
+        z_bot = numpy.zeros((nChunk, nCells, nVertLevels))
+        z_bot[:, :, 0] = -bottom_depth
+        z_bot[:, :, 1:] = local_thickness[:, :, :0:-1]
+        z_bot = numpy.cumsum(z_bot, axis=2)[:, :, ::-1]
+
+        z_mid = numpy.zeros((nChunk, nCells, nVertLevels+1))
+        z_mid[:, :, 0] = local_ssh
+        z_mid[:, :, 1:] = z_bot + 0.5*local_thickness
+
+        z_mid0 = z_mid[:, cell0, :]
+        z_mid1 = z_mid[:, cell1, :]
+        dz_vert1 = z_mid0[:, :, 0:-1] - z_mid0[:, :, 1:]
+        dz_vert2 = z_mid1[:, :, 0:-1] - z_mid1[:, :, 1:]
+        dz_edge = z_mid1 - z_mid0
+
+        dz_vert1[:, :, 0] *= 2
+        dz_vert2[:, :, 0] *= 2
+
+        rx1 = numpy.zeros((nChunk, nEdges, nVertLevels))
 
         epsilon = 1e-10
         denom = dz_vert1 + dz_vert2
         denom[numpy.abs(denom) < epsilon] = epsilon
 
-        rx1[internal_mask, :] = (numpy.abs(dz_edge[:, 0:-1] + dz_edge[:, 1:]) /
-                                 denom)
+        rx1[:, internal_mask, :] = \
+            numpy.abs(dz_edge[:, :, 0:-1] + dz_edge[:, :, 1:]) / denom
+
+        rx1 = numpy.where(edge_mask, rx1, numpy.nan)
+
+        # the maximum over the edges of each cell, ignoring invalid edges
+        haney_cell = rx1[:, edgesOnCell[:, 0], :]
+        for iEdge in range(1, edgesOnCell.shape[1]):
+            haney_cell = numpy.fmax(haney_cell,
+                                    rx1[:, edgesOnCell[:, iEdge], :])
+
+        if not include_edges:
+            rx1 = None
+
+        yield chunk_start, chunk_end, rx1, haney_cell
 
-        haney_edge[tIndex, :, :] = rx1
-        haney_edge[tIndex, :, :] = haney_edge[tIndex, :, :].where(edge_mask)
-        haney_cell[tIndex, :, :] = haney_edge[tIndex, edgesOnCell, :].max(
-            dim='maxEdges')
         if show_progress:
-            bar.update(tIndex+1)
+            bar.update(chunk_end)
     if show_progress:
         bar.finish()
 
-    if 'Time' not in layer_thickness.dims:
-        # don't need the time dimension
-        haney_edge = haney_edge.isel(Time=0)
-        haney_cell = haney_cell.isel(Time=0)
 
-    return haney_edge, haney_cell
+def _get_time_chunk(da, t_start, t_end, dims):
+    """
+    Get the values of a data array for a chunk of time indices as a numpy
+    array with the given dimensions
+    """
+    if 'Time' in da.dims:
+        da = da.isel(Time=slice(t_start, t_end))
+    else:
+        da = da.expand_dims(dim='Time')
+    return da.transpose(*dims).values
+
+
+def _open_haney_file(out_filename, ds_mesh, ds_time, include_edges):
+    """
+    Open the Haney number file, creating it if it doesn't exist (or if it
+    can't be appended to), and return the number of time indices already in
+    the file
+    """
+    dims = {'nCells': ds_mesh.sizes['nCells'],
+            'nEdges': ds_mesh.sizes['nEdges'],
+            'nVertLevels': ds_mesh.sizes['nVertLevels']}
+    var_names = ['haneyCell'] + list(ds_time.data_vars)
+    if include_edges:
+        var_names.append('haneyEdge')
+
+    if os.path.exists(out_filename):
+        with netCDF4.Dataset(out_filename, 'r') as nc_file:
+            compatible = 'Time' in nc_file.dimensions and \
+                nc_file.dimensions['Time'].isunlimited() and \
+                all([dim in nc_file.dimensions and
+                     len(nc_file.dimensions[dim]) == size
+                     for dim, size in dims.items()]) and \
+                all([var_name in nc_file.variables
+                     for var_name in var_names])
+            if compatible:
+                return len(nc_file.dimensions['Time'])
+        # a file that we can't append to, so start over
+        os.remove(out_filename)
+
+    with netCDF4.Dataset(out_filename, 'w', format='NETCDF4') as nc_file:
+        nc_file.createDimension('Time', None)
+        for dim, size in dims.items():
+            nc_file.createDimension(dim, size)
+        for var_name in ds_time.data_vars:
+            dtype = ds_time[var_name].dtype
+            if dtype.kind in ['S', 'U']:
+                if 'StrLen' not in nc_file.dimensions:
+                    nc_file.createDimension('StrLen', 64)
+                var = nc_file.createVariable(var_name, 'S1',
+                                             ('Time', 'StrLen'))
+                # read and write strings rather than arrays of characters
+                var._Encoding = 'utf-8'
+            else:
+                nc_file.createVariable(var_name, dtype, ('Time',))
+
+        for var_name, dim, location in [('haneyEdge', 'nEdges', 'edges'),
+                                        ('haneyCell', 'nCells', 'cells')]:
+            if var_name not in var_names:
+                continue
+            var = nc_file.createVariable(
+                var_name, 'f8', ('Time', dim, 'nVertLevels'),
+                fill_value=netCDF4.default_fillvals['f8'])
+            var.units = 'unitless'
+            var.description = 'Haney number on {}'.format(location)
+    return 0
@@ -1,11 +1,13 @@
+import os
+import csv
 import numpy
-import xarray
 import shutil
+import xarray
+import netCDF4
 
 from mpas_tools.cime.constants import constants
 from mpas_tools.io import write_netcdf
 
-from compass.io import symlink
 from compass.model import partition, run_model
 
 
@@ -39,11 +41,16 @@ def compute_land_ice_pressure_and_draft(ssh, modify_mask, ref_density):
     return landIcePressure, landIceDraft
 
 
-def adjust_ssh(variable, iteration_count, step):
+def adjust_ssh(variable, iteration_count, step, tolerance=0.,
+               tolerance_metric='max'):
     """
     Adjust the sea surface height or land-ice pressure to be dynamically
     consistent with one another.  A series of short model runs are performed,
-    each with
+    each with the initial condition from a working copy of
+    ``adjusting_init0.nc``, in which only the adjusted variables are updated
+    in place after each run.  The maximum and root-mean-square changes in
+    SSH from each iteration are written to ``ssh_adjustment.csv`` and, once
+    the iterations are done, to ``ssh_adjustment.nc``.
 
     Parameters
     ----------
@@ -51,124 +58,260 @@ def adjust_ssh(variable, iteration_count, step):
         The variable to adjust
 
     iteration_count : int
-        The number of iterations of adjustment
+        The maximum number of iterations of adjustment
 
     step : compass.Step
         the step for performing SSH or land-ice pressure adjustment
+
+    tolerance : float, optional
+        If positive, the iterations stop early once the change in SSH (m)
+        measured by ``tolerance_metric`` is below this tolerance
+
+    tolerance_metric : {'max', 'rms'}, optional
+        Whether the maximum or the root-mean-square of the absolute change in
+        SSH over cells where the land-ice pressure can be modified is compared
+        with ``tolerance``
     """
     cores = step.cores
     config = step.config
     logger = step.logger
-    out_filename = None
 
     if variable not in ['ssh', 'landIcePressure']:
         raise ValueError("Unknown variable to modify: {}".format(variable))
 
+    if tolerance_metric not in ['max', 'rms']:
+        raise ValueError("Unknown tolerance metric: {}".format(
+            tolerance_metric))
+
     step.update_namelist_pio('namelist.ocean')
+    # the partition is the same for all iterations
     partition(cores, config, logger)
 
-    for iterIndex in range(iteration_count):
-        logger.info(" * Iteration {}/{}".format(iterIndex + 1,
-                                                iteration_count))
+    # the model reads the initial condition from a working copy, which is
+    # updated in place after each iteration
+    init_filename = 'adjusting_init.nc'
+    if os.path.lexists(init_filename):
+        # make sure we don't write into the file the old symlink points to
+        os.remove(init_filename)
+    shutil.copyfile('adjusting_init0.nc', init_filename)
+
+    with netCDF4.Dataset(init_filename, 'r') as ds:
+        ds.set_auto_mask(False)
+        mesh = _read_adjustment_mesh(ds)
 
-        in_filename = 'adjusting_init{}.nc'.format(iterIndex)
-        out_filename = 'adjusting_init{}.nc'.format(iterIndex+1)
-        symlink(in_filename, 'adjusting_init.nc')
+    history = list()
+    converged = False
+    with open('ssh_adjustment.csv', 'w') as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(_get_history_columns(mesh))
 
-        logger.info("   * Running forward model")
-        run_model(step, update_pio=False, partition_graph=False)
-        logger.info("   - Complete")
+        for iterIndex in range(iteration_count):
+            logger.info(" * Iteration {}/{}".format(iterIndex + 1,
+                                                    iteration_count))
 
-        logger.info("   * Updating SSH or land-ice pressure")
+            logger.info("   * Running forward model")
+            run_model(step, update_pio=False, partition_graph=False)
+            logger.info("   - Complete")
 
-        with xarray.open_dataset(in_filename) as ds:
+            logger.info("   * Updating SSH or land-ice pressure")
 
-            # keep the data set with Time for output
-            ds_out = ds
+            with netCDF4.Dataset('output_ssh.nc', 'r') as ds_ssh:
+                ds_ssh.set_auto_mask(False)
+                # get the last time entry
+                finalSSH = ds_ssh.variables['ssh'][-1, :]
+                density = ds_ssh.variables['density'][-1, :, :]
+            topDensity = numpy.take_along_axis(
+                density, mesh['minLevelCell'][:, numpy.newaxis], axis=1)[:, 0]
+
+            with netCDF4.Dataset(init_filename, 'r+') as ds:
+                ds.set_auto_mask(False)
+                initSSH = _read_time_slice(ds, 'ssh')
+                landIcePressure = _read_time_slice(ds, 'landIcePressure')
+
+                deltaSSH = mesh['mask'] * (finalSSH - initSSH)
+
+                # then, modify the SSH or land-ice pressure
+                if variable == 'ssh':
+                    _write_time_slice(ds, 'ssh', finalSSH)
+                    # also update the landIceDraft variable, which will be
+                    # used to compensate for the SSH due to land-ice pressure
+                    # when computing sea-surface tilt
+                    if 'landIceDraft' not in ds.variables:
+                        ds.createVariable('landIceDraft', 'f8',
+                                          ds.variables['ssh'].dimensions)
+                    _write_time_slice(ds, 'landIceDraft', finalSSH)
+                    # we also need to stretch layerThickness to be compatible
+                    # with the new SSH
+                    stretch = ((finalSSH + mesh['bottomDepth']) /
+                               (initSSH + mesh['bottomDepth']))
+                    layerThickness = _read_time_slice(ds, 'layerThickness')
+                    _write_time_slice(ds, 'layerThickness',
+                                      layerThickness*stretch[:, numpy.newaxis])
+                else:
+                    # Moving the SSH up or down by deltaSSH would change the
+                    # land-ice pressure by density(SSH)*g*deltaSSH. If
+                    # deltaSSH is positive (moving up), it means the land-ice
+                    # pressure is too small and if deltaSSH is negative
+                    # (moving down), it means land-ice pressure is too large,
+                    # the sign of the second term makes sense.
+                    gravity = constants['SHR_CONST_G']
+                    deltaLandIcePressure = topDensity * gravity * deltaSSH
+
+                    landIcePressure = numpy.maximum(
+                        0.0, landIcePressure + deltaLandIcePressure)
+
+                    _write_time_slice(ds, 'landIcePressure', landIcePressure)
+
+                    finalSSH = initSSH
+
+            record = _log_iteration(logger, iterIndex, mesh, deltaSSH,
+                                    finalSSH, landIcePressure)
+            history.append(record)
+            writer.writerow(record)
+            csv_file.flush()
+
+            logger.info("   - Complete\n")
+
+            if tolerance > 0.:
+                deltaSSHRms, deltaSSHAbsMax = record[2:4]
+                if tolerance_metric == 'max':
+                    deltaSSHNorm = deltaSSHAbsMax
+                else:
+                    deltaSSHNorm = deltaSSHRms
+                if deltaSSHNorm < tolerance:
+                    converged = True
+                    logger.info(" * Converged after {} iterations: "
+                                "deltaSSH {} {:g} < {:g}\n".format(
+                                    iterIndex + 1, tolerance_metric,
+                                    deltaSSHNorm, tolerance))
+                    break
 
-            ds = ds.isel(Time=0)
+    _write_history(history, mesh, tolerance, tolerance_metric, converged)
 
-            on_a_sphere = ds.attrs['on_a_sphere'].lower() == 'yes'
+    os.replace(init_filename, 'adjusted_init.nc')
 
-            initSSH = ds.ssh
-            if 'minLevelCell' in ds:
-                minLevelCell = ds.minLevelCell-1
-            else:
-                minLevelCell = xarray.zeros_like(ds.maxLevelCell)
 
-            with xarray.open_dataset('output_ssh.nc') as ds_ssh:
-                # get the last time entry
-                ds_ssh = ds_ssh.isel(Time=ds_ssh.sizes['Time'] - 1)
-                finalSSH = ds_ssh.ssh
-                topDensity = ds_ssh.density.isel(nVertLevels=minLevelCell)
-
-            mask = numpy.logical_and(ds.maxLevelCell > 0,
-                                     ds.modifyLandIcePressureMask == 1)
-
-            deltaSSH = mask * (finalSSH - initSSH)
-
-            # then, modify the SSH or land-ice pressure
-            if variable == 'ssh':
-                ssh = finalSSH.expand_dims(dim='Time', axis=0)
-                ds_out['ssh'] = ssh
-                # also update the landIceDraft variable, which will be used to
-                # compensate for the SSH due to land-ice pressure when
-                # computing sea-surface tilt
-                ds_out['landIceDraft'] = ssh
-                # we also need to stretch layerThickness to be compatible with
-                # the new SSH
-                stretch = ((finalSSH + ds.bottomDepth) /
-                           (initSSH + ds.bottomDepth))
-                ds_out['layerThickness'] = ds_out.layerThickness * stretch
-                landIcePressure = ds.landIcePressure.values
-            else:
-                # Moving the SSH up or down by deltaSSH would change the
-                # land-ice pressure by density(SSH)*g*deltaSSH. If deltaSSH is
-                # positive (moving up), it means the land-ice pressure is too
-                # small and if deltaSSH is negative (moving down), it means
-                # land-ice pressure is too large, the sign of the second term
-                # makes sense.
-                gravity = constants['SHR_CONST_G']
-                deltaLandIcePressure = topDensity * gravity * deltaSSH
-
-                landIcePressure = numpy.maximum(
-                    0.0, ds.landIcePressure + deltaLandIcePressure)
-
-                ds_out['landIcePressure'] = \
-                    landIcePressure.expand_dims(dim='Time', axis=0)
-
-                finalSSH = initSSH
-
-            write_netcdf(ds_out, out_filename)
-
-            # Write the largest change in SSH and its lon/lat to a file
-            with open('maxDeltaSSH_{:03d}.log'.format(iterIndex), 'w') as \
-                    log_file:
-
-                mask = landIcePressure > 0.
-                iCell = numpy.abs(deltaSSH.where(mask)).argmax().values
-
-                ds_cell = ds.isel(nCells=iCell)
-
-                if on_a_sphere:
-                    coords = 'lon/lat: {:f} {:f}'.format(
-                        numpy.rad2deg(ds_cell.lonCell.values),
-                        numpy.rad2deg(ds_cell.latCell.values))
-                else:
-                    coords = 'x/y: {:f} {:f}'.format(
-                        1e-3 * ds_cell.xCell.values,
-                        1e-3 * ds_cell.yCell.values)
-                string = 'deltaSSHMax: {:g}, {}'.format(
-                    deltaSSH.isel(nCells=iCell).values, coords)
-                logger.info('     {}'.format(string))
-                log_file.write('{}\n'.format(string))
-                string = 'ssh: {:g}, landIcePressure: {:g}'.format(
-                    finalSSH.isel(nCells=iCell).values,
-                    landIcePressure.isel(nCells=iCell).values)
-                logger.info('     {}'.format(string))
-                log_file.write('{}\n'.format(string))
-
-        logger.info("   - Complete\n")
-
-    if out_filename is not None:
-        shutil.copy(out_filename, 'adjusted_init.nc')
+def _read_adjustment_mesh(ds):
+    """
+    Read the fields that don't change during SSH adjustment
+    """
+    mesh = dict()
+    if 'minLevelCell' in ds.variables:
+        mesh['minLevelCell'] = ds.variables['minLevelCell'][:] - 1
+    else:
+        mesh['minLevelCell'] = numpy.zeros(len(ds.dimensions['nCells']),
+                                           dtype=int)
+    maxLevelCell = ds.variables['maxLevelCell'][:]
+    modifyMask = _read_time_slice(ds, 'modifyLandIcePressureMask')
+    mesh['mask'] = numpy.logical_and(maxLevelCell > 0, modifyMask == 1)
+    mesh['bottomDepth'] = ds.variables['bottomDepth'][:]
+
+    on_a_sphere = ds.getncattr('on_a_sphere').lower() == 'yes'
+    if on_a_sphere:
+        mesh['coord_names'] = ('lon', 'lat')
+        mesh['coords'] = (numpy.rad2deg(ds.variables['lonCell'][:]),
+                          numpy.rad2deg(ds.variables['latCell'][:]))
+    else:
+        mesh['coord_names'] = ('x', 'y')
+        mesh['coords'] = (1e-3 * ds.variables['xCell'][:],
+                          1e-3 * ds.variables['yCell'][:])
+    return mesh
+
+
+def _get_history_columns(mesh):
+    """
+    The names of the columns in the history of SSH adjustment
+    """
+    return ['iteration', 'deltaSSHMax', 'deltaSSHRms', 'deltaSSHAbsMax',
+            'cellIndex', mesh['coord_names'][0], mesh['coord_names'][1],
+            'ssh', 'landIcePressure']
+
+
+def _log_iteration(logger, iterIndex, mesh, deltaSSH, finalSSH,
+                   landIcePressure):
+    """
+    Log the largest change in SSH and its location, and return it, the
+    root-mean-square and maximum absolute change in SSH over cells where the
+    land-ice pressure can be modified as a record in the history of SSH
+    adjustment
+    """
+    mask = landIcePressure > 0.
+    if numpy.any(mask):
+        iCell = numpy.argmax(numpy.where(mask, numpy.abs(deltaSSH), -1.))
+    else:
+        iCell = numpy.argmax(numpy.abs(deltaSSH))
+
+    deltaSSHMax = deltaSSH[iCell]
+    if numpy.any(mesh['mask']):
+        deltaSSHRms = numpy.sqrt(numpy.mean(deltaSSH[mesh['mask']]**2))
+        deltaSSHAbsMax = numpy.amax(numpy.abs(deltaSSH[mesh['mask']]))
+    else:
+        deltaSSHRms = 0.
+        deltaSSHAbsMax = 0.
+    coord0 = mesh['coords'][0][iCell]
+    coord1 = mesh['coords'][1][iCell]
+
+    string = 'deltaSSHMax: {:g}, {}/{}: {:f} {:f}'.format(
+        deltaSSHMax, mesh['coord_names'][0], mesh['coord_names'][1], coord0,
+        coord1)
+    logger.info('     {}'.format(string))
+    string = 'deltaSSHRms: {:g}, deltaSSHAbsMax: {:g}'.format(
+        deltaSSHRms, deltaSSHAbsMax)
+    logger.info('     {}'.format(string))
+    string = 'ssh: {:g}, landIcePressure: {:g}'.format(
+        finalSSH[iCell], landIcePressure[iCell])
+    logger.info('     {}'.format(string))
+
+    return [iterIndex + 1, deltaSSHMax, deltaSSHRms, deltaSSHAbsMax,
+            iCell + 1, coord0, coord1, finalSSH[iCell],
+            landIcePressure[iCell]]
+
+
+def _write_history(history, mesh, tolerance, tolerance_metric, converged):
+    """
+    Write the history of SSH adjustment to a netCDF file
+    """
+    columns = _get_history_columns(mesh)
+    if len(history) > 0:
+        values = list(zip(*history))
+    else:
+        values = [[] for _ in columns]
+
+    units = {'deltaSSHMax': 'm', 'deltaSSHRms': 'm', 'deltaSSHAbsMax': 'm',
+             'ssh': 'm', 'landIcePressure': 'Pa', 'lon': 'degrees',
+             'lat': 'degrees', 'x': 'km', 'y': 'km'}
+
+    ds = xarray.Dataset()
+    for column, column_values in zip(columns, values):
+        dtype = int if column in ['iteration', 'cellIndex'] else float
+        ds[column] = ('nIterations', numpy.array(column_values, dtype=dtype))
+        if column in units:
+            ds[column].attrs['units'] = units[column]
+    ds.attrs['tolerance'] = tolerance
+    ds.attrs['tolerance_metric'] = tolerance_metric
+    ds.attrs['converged'] = 'yes' if converged else 'no'
+    write_netcdf(ds, 'ssh_adjustment.nc')
+
+
+def _read_time_slice(ds, var_name):
+    """
+    Read the first time slice of a variable (or the whole variable if it has
+    no Time dimension) from a netCDF file
+    """
+    var = ds.variables[var_name]
+    if var.dimensions[0] == 'Time':
+        return var[0, ...]
+    else:
+        return var[...]
+
+
+def _write_time_slice(ds, var_name, values):
+    """
+    Write the first time slice of a variable (or the whole variable if it has
+    no Time dimension) to a netCDF file
+    """
+    var = ds.variables[var_name]
+    if var.dimensions[0] == 'Time':
+        var[0, ...] = values
+    else:
+        var[...] = values
@@ -1,3 +1,10 @@
+import os
+import shutil
+import hashlib
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
 import netCDF4
 import numpy as np
 from pyamg.classical import interpolate as amginterp
@@ -15,12 +22,17 @@ TYPELIST = ["buoyancy", "passive", "surface", "all"]
 VERTSEEDTYPE = ["linear", "denseCenter", "log"]
 SPATIAL_FILTER = ["SouthernOceanPlanar", "SouthernOceanXYZ"]
 
+# coarse points from AMG downsampling that have already been computed, with a
+# hash of the mesh and the number of splittings as keys
+_coarse_points = dict()
+
 
 def write(init_filename, graph_filename, particle_filename, types='all',
           n_vert_levels=10, vert_seed_type='linear', n_buoy_surf=11,
           pot_dens_min=1028.5, pot_dens_max=1030.0, spatial_filter=None,
           downsample=0, seed_center=True, seed_vertex=False,
-          add_noise=False, cfl_min=0.005):
+          add_noise=False, cfl_min=0.005, seed=None, workers=1,
+          downsample_cache_dir=None):
     """
     Write an initial condition for particles partitioned across cores
 
@@ -73,33 +85,36 @@ def write(init_filename, graph_filename, particle_filename, types='all',
     cfl_min : float, optional
         minimum assumed CFL, which is used in perturbing particles if
         ``seed_vertex=True`` or ``add_noise=True``
+
+    seed : int, optional
+        seed for the random number generator used if ``add_noise=True``, so
+        the noise is reproducible
+
+    workers : int, optional
+        the number of threads used to fill in the particles of different
+        types concurrently
+
+    downsample_cache_dir : str, optional
+        a directory for caching the points selected by AMG downsampling, so
+        they can be reused for the same mesh and ``downsample``
     """
 
     buoy_surf = np.linspace(pot_dens_min, pot_dens_max, n_buoy_surf)
     cpts, xCell, yCell, zCell = _particle_coords(
         init_filename, downsample, seed_center, seed_vertex, add_noise,
-        cfl_min)
+        cfl_min, seed, downsample_cache_dir)
 
     # build particles
-    particlelist = []
-    if "buoyancy" in types or "all" in types:
-        particlelist.append(_build_isopycnal_particles(
-            cpts, xCell, yCell, zCell, buoy_surf, spatial_filter))
-    if "passive" in types or "all" in types:
-        particlelist.append(_build_passive_floats(
-            cpts, xCell, yCell, zCell, init_filename, n_vert_levels,
-            spatial_filter, vert_seed_type))
-    # apply surface particles everywhere to ensure that LIGHT works
-    # (allow for some load-imbalance for filters)
-    if "surface" in types or "all" in types:
-        particlelist.append(_build_surface_floats(
-            cpts, xCell, yCell, zCell, spatial_filter))
+    particles = _build_particles(
+        cpts, xCell, yCell, zCell, init_filename, types, buoy_surf,
+        n_vert_levels, vert_seed_type, spatial_filter, workers)
 
     # write particles to disk
-    ParticleList(particlelist).write(particle_filename, graph_filename)
+    particles.write(particle_filename, graph_filename)
 
 
-def remap_particles(init_filename, particle_filename, graph_filename):
+def remap_particles(init_filename, particle_filename, graph_filename,
+                    chunk_size=1000000, workers=-1):
     """
     Remap particles onto a new grid decomposition.
 
@@ -113,55 +128,107 @@ def remap_particles(init_filename, particle_filename, graph_filename):
     We assume that all particles will be within the domain such that a nearest
     neighbor search is sufficient to make the remap.
 
+    Particles are read, located and written in chunks, so the particles never
+    need to be held in memory all at once.  To remap the same particles onto
+    several decompositions (e.g. for different numbers of cores) in a single
+    pass, give a list of graph partition files and a list of particle files
+    of the same length.  The particle positions are read from the first
+    particle file, and any other particle files that don't exist yet are
+    created as copies of it.
+
     Parameters
     ----------
     init_filename : str
         path of netCDF init/mesh file
 
-    graph_filename : str
-        path of graph partition file of form */*.info.part
+    graph_filename : str or list of str
+        path(s) of graph partition file(s) of form */*.info.part
 
-    particle_filename : str
-        path of input/output netCDF particle file
-    """
-    # load the files
-    with netCDF4.Dataset(init_filename, "r") as f_in, \
-            netCDF4.Dataset(particle_filename, "r+") as f_part:
+    particle_filename : str or list of str
+        path(s) of input/output netCDF particle file(s), one for each graph
+        partition file
 
-        # get the particle data
-        xpart = f_part.variables["xParticle"]
-        ypart = f_part.variables["yParticle"]
-        zpart = f_part.variables["zParticle"]
-        currentBlock = f_part.variables["currentBlock"]
-        try:
-            currentCell = f_part.variables["currentCell"]
-            currentCellGlobalID = f_part.variables["currentCellGlobalID"]
-        except KeyError:
-            currentCell = f_part.createVariable("currentCell", "i",
-                                                ("nParticles",))
-            currentCellGlobalID = f_part.createVariable(
-                "currentCellGlobalID", "i", ("nParticles",))
+    chunk_size : int, optional
+        the number of particles remapped at once
 
+    workers : int, optional
+        the number of threads used to find the nearest cells to particles,
+        with -1 meaning all available threads
+    """
+    if isinstance(graph_filename, str):
+        graph_filename = [graph_filename]
+    if isinstance(particle_filename, str):
+        particle_filename = [particle_filename]
+    if len(graph_filename) != len(particle_filename):
+        raise ValueError("There must be one particle file for each graph "
+                         "partition file")
+
+    for filename in particle_filename[1:]:
+        if not os.path.exists(filename):
+            shutil.copyfile(particle_filename[0], filename)
+
+    # load the decompositions
+    decomps = [_read_decomposition(filename) for filename in graph_filename]
+
+    with netCDF4.Dataset(init_filename, "r") as f_in:
         # get the cell positions
-        xcell = f_in.variables["xCell"]
-        ycell = f_in.variables["yCell"]
-        zcell = f_in.variables["zCell"]
-
-        # build the spatial tree
-        tree = spatial.cKDTree(np.vstack((xcell, ycell, zcell)).T)
+        xcell = f_in.variables["xCell"][:]
+        ycell = f_in.variables["yCell"][:]
+        zcell = f_in.variables["zCell"][:]
 
         # get nearest cell for each particle
         dvEdge = f_in.variables["dvEdge"]
         maxdist = 2.0 * max(dvEdge[:])
-        _, cellIndices = tree.query(
-            np.vstack((xpart, ypart, zpart)).T, distance_upper_bound=maxdist,
-            k=1)
 
-        # load the decomposition (apply to latest time step)
-        decomp = np.genfromtxt(graph_filename)
-        currentBlock[-1, :] = decomp[cellIndices]
-        currentCell[-1, :] = -1
-        currentCellGlobalID[-1, :] = cellIndices + 1
+    # build the spatial tree
+    tree = spatial.cKDTree(np.vstack((xcell, ycell, zcell)).T)
+
+    f_parts = [netCDF4.Dataset(filename, "r+") for filename in
+               particle_filename]
+    try:
+        for f_part in f_parts:
+            _add_current_cell(f_part)
+
+        # get the particle data
+        xpart = f_parts[0].variables["xParticle"]
+        ypart = f_parts[0].variables["yParticle"]
+        zpart = f_parts[0].variables["zParticle"]
+        nparticles = xpart.shape[1]
+
+        for start in range(0, nparticles, chunk_size):
+            indices = slice(start, min(start + chunk_size, nparticles))
+            _, cellIndices = tree.query(
+                np.vstack((xpart[-1, indices], ypart[-1, indices],
+                           zpart[-1, indices])).T,
+                distance_upper_bound=maxdist, k=1, workers=workers)
+
+            # apply to latest time step
+            for f_part, decomp in zip(f_parts, decomps):
+                f_part.variables["currentBlock"][-1, indices] = \
+                    decomp[cellIndices]
+                f_part.variables["currentCell"][-1, indices] = -1
+                f_part.variables["currentCellGlobalID"][-1, indices] = \
+                    cellIndices + 1
+    finally:
+        for f_part in f_parts:
+            f_part.close()
+
+
+def _read_decomposition(graph_filename):
+    """
+    Read the block (core) index of each cell from a graph partition file,
+    which has one integer per line
+    """
+    return np.fromfile(graph_filename, dtype=np.int64, sep=" ")
+
+
+def _add_current_cell(f_part):
+    """
+    Add the current cell variables to a particle file if they're missing
+    """
+    for var_name in ["currentCell", "currentCellGlobalID"]:
+        if var_name not in f_part.variables:
+            f_part.createVariable(var_name, "i", ("Time", "nParticles"))
 
 
 def _use_defaults(name, val):
@@ -171,12 +238,6 @@ def _use_defaults(name, val):
         return DEFAULTS[name]
 
 
-def _ensure_shape(start, new):
-    if isinstance(new, (int, float)):
-        new *= np.ones_like(start)
-    return new
-
-
 def _southern_ocean_only_xyz(x, y, z, maxNorth=-45.0):
     sq = np.sqrt(x ** 2 + y ** 2 + z ** 2)
     lat = np.arcsin(z / sq)
@@ -190,257 +251,303 @@ def _southern_ocean_only_planar(x, y, z, maxy=1000.0 * 1e3):
     return ids
 
 
-def _downsample_points(x, y, z, tri, nsplit):
+def _downsample_points(x, y, z, tri, nsplit, cache_dir=None):
     """
     Downsample points using algebraic multigrid splitting.
 
     Note, currently assumes that all points on grid are equidistant, which does
     a numeric (not area-weighted) downsampling.
 
+    The coarse points are cached in memory and, if ``cache_dir`` is given, on
+    disk, keyed by a hash of the mesh and ``nsplit``, so they are only
+    computed once for a given mesh.
+
     Phillip Wolfram
     LANL
     Origin: 03/09/2015, Updated: 01/14/2019
     """
+    x = np.asarray(x)
+    y = np.asarray(y)
+    z = np.asarray(z)
+    tri = np.asarray(tri)
+
+    key = _get_downsample_key(x, y, z, tri, nsplit)
+    if cache_dir is not None:
+        cache_filename = os.path.join(cache_dir,
+                                      "coarse_points_{}.npz".format(key))
+    else:
+        cache_filename = None
+
+    if key not in _coarse_points and cache_filename is not None and \
+            os.path.exists(cache_filename):
+        with np.load(cache_filename) as data:
+            _coarse_points[key] = data["Cpts"]
+
+    if key not in _coarse_points:
+        A = _build_adjacency(tri, x.shape[0])
+
+        Cpts = np.arange(x.shape[0])
+        # Grab root-nodes (i.e., Coarse / Fine splitting)
+        for ii in np.arange(nsplit):
+            splitting = split.PMIS(A)
+            # convert to index for subsetting particles
+            Cpts = Cpts[np.asarray(splitting, dtype=bool)]
+
+            if ii < nsplit - 1:
+                P = amginterp.direct_interpolation(A, A, splitting)
+                R = P.T.tocsr()
+                A = R @ A @ P
+
+        _coarse_points[key] = Cpts
+        if cache_filename is not None:
+            _write_coarse_points(cache_filename, Cpts)
+
+    Cpts = _coarse_points[key]
+    return Cpts, x[Cpts], y[Cpts], z[Cpts]
+
+
+def _build_adjacency(tri, Np):
+    """
+    Build the symmetric adjacency matrix of the points in a triangulation in
+    CSR format, with ones for each pair of points that share an edge
+    """
     # reference on cleanest way to do this calculation:
     # https://www.mathworks.com/matlabcentral/answers/
     # 369143-how-to-do-delaunay-triangulation-and-return-an-adjacency-matrix
 
-    # allocate the memory
-    Np = x.shape[0]
-    A = sparse.lil_matrix((Np, Np))
-
     # cleanup impartial cells (don't include the triangles on boundary)
     tri = tri[np.logical_not(np.any(tri == -1, axis=1)), :]
 
-    # handle one direction for triangles
-    A[tri[:, 0], tri[:, 1]] = 1
-    A[tri[:, 1], tri[:, 2]] = 1
-    A[tri[:, 2], tri[:, 0]] = 1
+    # both directions of each edge of each triangle (bi-directional graph)
+    rows = np.concatenate((tri[:, 0], tri[:, 1], tri[:, 2],
+                           tri[:, 1], tri[:, 2], tri[:, 0]))
+    cols = np.concatenate((tri[:, 1], tri[:, 2], tri[:, 0],
+                           tri[:, 0], tri[:, 1], tri[:, 2]))
+    data = np.ones(len(rows))
 
-    # handle other direction (bi-directional graph)
-    A[tri[:, 1], tri[:, 0]] = 1
-    A[tri[:, 2], tri[:, 1]] = 1
-    A[tri[:, 0], tri[:, 2]] = 1
+    # duplicate edges (shared by neighboring triangles) are summed when
+    # converting to CSR, so set all entries back to one
+    A = sparse.coo_matrix((data, (rows, cols)), shape=(Np, Np)).tocsr()
+    A.data[:] = 1.
+    return A
 
-    A = A.tocsr()
 
-    Cpts = np.arange(Np)
-    # Grab root-nodes (i.e., Coarse / Fine splitting)
-    for ii in np.arange(nsplit):
-        splitting = split.PMIS(A)
-        # convert to index for subsetting particles
-        Cpts = Cpts[np.asarray(splitting, dtype=bool)]
+def _get_downsample_key(x, y, z, tri, nsplit):
+    """
+    A hash of the points, the triangulation and the number of splittings
+    """
+    sha = hashlib.sha256()
+    for array in [x, y, z, tri]:
+        sha.update(np.ascontiguousarray(array).tobytes())
+    return "{}_nsplit{}".format(sha.hexdigest(), nsplit)
 
-        if ii < nsplit - 1:
-            P = amginterp.direct_interpolation(A, A, splitting)
-            R = P.T.tocsr()
-            A = R * A * P
 
-    return Cpts, x[Cpts], y[Cpts], z[Cpts]
+def _write_coarse_points(cache_filename, Cpts):
+    """
+    Write coarse points to the cache, using a temporary file so a partial
+    file is never read
+    """
+    cache_dir = os.path.dirname(cache_filename)
+    try:
+        os.makedirs(cache_dir)
+    except OSError:
+        pass
+    handle, temp_filename = tempfile.mkstemp(dir=cache_dir, suffix=".npz")
+    with os.fdopen(handle, "wb") as temp_file:
+        np.savez(temp_file, Cpts=Cpts)
+    os.replace(temp_filename, cache_filename)
+
+
+# the fields stored for each particle and their types
+PARTICLE_FIELDS = {"x": "f8",
+                   "y": "f8",
+                   "z": "f8",
+                   "zlevel": "f8",
+                   "buoypart": "f8",
+                   "cellindices": "i8",
+                   "verticaltreatment": "i4"}
 
 
-class Particles:
-    def __init__(
-        self,
-        x,
-        y,
-        z,
-        cellindices,
-        verticaltreatment,
-        dt=np.nan,
-        zlevel=np.nan,
-        indexlevel=np.nan,
-        buoypart=np.nan,
-        buoysurf=None,
-        spatialfilter=None,
-        resettime=np.nan,
-        xreset=np.nan,
-        yreset=np.nan,
-        zreset=np.nan,
-        zlevelreset=np.nan,
-    ):
-
-        # start with all the indices and restrict
-        ids = np.ones((len(x)), dtype=bool)
-        if type(spatialfilter) is str:
-            spatialfilter = [spatialfilter]
-        if spatialfilter:
-            if np.max(["SouthernOceanXYZ" == afilter for afilter in
-                       spatialfilter]):
-                ids = np.logical_and(ids, _southern_ocean_only_xyz(x, y, z))
-            if np.max(["SouthernOceanPlanar" == afilter for afilter in
-                       spatialfilter]):
-                ids = np.logical_and(ids, _southern_ocean_only_planar(x, y, z))
-
-        self.x = x[ids]
-        self.y = y[ids]
-        self.z = z[ids]
-        self.verticaltreatment = _ensure_shape(
-            self.x, VERTICAL_TREATMENTS[verticaltreatment])
-        self.nparticles = len(self.x)
-
-        self.dt = dt
-
-        # 3D passive floats
-        self.zlevel = _ensure_shape(x, zlevel)[ids]
-
-        # isopycnal floats
-        if buoysurf is not None:
-            self.buoysurf = buoysurf
-        self.buoypart = _ensure_shape(x, buoypart)[ids]
-        self.cellindices = cellindices[ids]
-        self.cellGlobalID = cellindices[ids]
-
-        # index level following floats
-        self.indexlevel = _ensure_shape(x, indexlevel)[ids]
-
-        # reset features
-        self.resettime = _ensure_shape(x, resettime)[ids]
-        self.xreset = _ensure_shape(x, xreset)[ids]
-        self.yreset = _ensure_shape(x, yreset)[ids]
-        self.zreset = _ensure_shape(x, zreset)[ids]
-        self.zlevelreset = _ensure_shape(x, zlevelreset)[ids]
-
-    def compute_lat_lon(self):
-        """
-        Ripped out whole-sale from latlon_coordinate_transforms.py
-        PJW 01/15/2019
-        """
+class ParticleList:
+    """
+    A columnar store of particles of one or more types.  Each field is held in
+    a single contiguous array that is allocated once for all particles, and
+    the particles of each type occupy a contiguous slice of these arrays.
+
+    Attributes
+    ----------
+    nparticles : int
+        The total number of particles
 
-        x = self.x
-        y = self.y
-        z = self.z
+    slices : dict of slice
+        The range of indices of the particles of each type
 
-        self.latParticle = np.arcsin(z / np.sqrt(x ** 2 + y ** 2 + z ** 2))
-        self.lonParticle = np.arctan2(y, x)
+    fields : dict of numpy.ndarray
+        The values of each field in ``PARTICLE_FIELDS`` for all particles
 
+    buoysurf : numpy.ndarray
+        The potential density of each buoyancy surface, or ``None`` if there
+        are no particles constrained to buoyancy surfaces
+    """
+    def __init__(self, counts):
+        """
+        Allocate the store
 
-class ParticleList:
-    def __init__(self, particlelist):
-        self.particlelist = particlelist
-
-    def aggregate(self):
-        self.len()
-
-        # buoyancysurf
-        buoysurf = np.array([])
-        for alist in self.particlelist:
-            if "buoysurf" in dir(alist):
-                buoysurf = np.unique(
-                    np.setdiff1d(np.append(buoysurf, alist.buoysurf), None)
-                )
-        if len(buoysurf) > 0:
-            self.buoysurf = np.asarray(buoysurf, dtype="f8")
-        else:
-            self.buoysurf = None
-
-    def __getattr__(self, name):
-        # __getattr__ ensures self.x is concatenated properly
-        return self.concatenate(name)
-
-    def concatenate(self, varname):
-        var = getattr(self.particlelist[0], varname)
-        for alist in self.particlelist[1:]:
-            var = np.append(var, getattr(alist, varname))
-        return var
-
-    def append(self, particlelist):
-        self.particlelist.append(particlelist[:])
-
-    def len(self):
+        Parameters
+        ----------
+        counts : dict of int
+            The number of particles of each type, in the order they are stored
+        """
         self.nparticles = 0
-        for alist in self.particlelist:
-            self.nparticles += alist.nparticles
+        self.slices = dict()
+        for name, count in counts.items():
+            self.slices[name] = slice(self.nparticles,
+                                      self.nparticles + count)
+            self.nparticles += count
+
+        self.fields = dict()
+        for field, dtype in PARTICLE_FIELDS.items():
+            if dtype == "f8":
+                # fields that are not used for a given type are NaN
+                self.fields[field] = np.full(self.nparticles, np.nan)
+            else:
+                self.fields[field] = np.zeros(self.nparticles, dtype=dtype)
+
+        self.buoysurf = None
+
+    def view(self, name):
+        """
+        Get views (not copies) of the fields of the particles of a given type
+
+        Parameters
+        ----------
+        name : str
+            The type of particles
+
+        Returns
+        -------
+        fields : dict of numpy.ndarray
+            The values of each field for particles of this type, which can be
+            modified in place
+        """
+        indices = self.slices[name]
+        return {field: values[indices] for field, values in
+                self.fields.items()}
 
-        return self.nparticles
+    def write(self, f_name, f_decomp, chunk_size=1000000):
+        """
+        Write the particles to a netCDF file
+
+        Parameters
+        ----------
+        f_name : str
+            path of output netCDF particle file
 
-    # probably a cleaner way to have this "fall through" to the particle
-    # instances themselves, but didn't have time to sort this all out so this
-    # isn't general for now
-    def compute_lat_lon(self):
-        for alist in self.particlelist:
-            alist.compute_lat_lon()
+        f_decomp : str
+            path of graph partition file of form */*.info.part
 
-    def write(self, f_name, f_decomp):
+        chunk_size : int, optional
+            The number of particles written at once
+        """
 
-        decomp = np.genfromtxt(f_decomp)
+        decomp = _read_decomposition(f_decomp)
 
-        self.aggregate()
         assert (
             max(decomp) < self.nparticles
         ), "Number of particles must be larger than decomposition!"
 
-        f_out = netCDF4.Dataset(f_name, "w", format="NETCDF3_64BIT_OFFSET")
-
-        f_out.createDimension("Time")
-        f_out.createDimension("nParticles", self.nparticles)
-
-        f_out.createVariable("xParticle", "f8", ("Time", "nParticles"))
-        f_out.createVariable("yParticle", "f8", ("Time", "nParticles"))
-        f_out.createVariable("zParticle", "f8", ("Time", "nParticles"))
-        f_out.createVariable("lonParticle", "f8", ("Time", "nParticles"))
-        f_out.createVariable("latParticle", "f8", ("Time", "nParticles"))
-        f_out.createVariable("zLevelParticle", "f8", ("Time", "nParticles"))
-        f_out.createVariable("dtParticle", "f8", ("Time", "nParticles"))
-        f_out.createVariable("buoyancyParticle", "f8", ("Time", "nParticles"))
-        f_out.createVariable("currentBlock", "i", ("Time", "nParticles"))
-        f_out.createVariable("currentCell", "i", ("Time", "nParticles"))
-        f_out.createVariable("currentCellGlobalID", "i", ("Time",
-                                                          "nParticles"))
-        f_out.createVariable("indexToParticleID", "i", ("nParticles",))
-        f_out.createVariable("verticalTreatment", "i", ("Time", "nParticles"))
-        f_out.createVariable("indexLevel", "i", ("Time", "nParticles"))
-        f_out.createVariable("resetTime", "i", ("nParticles",))
-        f_out.createVariable("currentBlockReset", "i", ("nParticles",))
-        f_out.createVariable("currentCellReset", "i", ("nParticles",))
-        f_out.createVariable("xParticleReset", "f8", ("nParticles",))
-        f_out.createVariable("yParticleReset", "f8", ("nParticles",))
-        f_out.createVariable("zParticleReset", "f8", ("nParticles",))
-        f_out.createVariable("zLevelParticleReset", "f8", ("nParticles",))
-
-        f_out.variables["xParticle"][0, :] = self.x
-        f_out.variables["yParticle"][0, :] = self.y
-        f_out.variables["zParticle"][0, :] = self.z
-
-        self.compute_lat_lon()
-        f_out.variables["lonParticle"][0, :] = self.lonParticle
-        f_out.variables["latParticle"][0, :] = self.latParticle
-
-        f_out.variables["verticalTreatment"][0, :] = self.verticaltreatment
-
-        f_out.variables["zLevelParticle"][0, :] = self.zlevel
-
-        if self.buoysurf is not None and len(self.buoysurf) > 0:
-            f_out.createDimension("nBuoyancySurfaces", len(self.buoysurf))
-            f_out.createVariable("buoyancySurfaceValues", "f8",
-                                 ("nBuoyancySurfaces"))
-            f_out.variables["buoyancyParticle"][0, :] = self.buoypart
-            f_out.variables["buoyancySurfaceValues"][:] = self.buoysurf
-
-        f_out.variables["dtParticle"][0, :] = DEFAULTS["dt"]
-        # assume single-processor mode for now
-        f_out.variables["currentBlock"][:] = 0
-        # reset each day
-        f_out.variables["resetTime"][:] = DEFAULTS["resettime"]
-        f_out.variables["indexLevel"][:] = 1
-        f_out.variables["indexToParticleID"][:] = np.arange(self.nparticles)
-
-        # resets
-        f_out.variables["currentBlock"][0, :] = decomp[self.cellindices]
-        f_out.variables["currentBlockReset"][:] = decomp[self.cellindices]
-        f_out.variables["currentCell"][0, :] = -1
-        f_out.variables["currentCellGlobalID"][0, :] = self.cellGlobalID + 1
-        f_out.variables["currentCellReset"][:] = -1
-        f_out.variables["xParticleReset"][:] = \
-            f_out.variables["xParticle"][0, :]
-        f_out.variables["yParticleReset"][:] = \
-            f_out.variables["yParticle"][0, :]
-        f_out.variables["zParticleReset"][:] = \
-            f_out.variables["zParticle"][0, :]
-        f_out.variables["zLevelParticleReset"][:] = \
-            f_out.variables["zLevelParticle"][0, :]
-
-        f_out.close()
+        has_buoysurf = self.buoysurf is not None and len(self.buoysurf) > 0
+
+        with netCDF4.Dataset(f_name, "w",
+                             format="NETCDF3_64BIT_OFFSET") as f_out:
+
+            f_out.createDimension("Time")
+            f_out.createDimension("nParticles", self.nparticles)
+
+            for var_name, dtype in [("xParticle", "f8"),
+                                    ("yParticle", "f8"),
+                                    ("zParticle", "f8"),
+                                    ("lonParticle", "f8"),
+                                    ("latParticle", "f8"),
+                                    ("zLevelParticle", "f8"),
+                                    ("dtParticle", "f8"),
+                                    ("buoyancyParticle", "f8"),
+                                    ("currentBlock", "i"),
+                                    ("currentCell", "i"),
+                                    ("currentCellGlobalID", "i"),
+                                    ("verticalTreatment", "i"),
+                                    ("indexLevel", "i")]:
+                f_out.createVariable(var_name, dtype, ("Time", "nParticles"))
+
+            for var_name, dtype in [("indexToParticleID", "i"),
+                                    ("resetTime", "i"),
+                                    ("currentBlockReset", "i"),
+                                    ("currentCellReset", "i"),
+                                    ("xParticleReset", "f8"),
+                                    ("yParticleReset", "f8"),
+                                    ("zParticleReset", "f8"),
+                                    ("zLevelParticleReset", "f8")]:
+                f_out.createVariable(var_name, dtype, ("nParticles",))
+
+            if has_buoysurf:
+                f_out.createDimension("nBuoyancySurfaces", len(self.buoysurf))
+                f_out.createVariable("buoyancySurfaceValues", "f8",
+                                     ("nBuoyancySurfaces"))
+                f_out.variables["buoyancySurfaceValues"][:] = self.buoysurf
+
+            # write all variables one large hyperslab at a time
+            for start in range(0, self.nparticles, chunk_size):
+                end = min(start + chunk_size, self.nparticles)
+                self._write_chunk(f_out, decomp, start, end, has_buoysurf)
+
+    def _write_chunk(self, f_out, decomp, start, end, has_buoysurf):
+        """
+        Write a contiguous range of particles to a netCDF file
+        """
+        indices = slice(start, end)
+        x = self.fields["x"][indices]
+        y = self.fields["y"][indices]
+        z = self.fields["z"][indices]
+        zlevel = self.fields["zlevel"][indices]
+        cellindices = self.fields["cellindices"][indices]
+        block = decomp[cellindices]
+
+        lat = np.arcsin(z / np.sqrt(x ** 2 + y ** 2 + z ** 2))
+        lon = np.arctan2(y, x)
+
+        time_values = [("xParticle", x),
+                       ("yParticle", y),
+                       ("zParticle", z),
+                       ("lonParticle", lon),
+                       ("latParticle", lat),
+                       ("verticalTreatment",
+                        self.fields["verticaltreatment"][indices]),
+                       ("zLevelParticle", zlevel),
+                       ("dtParticle", DEFAULTS["dt"]),
+                       # assume single-processor mode for now
+                       ("currentBlock", block),
+                       ("indexLevel", 1),
+                       ("currentCell", -1),
+                       ("currentCellGlobalID", cellindices + 1)]
+        if has_buoysurf:
+            time_values.append(("buoyancyParticle",
+                                self.fields["buoypart"][indices]))
+
+        values = [("indexToParticleID", np.arange(start, end)),
+                  # reset each day
+                  ("resetTime", DEFAULTS["resettime"]),
+                  # resets
+                  ("currentBlockReset", block),
+                  ("currentCellReset", -1),
+                  ("xParticleReset", x),
+                  ("yParticleReset", y),
+                  ("zParticleReset", z),
+                  ("zLevelParticleReset", zlevel)]
+
+        for var_name, var_values in time_values:
+            f_out.variables[var_name][0, indices] = var_values
+        for var_name, var_values in values:
+            f_out.variables[var_name][indices] = var_values
 
 
 def _rescale_for_shell(f_init, x, y, z):
@@ -453,7 +560,7 @@ def _rescale_for_shell(f_init, x, y, z):
 
 
 def _get_particle_coords(f_init, seed_center=True, seed_vertex=False,
-                         add_noise=False, CFLmin=None):
+                         add_noise=False, CFLmin=None, seed=None):
     xCell = f_init.variables["xCell"][:]
     yCell = f_init.variables["yCell"][:]
     zCell = f_init.variables["zCell"][:]
@@ -471,48 +578,31 @@ def _get_particle_coords(f_init, seed_center=True, seed_vertex=False,
         nCells = len(f_init.dimensions["nCells"])
         perturbation = CFLmin * np.ones((nCells,))
 
-        allx = []
-        ally = []
-        allz = []
-        allcpts = []
+        rng = np.random.default_rng(seed)
         # There are six potential cell neighbors to perturb the particles for.
         # This selects three random directions (without replacement) at every
-        # cell.
-        cellDirs = np.stack(
-            [
-                np.random.choice(np.arange(6), size=3, replace=False)
-                for _ in range(nCells)
-            ]
-        )
-        for ci in np.arange(3):
-            epsilon = np.abs(np.random.normal(size=nCells))
-            epsilon /= epsilon.max()
-            # Adds gaussian noise at each cell, creating range of
-            # [CFLMin, 2*CFLMin]
-            theta = perturbation * epsilon + perturbation
-
-            x = (1.0 - theta) * xCell + theta * xCell[
-                cellsOnCell[range(nCells), cellDirs[:, ci]] - 1
-            ]
-            y = (1.0 - theta) * yCell + theta * yCell[
-                cellsOnCell[range(nCells), cellDirs[:, ci]] - 1
-            ]
-            z = (1.0 - theta) * zCell + theta * zCell[
-                cellsOnCell[range(nCells), cellDirs[:, ci]] - 1
-            ]
+        # cell by sorting random keys for the six directions.
+        cellDirs = np.argsort(rng.random((nCells, 6)), axis=1)[:, 0:3]
+        neighbors = cellsOnCell[np.arange(nCells)[:, np.newaxis],
+                                cellDirs].T - 1
 
-            x, y, z = _rescale_for_shell(f_init, x, y, z)
+        epsilon = np.abs(rng.normal(size=(3, nCells)))
+        epsilon /= epsilon.max(axis=1)[:, np.newaxis]
+        # Adds gaussian noise at each cell, creating range of
+        # [CFLMin, 2*CFLMin]
+        theta = perturbation * epsilon + perturbation
 
-            allx.append(x)
-            ally.append(y)
-            allz.append(z)
-            allcpts.append(cellsOnCell[:, ci] - 1)
-        cells_center = (
-            np.concatenate(allx),
-            np.concatenate(ally),
-            np.concatenate(allz),
-        )
-        cpts_center = np.concatenate(allcpts)
+        x = (1.0 - theta) * xCell + theta * xCell[neighbors]
+        y = (1.0 - theta) * yCell + theta * yCell[neighbors]
+        z = (1.0 - theta) * zCell + theta * zCell[neighbors]
+
+        x, y, z = _rescale_for_shell(f_init, x.ravel(), y.ravel(),
+                                     z.ravel())
+
+        cells_center = (x, y, z)
+        # the particles are perturbed only slightly, so they remain in the
+        # cell they were seeded in
+        cpts_center = np.tile(np.arange(nCells), 3)
 
     # Case of seeding 3 particles by a small epsilon around the vertices.
     if seed_vertex:
@@ -569,56 +659,124 @@ def _get_particle_coords(f_init, seed_center=True, seed_vertex=False,
     return cells, cpts
 
 
-def _expand_nlevels(x, n):
-    return np.tile(x, (n))
-
-
 def _particle_coords(
-    f_init, downsample, seed_center, seed_vertex, add_noise, CFLmin
+    f_init, downsample, seed_center, seed_vertex, add_noise, CFLmin, seed=None,
+    downsample_cache_dir=None
 ):
 
     f_init = netCDF4.Dataset(f_init, "r")
     cells, cpts = _get_particle_coords(
-        f_init, seed_center, seed_vertex, add_noise, CFLmin
+        f_init, seed_center, seed_vertex, add_noise, CFLmin, seed
     )
     xCell, yCell, zCell = cells
     if downsample:
         tri = f_init.variables["cellsOnVertex"][:, :] - 1
         cpts, xCell, yCell, zCell = _downsample_points(
-            xCell, yCell, zCell, tri, downsample
+            xCell, yCell, zCell, tri, downsample, downsample_cache_dir
         )
     f_init.close()
 
     return cpts, xCell, yCell, zCell
 
 
-def _build_isopycnal_particles(cpts, xCell, yCell, zCell, buoysurf, afilter):
+def _build_particles(cpts, xCell, yCell, zCell, f_init, types, buoysurf,
+                     nvertlevels, vertseedtype, afilter, workers=1):
+    """
+    Allocate a store for particles of all the requested types and fill in
+    the particles of each type, using a pool of threads (numpy releases the
+    GIL while filling large arrays) for the different types
+    """
+    ids = _spatial_filter(xCell, yCell, zCell, afilter)
+    cpts = cpts[ids]
+    xCell = xCell[ids]
+    yCell = yCell[ids]
+    zCell = zCell[ids]
+    ncells = len(cpts)
+
+    # the number of particles of each type seeded in each cell
+    nlevels = dict()
+    if "buoyancy" in types or "all" in types:
+        nlevels["buoyancy"] = len(buoysurf)
+    if "passive" in types or "all" in types:
+        nlevels["passive"] = nvertlevels
+    # apply surface particles everywhere to ensure that LIGHT works
+    # (allow for some load-imbalance for filters)
+    if "surface" in types or "all" in types:
+        nlevels["surface"] = 1
+
+    particles = ParticleList({name: ncells * count for name, count in
+                              nlevels.items()})
+
+    builders = []
+    if "buoyancy" in nlevels:
+        builders.append(partial(_build_isopycnal_particles, particles, cpts,
+                                xCell, yCell, zCell, buoysurf))
+    if "passive" in nlevels:
+        with netCDF4.Dataset(f_init, "r") as ds_init:
+            bottomDepth = ds_init.variables["bottomDepth"][:][cpts]
+        builders.append(partial(_build_passive_floats, particles, cpts, xCell,
+                                yCell, zCell, bottomDepth, nvertlevels,
+                                vertseedtype))
+    if "surface" in nlevels:
+        builders.append(partial(_build_surface_floats, particles, cpts, xCell,
+                                yCell, zCell))
+
+    # each type fills in its own slice of the store
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = [executor.submit(builder) for builder in builders]
+        for future in futures:
+            future.result()
+
+    return particles
+
+
+def _spatial_filter(x, y, z, spatialfilter):
+    """
+    A mask of the points that pass the spatial filter(s)
+    """
+    # start with all the indices and restrict
+    ids = np.ones((len(x)), dtype=bool)
+    if type(spatialfilter) is str:
+        spatialfilter = [spatialfilter]
+    if spatialfilter:
+        if "SouthernOceanXYZ" in spatialfilter:
+            ids = np.logical_and(ids, _southern_ocean_only_xyz(x, y, z))
+        if "SouthernOceanPlanar" in spatialfilter:
+            ids = np.logical_and(ids, _southern_ocean_only_planar(x, y, z))
+    return ids
+
+
+def _fill_levels(fields, nlevels, cpts, xCell, yCell, zCell):
+    """
+    Fill in the positions and cells of particles seeded at ``nlevels`` levels
+    in each cell, with all the particles at one level stored together
+    """
+    ncells = len(cpts)
+    for field, values in [("x", xCell), ("y", yCell), ("z", zCell),
+                          ("cellindices", cpts)]:
+        fields[field].reshape(nlevels, ncells)[:] = values
+
 
-    nparticles = len(xCell)
+def _build_isopycnal_particles(particles, cpts, xCell, yCell, zCell,
+                               buoysurf):
+
+    fields = particles.view("buoyancy")
     nbuoysurf = buoysurf.shape[0]
 
-    x = _expand_nlevels(xCell, nbuoysurf)
-    y = _expand_nlevels(yCell, nbuoysurf)
-    z = _expand_nlevels(zCell, nbuoysurf)
+    _fill_levels(fields, nbuoysurf, cpts, xCell, yCell, zCell)
+    fields["verticaltreatment"][:] = VERTICAL_TREATMENTS["buoyancySurface"]
+    fields["buoypart"].reshape(nbuoysurf, len(cpts))[:] = \
+        buoysurf[:, np.newaxis]
 
-    buoypart = (
-        (np.tile(buoysurf, (nparticles, 1)))
-        .reshape(nparticles * nbuoysurf, order="F")
-        .copy())
-    cellindices = np.tile(cpts, (nbuoysurf))
+    particles.buoysurf = np.asarray(np.unique(buoysurf), dtype="f8")
 
-    return Particles(x, y, z, cellindices, "buoyancySurface",
-                     buoypart=buoypart, buoysurf=buoysurf,
-                     spatialfilter=afilter)
 
+def _build_passive_floats(particles, cpts, xCell, yCell, zCell, bottomDepth,
+                          nvertlevels, vertseedtype):
 
-def _build_passive_floats(cpts, xCell, yCell, zCell, f_init, nvertlevels,
-                          afilter, vertseedtype):
+    fields = particles.view("passive")
 
-    x = _expand_nlevels(xCell, nvertlevels)
-    y = _expand_nlevels(yCell, nvertlevels)
-    z = _expand_nlevels(zCell, nvertlevels)
-    f_init = netCDF4.Dataset(f_init, "r")
+    _fill_levels(fields, nvertlevels, cpts, xCell, yCell, zCell)
     if vertseedtype == "linear":
         wgts = np.linspace(0, 1, nvertlevels + 2)[1:-1]
     elif vertseedtype == "log":
@@ -630,13 +788,9 @@ def _build_passive_floats(cpts, xCell, yCell, zCell, f_init, nvertlevels,
             "Must designate `vertseedtype` as one of the following: "
             + f"{VERTSEEDTYPE}"
         )
-    zlevel = -np.kron(wgts, f_init.variables["bottomDepth"][cpts])
-    cellindices = np.tile(cpts, (nvertlevels))
-    f_init.close()
-
-    return Particles(
-        x, y, z, cellindices, "passiveFloat", zlevel=zlevel,
-        spatialfilter=afilter)
+    fields["zlevel"].reshape(nvertlevels, len(cpts))[:] = \
+        -np.outer(wgts, bottomDepth)
+    fields["verticaltreatment"][:] = VERTICAL_TREATMENTS["passiveFloat"]
 
 
 def _dense_center_seeding(nVert):
@@ -656,15 +810,13 @@ def _dense_center_seeding(nVert):
     return c_wgts
 
 
-def _build_surface_floats(cpts, xCell, yCell, zCell, afilter):
+def _build_surface_floats(particles, cpts, xCell, yCell, zCell):
 
-    x = _expand_nlevels(xCell, 1)
-    y = _expand_nlevels(yCell, 1)
-    z = _expand_nlevels(zCell, 1)
-    cellindices = cpts
+    fields = particles.view("surface")
 
-    return Particles(x, y, z, cellindices, "indexLevel", indexlevel=1,
-                     zlevel=0, spatialfilter=afilter)
+    _fill_levels(fields, 1, cpts, xCell, yCell, zCell)
+    fields["zlevel"][:] = 0.
+    fields["verticaltreatment"][:] = VERTICAL_TREATMENTS["indexLevel"]
 
 
 def _build_particle_file(f_init, f_name, f_decomp, types, spatialfilter,
@@ -675,21 +827,9 @@ def _build_particle_file(f_init, f_name, f_decomp, types, spatialfilter,
         f_init, downsample, seed_center, seed_vertex, add_noise, CFLmin)
 
     # build particles
-    particlelist = []
-    if "buoyancy" in types or "all" in types:
-        particlelist.append(
-            _build_isopycnal_particles(
-                cpts, xCell, yCell, zCell, buoySurf, spatialfilter))
-    if "passive" in types or "all" in types:
-        particlelist.append(
-            _build_passive_floats(
-                cpts, xCell, yCell, zCell, f_init, nVertLevels, spatialfilter,
-                vertseedtype))
-    # apply surface particles everywhere to ensure that LIGHT works
-    # (allow for some load-imbalance for filters)
-    if "surface" in types or "all" in types:
-        particlelist.append(
-            _build_surface_floats(cpts, xCell, yCell, zCell, spatialfilter))
+    particles = _build_particles(
+        cpts, xCell, yCell, zCell, f_init, types, buoySurf, nVertLevels,
+        vertseedtype, spatialfilter)
 
     # write particles to disk
-    ParticleList(particlelist).write(f_name, f_decomp)
+    particles.write(f_name, f_decomp)
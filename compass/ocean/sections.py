@@ -0,0 +1,83 @@
+import hashlib
+
+import numpy
+from scipy.spatial import cKDTree
+
+
+# trees of cell centers that have already been built, with a hash of the
+# cell-center coordinates as keys
+_cell_trees = dict()
+
+
+def get_cell_tree(ds_mesh):
+    """
+    Get a KD-tree of the cell centers of a planar mesh.  The tree is built
+    only once for each mesh and reused in later calls.
+
+    Parameters
+    ----------
+    ds_mesh : xarray.Dataset
+        A dataset with the MPAS mesh, including ``xCell`` and ``yCell``
+
+    Returns
+    -------
+    tree : scipy.spatial.cKDTree
+        A KD-tree of the cell centers
+    """
+    x_cell = numpy.ascontiguousarray(ds_mesh.xCell.values)
+    y_cell = numpy.ascontiguousarray(ds_mesh.yCell.values)
+
+    sha = hashlib.sha256()
+    sha.update(x_cell.tobytes())
+    sha.update(y_cell.tobytes())
+    key = sha.hexdigest()
+
+    if key not in _cell_trees:
+        _cell_trees[key] = cKDTree(numpy.vstack((x_cell, y_cell)).T)
+
+    return _cell_trees[key]
+
+
+def find_section_cells(ds_mesh, x, y, n_samples=10000):
+    """
+    Find the cells along a section through a planar mesh.  The section is
+    sampled at evenly spaced points and the nearest cell center to each point
+    is found with a KD-tree.
+
+    Parameters
+    ----------
+    ds_mesh : xarray.Dataset
+        A dataset with the MPAS mesh, including ``xCell`` and ``yCell``
+
+    x, y : numpy.ndarray
+        The coordinates of the vertices of the polyline defining the section,
+        in the same units as ``xCell`` and ``yCell``
+
+    n_samples : int, optional
+        The number of points sampled along the section
+
+    Returns
+    -------
+    cell_indices : numpy.ndarray
+        The zero-based indices of the cells along the section, in order and
+        without consecutive repeats
+    """
+    x = numpy.asarray(x, dtype=float)
+    y = numpy.asarray(y, dtype=float)
+
+    # the distance along the section of each vertex of the polyline
+    distance = numpy.zeros(len(x))
+    distance[1:] = numpy.cumsum(numpy.sqrt(numpy.diff(x)**2 +
+                                           numpy.diff(y)**2))
+
+    sample_distance = numpy.linspace(0., distance[-1], n_samples)
+    x_sample = numpy.interp(sample_distance, distance, x)
+    y_sample = numpy.interp(sample_distance, distance, y)
+
+    tree = get_cell_tree(ds_mesh)
+    _, cell_indices = tree.query(numpy.vstack((x_sample, y_sample)).T)
+
+    keep = numpy.ones(len(cell_indices), dtype=bool)
+    keep[1:] = cell_indices[1:] != cell_indices[:-1]
+
+    return cell_indices[keep]
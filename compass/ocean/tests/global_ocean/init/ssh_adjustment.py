@@ -85,5 +85,8 @@ class SshAdjustment(Step):
         """
         config = self.config
         iteration_count = config.getint('ssh_adjustment', 'iterations')
+        tolerance = config.getfloat('ssh_adjustment', 'tolerance')
+        tolerance_metric = config.get('ssh_adjustment', 'tolerance_metric')
         adjust_ssh(variable='landIcePressure', iteration_count=iteration_count,
-                   step=self)
+                   step=self, tolerance=tolerance,
+                   tolerance_metric=tolerance_metric)
@@ -1,6 +1,7 @@
 import numpy
+import scipy.sparse
+import shapely
 from netCDF4 import Dataset
-from shapely.geometry import Polygon, LineString
 
 from progressbar import ProgressBar, Percentage, Bar, ETA
 
@@ -68,144 +69,13 @@ class Misomip(Step):
         # show progress only if we're not writing to a log file
         show_progress = self.log_filename is None
 
-        _compute_misomip_interp_coeffs(in_dir=in_dir,
-                                       show_progress=show_progress)
+        _compute_misomip_interp_coeffs(in_dir=in_dir)
         _interp_misomip(in_dir=in_dir, sf_dir=sf_dir,
                         out_file_name=self.outputs[0],
                         show_progress=show_progress)
 
 
-def _compute_misomip_interp_coeffs(in_dir, show_progress):
-    def getTransectWeights(outFileName, axis):
-
-        if show_progress:
-            pbar = ProgressBar(
-                widgets=[
-                    'compute MPAS and MISOMIP {} transect '
-                    'intersections'.format(axis),
-                    Percentage(),
-                    Bar(),
-                    ETA()],
-                maxval=nCells).start()
-        else:
-            pbar = None
-
-        if axis == 'x':
-            slicePos = xTransect
-            outNOther = outNy
-            outOtherAxis = y
-        else:
-            slicePos = yTransect
-            outNOther = outNx
-            outOtherAxis = x
-
-        sliceCount = numpy.zeros(outNOther, int)
-        cellIndices = []
-        otherIndices = []
-        weights = []
-        sliceIndices = []
-
-        for iCell in range(nCells):
-            verts = verticesOnCell[iCell, 0:nEdgesOnCell[iCell]]
-            verts = numpy.append(verts, verts[0])
-            xVert = xVertex[verts]
-            yVert = yVertex[verts]
-
-            if axis == 'x':
-                sliceAxisVerts = xVert
-                otherAxisVerts = yVert
-            else:
-                sliceAxisVerts = yVert
-                otherAxisVerts = xVert
-
-            if(numpy.amax(sliceAxisVerts) < slicePos) or \
-                    (numpy.amin(sliceAxisVerts) > slicePos):
-                # this polygon doesn't intersect the slice
-                continue
-
-            mpasPolygon = Polygon(zip(xVert, yVert))
-
-            indices = numpy.nonzero(
-                outOtherAxis < numpy.amin(otherAxisVerts))[0]
-            if len(indices) == 0:
-                lower = 0
-            else:
-                lower = indices[-1]
-
-            indices = numpy.nonzero(
-                outOtherAxis > numpy.amax(otherAxisVerts))[0]
-            if len(indices) == 0:
-                upper = outNOther
-            else:
-                upper = indices[0]
-
-            for otherIndex in range(lower, upper):
-                if axis == 'x':
-                    vertices = ((slicePos, outOtherAxis[otherIndex]),
-                                (slicePos, outOtherAxis[otherIndex + 1]))
-                else:
-                    vertices = ((outOtherAxis[otherIndex], slicePos),
-                                (outOtherAxis[otherIndex + 1], slicePos))
-
-                line = LineString(vertices)
-                if not mpasPolygon.intersects(line):
-                    continue
-                length = mpasPolygon.intersection(line).length
-                if length == 0.0:
-                    continue
-
-                cellIndices.append(iCell)
-                otherIndices.append(otherIndex)
-
-                weights.append(length / outDx)
-
-                sliceIndex = sliceCount[otherIndex]
-                sliceCount[otherIndex] += 1
-                sliceIndices.append(sliceIndex)
-            if show_progress:
-                pbar.update(iCell + 1)
-
-        if show_progress:
-            pbar.finish()
-
-        cellIndices = numpy.array(cellIndices)
-        otherIndices = numpy.array(otherIndices)
-        sliceIndices = numpy.array(sliceIndices)
-        weights = numpy.array(weights)
-
-        # sort the intersections first by otherIndex, then by sliceIndex
-        # for efficiency
-        nSlices = numpy.amax(sliceCount)
-        sortedIndices = numpy.zeros(0, int)
-        for sliceIndex in range(nSlices):
-            intersectionsInSlice = numpy.nonzero(sliceIndices == sliceIndex)[0]
-            indices = numpy.argsort(otherIndices[intersectionsInSlice])
-            sortedIndices = numpy.append(
-                sortedIndices, intersectionsInSlice[indices])
-
-        outFile = Dataset(outFileName, 'w', format='NETCDF4')
-        outFile.createDimension('nIntersections', len(cellIndices))
-        outFile.createVariable('cellIndices', 'i4', ('nIntersections',))
-        if axis == 'x':
-            outFile.createVariable('yIndices', 'i4', ('nIntersections',))
-        else:
-            outFile.createVariable('xIndices', 'i4', ('nIntersections',))
-        outFile.createVariable('sliceIndices', 'i4', ('nIntersections',))
-        outFile.createVariable(
-            'mpasToMisomipWeights', 'f8', ('nIntersections',))
-
-        outVars = outFile.variables
-        outVars['cellIndices'][:] = cellIndices[sortedIndices]
-        if axis == 'x':
-            outVars['yIndices'][:] = otherIndices[sortedIndices]
-        else:
-            outVars['xIndices'][:] = otherIndices[sortedIndices]
-
-        outVars['sliceIndices'][:] = sliceIndices[sortedIndices]
-        outVars['mpasToMisomipWeights'][:] = weights[sortedIndices]
-
-        outFile.close()
-
+def _compute_misomip_interp_coeffs(in_dir):
     meshFileName = '{}/init.nc'.format(in_dir)
     interpWeightsFileName = 'horiz_map.nc'
     xTransectFileName = 'x_trans_map.nc'
@@ -216,7 +86,6 @@ def _compute_misomip_interp_coeffs(in_dir, show_progress):
 
     inFile = Dataset(meshFileName, 'r')
 
-    nCells = len(inFile.dimensions['nCells'])
     inVars = inFile.variables
     nEdgesOnCell = inVars['nEdgesOnCell'][:]
     verticesOnCell = inVars['verticesOnCell'][:, :] - 1
@@ -224,223 +93,103 @@ def _compute_misomip_interp_coeffs(in_dir, show_progress):
     yVertex = inVars['yVertex'][:]
 
     inFile.close()
-    if(not os.path.exists(interpWeightsFileName)):
 
-        cellIndices = []
-        xIndices = []
-        yIndices = []
-        weights = []
-        sliceIndices = []
+    mpasPolygons = _get_mpas_polygons(nEdgesOnCell, verticesOnCell, xVertex,
+                                      yVertex)
 
-        sliceCount = numpy.zeros((outNy, outNx), int)
+    if not os.path.exists(interpWeightsFileName):
+        # the MISOMIP grid boxes in the same (row-major) order as the output
+        # fields
+        xMin, yMin = numpy.meshgrid(x[0:-1], y[0:-1])
+        xMax, yMax = numpy.meshgrid(x[1:], y[1:])
+        outPolygons = shapely.box(xMin.ravel(), yMin.ravel(), xMax.ravel(),
+                                  yMax.ravel())
 
-        if show_progress:
-            pbar = ProgressBar(
-                widgets=[
-                    'compute MPAS and MISOMIP intersections',
-                    Percentage(),
-                    Bar(),
-                    ETA()],
-                maxval=nCells).start()
-        else:
-            pbar = None
-
-        for iCell in range(nCells):
-            verts = verticesOnCell[iCell, 0:nEdgesOnCell[iCell]]
-            verts = numpy.append(verts, verts[0])
-            xVert = xVertex[verts]
-            yVert = yVertex[verts]
-            mpasPolygon = Polygon(zip(xVert, yVert))
-
-            # find the out indices that bound the MPAS polygon
-            indices = numpy.nonzero(x < numpy.amin(xVert))[0]
-            if len(indices) == 0:
-                xl = 0
-            else:
-                xl = indices[-1]
-
-            indices = numpy.nonzero(x > numpy.amax(xVert))[0]
-            if len(indices) == 0:
-                xu = outNx
-            else:
-                xu = indices[0]
-
-            indices = numpy.nonzero(y < numpy.amin(yVert))[0]
-            if len(indices) == 0:
-                yl = 0
-            else:
-                yl = indices[-1]
-
-            indices = numpy.nonzero(y > numpy.amax(yVert))[0]
-            if len(indices) == 0:
-                yu = outNy
-            else:
-                yu = indices[0]
-
-            for yIndex in range(yl, yu):
-                for xIndex in range(xl, xu):
-                    vertices = ((x[xIndex], y[yIndex]),
-                                (x[xIndex + 1], y[yIndex]),
-                                (x[xIndex + 1], y[yIndex + 1]),
-                                (x[xIndex], y[yIndex + 1]),
-                                (x[xIndex], y[yIndex]))
-                    outPoly = Polygon(vertices)
-                    if not mpasPolygon.intersects(outPoly):
-                        continue
-                    intersectionArea = mpasPolygon.intersection(outPoly).area
-                    if intersectionArea == 0.:
-                        continue
-
-                    cellIndices.append(iCell)
-                    xIndices.append(xIndex)
-                    yIndices.append(yIndex)
-
-                    weights.append(intersectionArea / outDx**2)
-
-                    sliceIndex = sliceCount[yIndex, xIndex]
-                    sliceCount[yIndex, xIndex] += 1
-                    sliceIndices.append(sliceIndex)
-            if show_progress:
-                pbar.update(iCell + 1)
+        cellIndices, outIndices, areas = _get_intersections(
+            mpasPolygons, outPolygons, shapely.area)
 
-        if show_progress:
-            pbar.finish()
-
-        cellIndices = numpy.array(cellIndices)
-        xIndices = numpy.array(xIndices)
-        yIndices = numpy.array(yIndices)
-        sliceIndices = numpy.array(sliceIndices)
-        weights = numpy.array(weights)
-
-        # sort the intersections first by xIndex, then by yIndex, then by
-        # sliceIndex for efficiency
-        nSlices = numpy.amax(sliceCount)
-        sortedIndices = numpy.zeros(0, int)
-        xyIndices = xIndices + outNx * yIndices
-        for sliceIndex in range(nSlices):
-            intersectionsInSlice = numpy.nonzero(sliceIndices == sliceIndex)[0]
-            indices = numpy.argsort(xyIndices[intersectionsInSlice])
-            sortedIndices = numpy.append(
-                sortedIndices, intersectionsInSlice[indices])
+        # sort the intersections by output grid box (the row of the sparse
+        # matrix) and then by MPAS cell
+        sortedIndices = numpy.lexsort((cellIndices, outIndices))
+        cellIndices = cellIndices[sortedIndices]
+        outIndices = outIndices[sortedIndices]
+        weights = areas[sortedIndices] / outDx**2
 
         outFile = Dataset(interpWeightsFileName, 'w', format='NETCDF4')
         outFile.createDimension('nIntersections', len(cellIndices))
         outFile.createVariable('cellIndices', 'i4', ('nIntersections',))
         outFile.createVariable('xIndices', 'i4', ('nIntersections',))
         outFile.createVariable('yIndices', 'i4', ('nIntersections',))
-        outFile.createVariable('sliceIndices', 'i4', ('nIntersections',))
         outFile.createVariable(
             'mpasToMisomipWeights', 'f8', ('nIntersections',))
 
         outVars = outFile.variables
-        outVars['cellIndices'][:] = cellIndices[sortedIndices]
-        outVars['xIndices'][:] = xIndices[sortedIndices]
-        outVars['yIndices'][:] = yIndices[sortedIndices]
-        outVars['sliceIndices'][:] = sliceIndices[sortedIndices]
-        outVars['mpasToMisomipWeights'][:] = weights[sortedIndices]
+        outVars['cellIndices'][:] = cellIndices
+        outVars['xIndices'][:] = numpy.mod(outIndices, outNx)
+        outVars['yIndices'][:] = outIndices // outNx
+        outVars['mpasToMisomipWeights'][:] = weights
 
         outFile.close()
 
-    if(not os.path.exists(xTransectFileName)):
-        getTransectWeights(xTransectFileName, axis='x')
+    if not os.path.exists(xTransectFileName):
+        _write_transect_weights(xTransectFileName, mpasPolygons, axis='x',
+                                slicePos=xTransect, outOtherAxis=y,
+                                outDx=outDx)
 
-    if(not os.path.exists(yTransectFileName)):
-        getTransectWeights(yTransectFileName, axis='y')
+    if not os.path.exists(yTransectFileName):
+        _write_transect_weights(yTransectFileName, mpasPolygons, axis='y',
+                                slicePos=yTransect, outOtherAxis=x,
+                                outDx=outDx)
 
 
 def _interp_misomip(in_dir, sf_dir, out_file_name, show_progress):
 
     def interpHoriz(field, inMask=None, outFraction=None):
+        # field is either a single field or a stack of fields with shape
+        # (nCells, nFields), all remapped with one sparse matrix multiply
+        field = numpy.asarray(field, dtype=float)
         if inMask is not None:
-            field = field * inMask
-        outField = numpy.zeros((outNy, outNx))
-        for sliceIndex in range(xyNSlices):
-            mask = xySliceIndices == sliceIndex
-            cellsSlice = xyCellIndices[mask]
-            fieldSlice = field[cellsSlice]
-            outField[xyYIndices[mask], xyXIndices[mask]
-                     ] += (xyMpasToMisomipWeights[mask] * fieldSlice)
+            field = (field.T * inMask).T
+        outField = xyMap.dot(field)
+        outField = outField.T.reshape(field.shape[1:] + (outNy, outNx))
         if outFraction is not None:
-            mask = outFraction > normalizationThreshold
-            outField[mask] /= outFraction[mask]
-            outField[numpy.logical_not(mask)] = 0.
+            outField = normalize(outField, outFraction)
         return outField
 
+    def normalize(outField, outFraction):
+        mask = outFraction > normalizationThreshold
+        return numpy.where(mask, outField / numpy.where(mask, outFraction, 1.),
+                           0.)
+
     def interpHorizOcean(field):
         return interpHoriz(field, cellOceanMask, xyOceanFraction)
 
-    def interpHorizCavity(field):
-        return interpHoriz(field, inCavityFraction, outCavityFraction)
-
-    def interpXZTransect(field, normalize=True):
-        outField = numpy.zeros((outNz, outNx))
-
-        for sliceIndex in range(xzNSlices):
-            mask = xzSliceIndices == sliceIndex
-            cellsSlice = xzCellIndices[mask]
-            xIndices = xzXIndices[mask]
-            weights = xzMpasToMisomipWeights[mask]
-            for index in range(len(cellsSlice)):
-                iCell = cellsSlice[index]
-                xIndex = xIndices[index]
-                weight = weights[index]
-                layerThick = layerThickness[iCell, :]
-                layerThick[0:minLevelCell[iCell]] = 0.
-                layerThick[maxLevelCell[iCell] + 1:] = 0.
-                zInterface = numpy.zeros(2 * nVertLevels)
-                fieldColumn = numpy.zeros(2 * nVertLevels)
-                fieldColumn[0::2] = field[iCell, :]
-                fieldColumn[1::2] = field[iCell, :]
-                zInterface[0] = ssh[iCell]
-                zInterface[1::2] = ssh[iCell] - numpy.cumsum(layerThick[:])
-                zInterface[2::2] = ssh[iCell] - numpy.cumsum(layerThick[:-1])
-                outField[:,
-                         xIndex] += weight * numpy.interp(z,
-                                                          zInterface[::-1],
-                                                          fieldColumn[::-1],
-                                                          left=0.,
-                                                          right=0.)
-
-        if normalize:
-            outField[xzOceanMask] /= xzOceanFraction[xzOceanMask]
-            outField[numpy.logical_not(xzOceanMask)] = 0.
-
-        return outField
-
-    def interpYZTransect(field, normalize=True):
-        outField = numpy.zeros((outNz, outNy))
-
-        for sliceIndex in range(yzNSlices):
-            mask = yzSliceIndices == sliceIndex
-            cellsSlice = yzCellIndices[mask]
-            yIndices = yzYIndices[mask]
-            weights = yzMpasToMisomipWeights[mask]
-            for index in range(len(cellsSlice)):
-                iCell = cellsSlice[index]
-                yIndex = yIndices[index]
-                weight = weights[index]
-                layerThick = layerThickness[iCell, :]
-                layerThick[0:minLevelCell[iCell]] = 0.
-                layerThick[maxLevelCell[iCell] + 1:] = 0.
-                zInterface = numpy.zeros(2 * nVertLevels)
-                fieldColumn = numpy.zeros(2 * nVertLevels)
-                fieldColumn[0::2] = field[iCell, :]
-                fieldColumn[1::2] = field[iCell, :]
-                zInterface[0] = ssh[iCell]
-                zInterface[1::2] = ssh[iCell] - numpy.cumsum(layerThick[:])
-                zInterface[2::2] = ssh[iCell] - numpy.cumsum(layerThick[:-1])
-                outField[:,
-                         yIndex] += weight * numpy.interp(z,
-                                                          zInterface[::-1],
-                                                          fieldColumn[::-1],
-                                                          left=0.,
-                                                          right=0.)
-
-        if normalize:
-            outField[yzOceanMask] /= yzOceanFraction[yzOceanMask]
-            outField[numpy.logical_not(yzOceanMask)] = 0.
-
-        return outField
+    def interpTransect(cellIndices, outIndices, weights, nOut, fields):
+        # a sparse operator from each (cell, level) to each (z, out index)
+        # on the transect for the current ssh and layer thickness.  Each
+        # output z gets the value of the layer that contains it, weighted by
+        # the length of the intersection between the cell and the transect.
+        thickness = numpy.where(cellMask[cellIndices, :] > 0.,
+                                layerThickness[cellIndices, :], 0.)
+        zTop = ssh[cellIndices]
+        zBot = zTop[:, numpy.newaxis] - numpy.cumsum(thickness, axis=1)
+        levels = numpy.sum(zBot[:, numpy.newaxis, :] >
+                           z[numpy.newaxis, :, numpy.newaxis], axis=2)
+        valid = numpy.logical_and(z[numpy.newaxis, :] < zTop[:, numpy.newaxis],
+                                  levels < nVertLevels)
+        intersections, zIndices = numpy.nonzero(valid)
+        rows = zIndices * nOut + outIndices[intersections]
+        cols = cellIndices[intersections] * nVertLevels + \
+            levels[intersections, zIndices]
+        transectMap = scipy.sparse.csr_matrix(
+            (weights[intersections], (rows, cols)),
+            shape=(outNz * nOut, nCells * nVertLevels))
+
+        # all fields are remapped with one sparse matrix multiply
+        fields = numpy.stack([numpy.asarray(field, dtype=float).ravel() for
+                              field in fields], axis=1)
+        outFields = transectMap.dot(fields)
+        return outFields.T.reshape((len(fields.T), outNz, nOut))
 
     def writeMetric(varName, metric):
         vars[varName][tIndex] = metric
@@ -464,33 +213,19 @@ def _interp_misomip(in_dir, sf_dir, out_file_name, show_progress):
     outNx, outNy, outNz, x, y, z, xTransect, yTransect, outDx, outDz = \
         _get_out_grid(corners=False)
 
-    inFile = Dataset('horiz_map.nc', 'r')
-    inVars = inFile.variables
-    xyCellIndices = inVars['cellIndices'][:]
-    xyXIndices = inVars['xIndices'][:]
-    xyYIndices = inVars['yIndices'][:]
-    xySliceIndices = inVars['sliceIndices'][:]
-    xyMpasToMisomipWeights = inVars['mpasToMisomipWeights'][:]
-    inFile.close()
-    xyNSlices = numpy.amax(xySliceIndices) + 1
-
     inFile = Dataset('x_trans_map.nc', 'r')
     inVars = inFile.variables
-    yzCellIndices = inVars['cellIndices'][:]
-    yzYIndices = inVars['yIndices'][:]
-    yzSliceIndices = inVars['sliceIndices'][:]
-    yzMpasToMisomipWeights = inVars['mpasToMisomipWeights'][:]
+    yzCellIndices = numpy.asarray(inVars['cellIndices'][:])
+    yzYIndices = numpy.asarray(inVars['yIndices'][:])
+    yzMpasToMisomipWeights = numpy.asarray(inVars['mpasToMisomipWeights'][:])
     inFile.close()
-    yzNSlices = numpy.amax(yzSliceIndices) + 1
 
     inFile = Dataset('y_trans_map.nc', 'r')
     inVars = inFile.variables
-    xzCellIndices = inVars['cellIndices'][:]
-    xzXIndices = inVars['xIndices'][:]
-    xzSliceIndices = inVars['sliceIndices'][:]
-    xzMpasToMisomipWeights = inVars['mpasToMisomipWeights'][:]
+    xzCellIndices = numpy.asarray(inVars['cellIndices'][:])
+    xzXIndices = numpy.asarray(inVars['xIndices'][:])
+    xzMpasToMisomipWeights = numpy.asarray(inVars['mpasToMisomipWeights'][:])
     inFile.close()
-    xzNSlices = numpy.amax(xzSliceIndices) + 1
 
     dynamicTopo = False
 
@@ -645,6 +380,18 @@ def _interp_misomip(in_dir, sf_dir, out_file_name, show_progress):
     else:
         nTimeOut = 0
 
+    # the horizontal remapping is a sparse matrix from MPAS cells to MISOMIP
+    # grid boxes (in row-major order)
+    inFile = Dataset('horiz_map.nc', 'r')
+    inVars = inFile.variables
+    xyCellIndices = inVars['cellIndices'][:]
+    xyOutIndices = inVars['xIndices'][:] + outNx * inVars['yIndices'][:]
+    xyMpasToMisomipWeights = inVars['mpasToMisomipWeights'][:]
+    inFile.close()
+    xyMap = scipy.sparse.csr_matrix(
+        (xyMpasToMisomipWeights, (xyOutIndices, xyCellIndices)),
+        shape=(outNy * outNx, nCells))
+
     areaCell = initFile.variables['areaCell'][:]
     bathymetry = -initFile.variables['bottomDepth'][:]
     minLevelCell = initFile.variables['minLevelCell'][:] - 1
@@ -687,8 +434,6 @@ def _interp_misomip(in_dir, sf_dir, out_file_name, show_progress):
 
         freshwaterFlux = inVars['timeMonthly_avg_landIceFreshwaterFlux'][0, :]
         inCavityFraction = inVars['timeMonthly_avg_landIceFraction'][0, :]
-        outCavityFraction = interpHoriz(inCavityFraction)
-        outCavityMask = outCavityFraction > normalizationThreshold
         meltRate = freshwaterFlux / rho_fw
 
         if not numpy.all(inCavityFraction == 0.):
@@ -715,27 +460,6 @@ def _interp_misomip(in_dir, sf_dir, out_file_name, show_progress):
 
         bsfCell = 1e6 * bsfFile.variables['bsfCell'][tIndex, :]
 
-        # meltRate is already multiplied by inCavityFraction, so no in masking
-        writeVar(
-            'meltRate',
-            interpHoriz(
-                meltRate,
-                inMask=None,
-                outFraction=outCavityFraction),
-            outCavityMask)
-        writeVar(
-            'thermalDriving',
-            interpHorizCavity(thermalDriving),
-            outCavityMask)
-        writeVar(
-            'halineDriving',
-            interpHorizCavity(halineDriving),
-            outCavityMask)
-        writeVar('frictionVelocity', interpHorizCavity(frictionVelocity),
-                 outCavityMask)
-        writeVar('barotropicStreamfunction', interpHorizOcean(bsfCell),
-                 xyOceanMask)
-
         temperature = \
             inVars['timeMonthly_avg_activeTracers_temperature'][0, :, :]
         salinity = inVars['timeMonthly_avg_activeTracers_salinity'][0, :, :]
@@ -745,10 +469,44 @@ def _interp_misomip(in_dir, sf_dir, out_file_name, show_progress):
         bottomTemperature = temperature[indices, maxLevelCell]
         bottomSalinity = salinity[indices, maxLevelCell]
 
-        writeVar('bottomTemperature', interpHorizOcean(bottomTemperature),
-                 xyOceanMask)
-        writeVar('bottomSalinity', interpHorizOcean(bottomSalinity),
-                 xyOceanMask)
+        uTop = inVars['timeMonthly_avg_velocityX'][0, :, 0]
+        vTop = inVars['timeMonthly_avg_velocityY'][0, :, 0]
+
+        # remap all the 2D fields with a single sparse matrix multiply.
+        # Fields in the cavity are weighted by the land-ice fraction (meltRate
+        # is already multiplied by inCavityFraction) and the others by the
+        # ocean mask
+        (outCavityFraction, outMeltRate, outThermalDriving, outHalineDriving,
+         outFrictionVelocity, outUTop, outVTop, outBsf, outBottomTemperature,
+         outBottomSalinity) = interpHoriz(numpy.stack(
+            [inCavityFraction,
+             meltRate,
+             inCavityFraction * thermalDriving,
+             inCavityFraction * halineDriving,
+             inCavityFraction * frictionVelocity,
+             inCavityFraction * uTop,
+             inCavityFraction * vTop,
+             cellOceanMask * bsfCell,
+             cellOceanMask * bottomTemperature,
+             cellOceanMask * bottomSalinity], axis=1))
+
+        outCavityMask = outCavityFraction > normalizationThreshold
+
+        for varName, outField in [('meltRate', outMeltRate),
+                                  ('thermalDriving', outThermalDriving),
+                                  ('halineDriving', outHalineDriving),
+                                  ('frictionVelocity', outFrictionVelocity),
+                                  ('uBoundaryLayer', outUTop),
+                                  ('vBoundaryLayer', outVTop)]:
+            writeVar(varName, normalize(outField, outCavityFraction),
+                     outCavityMask)
+
+        for varName, outField in [
+                ('barotropicStreamfunction', outBsf),
+                ('bottomTemperature', outBottomTemperature),
+                ('bottomSalinity', outBottomSalinity)]:
+            writeVar(varName, normalize(outField, xyOceanFraction),
+                     xyOceanMask)
 
         writeMetric(
             'meanTemperature',
@@ -769,11 +527,6 @@ def _interp_misomip(in_dir, sf_dir, out_file_name, show_progress):
                 cellMask *
                 layerThickness))
 
-        uTop = inVars['timeMonthly_avg_velocityX'][0, :, 0]
-        vTop = inVars['timeMonthly_avg_velocityY'][0, :, 0]
-        writeVar('uBoundaryLayer', interpHorizCavity(uTop), outCavityMask)
-        writeVar('vBoundaryLayer', interpHorizCavity(vTop), outCavityMask)
-
         osf = 1e6 * osfFile.variables['osf'][tIndex, :, :]
         osfX = osfFile.variables['x'][:]
         osfZ = osfFile.variables['z'][:]
@@ -783,17 +536,28 @@ def _interp_misomip(in_dir, sf_dir, out_file_name, show_progress):
 
         writeVar('overturningStreamfunction', osf)
 
-        xzOceanFraction = interpXZTransect(cellMask, normalize=False)
-        xzOceanMask = xzOceanFraction > 0.001
+        ssh = numpy.asarray(ssh, dtype=float)
+        layerThickness = numpy.asarray(layerThickness, dtype=float)
+
+        xzOceanFraction, xzTemperature, xzSalinity = interpTransect(
+            xzCellIndices, xzXIndices, xzMpasToMisomipWeights, outNx,
+            [cellMask, temperature, salinity])
+        xzOceanMask = xzOceanFraction > normalizationThreshold
 
-        yzOceanFraction = interpYZTransect(cellMask, normalize=False)
-        yzOceanMask = yzOceanFraction > 0.001
+        yzOceanFraction, yzTemperature, yzSalinity = interpTransect(
+            yzCellIndices, yzYIndices, yzMpasToMisomipWeights, outNy,
+            [cellMask, temperature, salinity])
+        yzOceanMask = yzOceanFraction > normalizationThreshold
 
-        writeVar('temperatureXZ', interpXZTransect(temperature), xzOceanMask)
-        writeVar('salinityXZ', interpXZTransect(salinity), xzOceanMask)
+        writeVar('temperatureXZ', normalize(xzTemperature, xzOceanFraction),
+                 xzOceanMask)
+        writeVar('salinityXZ', normalize(xzSalinity, xzOceanFraction),
+                 xzOceanMask)
 
-        writeVar('temperatureYZ', interpYZTransect(temperature), yzOceanMask)
-        writeVar('salinityYZ', interpYZTransect(salinity), yzOceanMask)
+        writeVar('temperatureYZ', normalize(yzTemperature, yzOceanFraction),
+                 yzOceanMask)
+        writeVar('salinityYZ', normalize(yzSalinity, yzOceanFraction),
+                 yzOceanMask)
         if show_progress:
             pbar.update(tIndex + 1)
 
@@ -829,3 +593,78 @@ def _get_out_grid(corners):
         z = -outDz*(numpy.arange(outNz)+0.5)
 
     return outNx, outNy, outNz, x, y, z, xTransect, yTransect, outDx, outDz
+
+
+def _get_mpas_polygons(nEdgesOnCell, verticesOnCell, xVertex, yVertex):
+    """ Make an array of polygons for the MPAS cells """
+    nEdgesOnCell = numpy.asarray(nEdgesOnCell)
+    verticesOnCell = numpy.asarray(verticesOnCell)
+    nCells, maxEdges = verticesOnCell.shape
+    validVertices = numpy.arange(maxEdges) < nEdgesOnCell[:, numpy.newaxis]
+    verts = verticesOnCell[validVertices]
+    coords = numpy.stack((numpy.asarray(xVertex)[verts],
+                          numpy.asarray(yVertex)[verts]), axis=1)
+    cellIndices = numpy.repeat(numpy.arange(nCells), nEdgesOnCell)
+    return shapely.polygons(shapely.linearrings(coords, indices=cellIndices))
+
+
+def _get_intersections(mpasPolygons, outGeometries, measure):
+    """
+    Find the intersections between MPAS cells and output geometries (grid
+    boxes or transect segments) with a spatial index and compute their size
+    (area or length) with the given function, keeping only intersections of
+    nonzero size
+    """
+    tree = shapely.STRtree(outGeometries)
+    cellIndices, outIndices = tree.query(mpasPolygons, predicate='intersects')
+    intersections = shapely.intersection(mpasPolygons[cellIndices],
+                                         outGeometries[outIndices])
+    sizes = measure(intersections)
+    mask = sizes > 0.
+    return cellIndices[mask], outIndices[mask], sizes[mask]
+
+
+def _write_transect_weights(outFileName, mpasPolygons, axis, slicePos,
+                            outOtherAxis, outDx):
+    """
+    Compute the weights for interpolating from MPAS cells to segments along a
+    transect at ``x = slicePos`` (``axis = 'x'``) or ``y = slicePos``
+    (``axis = 'y'``) and write them out
+    """
+    outNOther = len(outOtherAxis) - 1
+    sliceCoords = slicePos * numpy.ones(outNOther)
+    start = (sliceCoords, outOtherAxis[0:-1])
+    end = (sliceCoords, outOtherAxis[1:])
+    if axis == 'y':
+        start = start[::-1]
+        end = end[::-1]
+    coords = numpy.stack((numpy.stack(start, axis=1),
+                          numpy.stack(end, axis=1)), axis=1)
+    segments = shapely.linestrings(coords)
+
+    cellIndices, otherIndices, lengths = _get_intersections(
+        mpasPolygons, segments, shapely.length)
+    weights = lengths / outDx
+
+    # sort the intersections by segment and then by MPAS cell
+    sortedIndices = numpy.lexsort((cellIndices, otherIndices))
+
+    outFile = Dataset(outFileName, 'w', format='NETCDF4')
+    outFile.createDimension('nIntersections', len(cellIndices))
+    outFile.createVariable('cellIndices', 'i4', ('nIntersections',))
+    if axis == 'x':
+        outFile.createVariable('yIndices', 'i4', ('nIntersections',))
+    else:
+        outFile.createVariable('xIndices', 'i4', ('nIntersections',))
+    outFile.createVariable(
+        'mpasToMisomipWeights', 'f8', ('nIntersections',))
+
+    outVars = outFile.variables
+    outVars['cellIndices'][:] = cellIndices[sortedIndices]
+    if axis == 'x':
+        outVars['yIndices'][:] = otherIndices[sortedIndices]
+    else:
+        outVars['xIndices'][:] = otherIndices[sortedIndices]
+    outVars['mpasToMisomipWeights'][:] = weights[sortedIndices]
+
+    outFile.close()
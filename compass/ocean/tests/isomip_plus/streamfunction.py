@@ -4,6 +4,7 @@ import scipy.sparse
 import scipy.sparse.linalg
 import progressbar
 import os
+import netCDF4
 from mpas_tools.io import write_netcdf
 
 from compass.step import Step
@@ -68,14 +69,13 @@ class Streamfunction(Step):
             '{}/timeSeriesStatsMonthly*.nc'.format(in_dir),
             concat_dim='Time', combine='nested')
 
-        _compute_barotropic_streamfunction(dsMesh, ds, out_dir,
-                                           show_progress=show_progress)
+        _compute_barotropic_streamfunction(dsMesh, ds, out_dir)
 
         _compute_overturning_streamfunction(dsMesh, ds, out_dir, dx=dx, dz=dz,
                                             show_progress=show_progress)
 
 
-def _compute_barotropic_streamfunction(dsMesh, ds, out_dir, show_progress):
+def _compute_barotropic_streamfunction(dsMesh, ds, out_dir):
     """
     compute the barotropic streamfunction for the given mesh and monthly-mean
     data set
@@ -85,8 +85,7 @@ def _compute_barotropic_streamfunction(dsMesh, ds, out_dir, show_progress):
     if file_complete(ds, bsfFileName):
         return
 
-    bsfVertex = _compute_barotropic_streamfunction_vertex(dsMesh, ds,
-                                                          show_progress)
+    bsfVertex = _compute_barotropic_streamfunction_vertex(dsMesh, ds)
     bsfCell = _compute_barotropic_streamfunction_cell(dsMesh, bsfVertex)
     dsBSF = xarray.Dataset()
     dsBSF['xtime_startMonthly'] = ds.xtime_startMonthly
@@ -110,6 +109,10 @@ def _compute_overturning_streamfunction(dsMesh, ds, out_dir, dx=2e3, dz=5.,
     data set.
 
     dx and dz are the resolutions of the OSF in meters
+
+    Months are appended to the output file as they are computed, so only
+    months that have been added to the monthly-mean data set since the last
+    time the OSF was computed need to be processed.
     """
 
     osfFileName = '{}/overturningStreamfunction.nc'.format(out_dir)
@@ -127,29 +130,58 @@ def _compute_overturning_streamfunction(dsMesh, ds, out_dir, dx=2e3, dz=5.,
     nz = int((zMax - zMin)/dz + 1)
     z = numpy.linspace(zMax, zMin, nz)
 
-    try:
-        os.makedirs('{}/cache'.format(out_dir))
-    except OSError:
-        pass
+    cellsOnEdge = dsMesh.cellsOnEdge.values - 1
+    internalEdges = numpy.nonzero(numpy.logical_and(
+        cellsOnEdge[:, 0] >= 0, cellsOnEdge[:, 1] >= 0))[0]
 
-    mpasTransportFileName = '{}/cache/osf_mpas_transport.nc'.format(out_dir)
-    _compute_horizontal_transport_mpas(ds, dsMesh, mpasTransportFileName)
-    ds = xarray.open_dataset(mpasTransportFileName)
+    regionOperator = _compute_region_boundary_operator(
+        dsMesh, cellsOnEdge[internalEdges, :], x)
 
-    zlevelTransportFileName = '{}/cache/osf_zlevel_transport.nc'.format(
-        out_dir)
-    _interpolate_horizontal_transport_zlevel(ds, z, zlevelTransportFileName,
-                                             show_progress)
-    ds = xarray.open_dataset(zlevelTransportFileName)
+    # we only need the internal edges on the boundary of at least one region
+    usedEdges = numpy.nonzero(abs(regionOperator).sum(axis=0).A1 > 0)[0]
+    regionOperator = regionOperator[:, usedEdges]
+    edgeIndices = internalEdges[usedEdges]
 
-    cumsumTransportFileName = '{}/cache/osf_cumsum_transport.nc'.format(
-        out_dir)
-    _vertical_cumsum_horizontal_transport(ds, cumsumTransportFileName)
-    ds = xarray.open_dataset(cumsumTransportFileName)
+    nTime = ds.sizes['Time']
+    nTimeOut = _open_osf_file(osfFileName, x, z)
+
+    if show_progress:
+        widgets = ['overturning streamfunction: ', progressbar.Percentage(),
+                   ' ', progressbar.Bar(), ' ', progressbar.ETA()]
+        bar = progressbar.ProgressBar(widgets=widgets,
+                                      maxval=nTime).start()
+    else:
+        bar = None
+
+    for tIndex in range(nTimeOut, nTime):
+        transport, mask = _compute_zlevel_transport(dsMesh, ds, tIndex,
+                                                    edgeIndices, z)
+
+        # the transport into each region between the top of the domain and
+        # each z level
+        regionTransport = regionOperator.dot(transport)
+        transportSum = numpy.zeros((nx, nz))
+        transportSum[:, 1:] = numpy.cumsum(regionTransport, axis=1)
+
+        # mask out locations on the output where no input-grid layers overlap
+        # with either the output layer above or the one below
+        regionMask = abs(regionOperator).dot(mask.astype(float)) > 0.
+        outMask = numpy.zeros((nx, nz), bool)
+        outMask[:, 0:-1] = regionMask
+        outMask[:, 1:] = numpy.logical_or(outMask[:, 1:], regionMask)
+
+        # convert to Sv
+        osf = numpy.where(outMask, 1e-6*transportSum, numpy.nan)
+
+        _append_osf(osfFileName, tIndex, osf.T,
+                    ds.xtime_startMonthly.isel(Time=tIndex).values,
+                    ds.xtime_endMonthly.isel(Time=tIndex).values)
+
+        if show_progress:
+            bar.update(tIndex+1)
 
-    cacheFileName = '{}/cache/osf_vert_slice.nc'.format(out_dir)
-    _horizontally_bin_overturning_streamfunction(ds, dsMesh, x, osfFileName,
-                                                 cacheFileName, show_progress)
+    if show_progress:
+        bar.finish()
 
 
 def _compute_barotorpic_transport(dsMesh, ds):
@@ -181,11 +213,10 @@ def _compute_barotorpic_transport(dsMesh, ds):
     return innerEdges, transport
 
 
-def _compute_barotropic_streamfunction_vertex(dsMesh, ds, show_progress):
+def _compute_barotropic_streamfunction_vertex(dsMesh, ds):
     innerEdges, transport = _compute_barotorpic_transport(dsMesh, ds)
 
     nVertices = dsMesh.sizes['nVertices']
-    nTime = ds.sizes['Time']
 
     cellsOnVertex = dsMesh.cellsOnVertex - 1
     verticesOnEdge = dsMesh.verticesOnEdge - 1
@@ -223,38 +254,29 @@ def _compute_barotropic_streamfunction_vertex(dsMesh, ds, show_progress):
     indices[1, 2*nInnerEdges + ind] = boundaryVertices
     data[2*nInnerEdges + ind] = 1.
 
-    bsfVertex = xarray.DataArray(numpy.zeros((nTime, nVertices)),
-                                 dims=('Time', 'nVertices'))
+    M = scipy.sparse.csr_matrix((data, indices),
+                                shape=(nInnerEdges+nBoundaryVertices,
+                                       nVertices))
 
-    if show_progress:
-        widgets = ['barotropic streamfunction: ', progressbar.Percentage(),
-                   ' ', progressbar.Bar(), ' ', progressbar.ETA()]
-        bar = progressbar.ProgressBar(widgets=widgets,
-                                      maxval=nTime).start()
-    else:
-        bar = None
+    # Only the transport (the right-hand side) changes in time, so we solve
+    # the normal equations of the least-squares problem for all time levels
+    # at once with a single sparse LU factorization.  The matrix is a graph
+    # Laplacian plus the boundary constraints, so it is symmetric positive
+    # definite as long as each vertex is connected to the boundary.
+    # Vertices that are not on any inner edge are not constrained, so we
+    # set the streamfunction there to zero.
+    MTM = (M.T @ M).tocsc()
+    unconstrained = MTM.diagonal() == 0.
+    MTM = MTM + scipy.sparse.diags(unconstrained.astype(float), format='csc')
+    lu = scipy.sparse.linalg.splu(MTM)
 
-    for tIndex in range(nTime):
-        rhs = numpy.zeros(nInnerEdges+nBoundaryVertices, dtype=float)
+    # convert to Sv
+    rhs = 1e-6*transport.transpose('nEdges', 'Time').values
+    rhs = M[0:nInnerEdges, :].T @ rhs
 
-        # convert to Sv
-        ind = numpy.arange(nInnerEdges)
-        rhs[ind] = 1e-6*transport.isel(Time=tIndex)
+    solution = lu.solve(rhs)
 
-        ind = numpy.arange(nBoundaryVertices)
-        rhs[nInnerEdges + ind] = 0.
-
-        M = scipy.sparse.csr_matrix((data, indices),
-                                    shape=(nInnerEdges+nBoundaryVertices,
-                                           nVertices))
-
-        solution = scipy.sparse.linalg.lsqr(M, rhs)
-
-        bsfVertex[tIndex, :] = -solution[0]
-        if show_progress:
-            bar.update(tIndex+1)
-    if show_progress:
-        bar.finish()
+    bsfVertex = xarray.DataArray(-solution.T, dims=('Time', 'nVertices'))
 
     return bsfVertex
 
@@ -280,359 +302,142 @@ def _compute_barotropic_streamfunction_cell(dsMesh, bsfVertex):
     return bsfCell
 
 
-def _compute_horizontal_transport_mpas(ds, dsMesh, outFileName):
+def _compute_region_boundary_operator(dsMesh, cellsOnEdge, x):
     """
-    compute the horizontal transport through edges on the native MPAS grid.
+    Compute a sparse operator with the signs (indicating fluxes into each
+    region) of the internal edges on the boundary of each region
+    ``xCell >= x``, so that the transport into all regions can be computed
+    with a single sparse matrix multiplication
     """
+    # according to the mesh spec, normals point from cell 0 to cell 1 on a
+    # given edge:
+    # https://mpas-dev.github.io/files/documents/MPAS-MeshSpec.pdf
+    xCell = dsMesh.xCell.values
+    x0 = xCell[cellsOnEdge[:, 0]]
+    x1 = xCell[cellsOnEdge[:, 1]]
 
-    if file_complete(ds, outFileName):
-        return
+    # an edge is on the boundary of each region where one cell is in the
+    # region and the other is not
+    xIndexStart = numpy.searchsorted(x, numpy.minimum(x0, x1), side='right')
+    xIndexEnd = numpy.searchsorted(x, numpy.maximum(x0, x1), side='right')
+    counts = xIndexEnd - xIndexStart
 
-    cellsOnEdge = dsMesh.cellsOnEdge - 1
-    minLevelCell = dsMesh.minLevelCell - 1
-    maxLevelCell = dsMesh.maxLevelCell - 1
+    edgeIndices = numpy.repeat(numpy.arange(len(x0)), counts)
+    offsets = numpy.arange(len(edgeIndices)) - \
+        numpy.repeat(numpy.cumsum(counts) - counts, counts)
+    xIndices = numpy.repeat(xIndexStart, counts) + offsets
 
-    cell0 = cellsOnEdge[:, 0]
-    cell1 = cellsOnEdge[:, 1]
-
-    internalEdgeIndices = xarray.DataArray(
-        numpy.nonzero(numpy.logical_and(cell0.values >= 0,
-                                        cell1.values >= 0))[0],
-        dims=('nInternalEdges',))
-
-    cell0 = cell0[internalEdgeIndices]
-    cell1 = cell1[internalEdgeIndices]
-
-    bottomDepth = dsMesh.bottomDepth
-
-    minLevelEdgeBot = minLevelCell[cell0]
-    mask = numpy.logical_or(cell0 == -1,
-                            minLevelCell[cell1] > minLevelEdgeBot)
-    minLevelEdgeBot[mask] = minLevelCell[cell1][mask]
-
-    maxLevelEdgeTop = maxLevelCell[cell0]
-    mask = numpy.logical_or(cell0 == -1,
-                            maxLevelCell[cell1] < maxLevelEdgeTop)
-    maxLevelEdgeTop[mask] = maxLevelCell[cell1][mask]
-
-    nVertLevels = dsMesh.sizes['nVertLevels']
-
-    vertIndex = \
-        xarray.DataArray.from_dict({'dims': ('nVertLevels',),
-                                    'data': numpy.arange(nVertLevels)})
-
-    ds = ds.chunk({'Time': 1})
-
-    chunks = {'nInternalEdges': 1024}
-    minLevelEdgeBot = minLevelEdgeBot.chunk(chunks)
-    maxLevelEdgeTop = maxLevelEdgeTop.chunk(chunks)
-    dvEdge = dsMesh.dvEdge[internalEdgeIndices].chunk(chunks)
-    bottomDepthEdge = 0.5*(bottomDepth[cell0] +
-                           bottomDepth[cell1]).chunk(chunks)
-
-    chunks = {'Time': 1, 'nInternalEdges': 1024}
-
-    normalVelocity = ds.timeMonthly_avg_normalVelocity.isel(
-        nEdges=internalEdgeIndices).chunk(chunks)
-    layerThickness = ds.timeMonthly_avg_layerThickness.chunk()
-
-    layerThicknessEdge = 0.5*(layerThickness.isel(nCells=cell0) +
-                              layerThickness.isel(nCells=cell1)).chunk(chunks)
-
-    mask = numpy.logical_and(vertIndex >= minLevelEdgeBot,
-                             vertIndex <= maxLevelEdgeTop)
-    layerThicknessEdge = layerThicknessEdge.where(mask, other=0.)
-
-    thicknessSum = layerThicknessEdge.sum(dim='nVertLevels')
-
-    thicknessCumSum = layerThicknessEdge.cumsum(dim='nVertLevels')
-
-    zSurface = thicknessSum - bottomDepthEdge
+    # the sign is positive if the normal points into the region (i.e. if
+    # cell 1 is in the region) and negative otherwise
+    signs = numpy.where(x1 > x0, 1., -1.)[edgeIndices]
 
-    zInterfaceEdge = -thicknessCumSum + zSurface
+    return scipy.sparse.csr_matrix((signs, (xIndices, edgeIndices)),
+                                   shape=(len(x), len(x0)))
 
-    zInterfaceEdge = xarray.concat(
-        [zSurface.expand_dims(dim='nVertLevelsP1', axis=2),
-         zInterfaceEdge.rename({'nVertLevels': 'nVertLevelsP1'})],
-        dim='nVertLevelsP1')
 
-    transportPerDepth = dvEdge*normalVelocity
-
-    dsOut = xarray.Dataset()
-    dsOut['xtime_startMonthly'] = ds.xtime_startMonthly
-    dsOut['xtime_endMonthly'] = ds.xtime_endMonthly
-    dsOut['zInterfaceEdge'] = zInterfaceEdge
-    dsOut['layerThicknessEdge'] = layerThicknessEdge
-    dsOut['transportPerDepth'] = transportPerDepth
-    dsOut['transportVertSum'] = \
-        (transportPerDepth*layerThicknessEdge).sum(dim='nVertLevels')
-
-    dsOut = dsOut.transpose('Time', 'nInternalEdges', 'nVertLevels',
-                            'nVertLevelsP1')
-
-    print('compute and caching transport on MPAS grid:')
-    write_netcdf(dsOut, outFileName)
-
-
-def _interpolate_horizontal_transport_zlevel(ds, z, outFileName,
-                                             show_progress):
+def _compute_zlevel_transport(dsMesh, ds, tIndex, edgeIndices, z):
     """
-    interpolate the horizontal transport through edges onto a z-level grid.
+    compute the horizontal transport through the given edges at the given
+    time index, interpolated onto the layers between the z levels, and a mask
+    of where MPAS layers overlap with each z-level layer
     """
+    cellsOnEdge = dsMesh.cellsOnEdge.values[edgeIndices, :] - 1
+    cell0 = cellsOnEdge[:, 0]
+    cell1 = cellsOnEdge[:, 1]
+    minLevelCell = dsMesh.minLevelCell.values - 1
+    maxLevelCell = dsMesh.maxLevelCell.values - 1
+    bottomDepth = dsMesh.bottomDepth.values
 
-    if file_complete(ds, outFileName):
-        return
-
-    ds = ds.chunk({'Time': 1, 'nInternalEdges': None, 'nVertLevels': 1,
-                   'nVertLevelsP1': 1})
-
-    nz = len(z)
-    z = xarray.DataArray.from_dict({'dims': ('nz',), 'data': z})
-
-    # make sure we don't miss anything
-    z[0] = max(z[0].values, ds.zInterfaceEdge.max())
-    z[-1] = min(z[-1].values, ds.zInterfaceEdge.min())
-
-    z0 = z[0:-1].rename({'nz': 'nzM1'})
-    z1 = z[1:].rename({'nz': 'nzM1'})
-
-    nTime = ds.sizes['Time']
-    nInternalEdges = ds.sizes['nInternalEdges']
-    nVertLevels = ds.sizes['nVertLevels']
-
-    if show_progress:
-        widgets = ['interpolating tansport on z-level grid: ',
-                   progressbar.Percentage(), ' ', progressbar.Bar(), ' ',
-                   progressbar.ETA()]
-        bar = progressbar.ProgressBar(widgets=widgets, maxval=nTime).start()
-    else:
-        bar = None
-
-    fileNames = []
-
-    for tIndex in range(nTime):
-        fileName = outFileName.replace('.nc', '_{}.nc'.format(tIndex))
-        fileNames.append(fileName)
-        if os.path.exists(fileName):
-            continue
-
-        outTransport = xarray.DataArray(
-            numpy.zeros((nInternalEdges, nz-1)),
-            dims=('nInternalEdges', 'nzM1'))
-
-        dzSum = xarray.DataArray(
-            numpy.zeros((nInternalEdges, nz-1)),
-            dims=('nInternalEdges', 'nzM1'))
-
-        dsIn = ds.isel(Time=tIndex)
-        for inZIndex in range(nVertLevels):
-            zTop = dsIn.zInterfaceEdge.isel(nVertLevelsP1=inZIndex)
-            zBot = dsIn.zInterfaceEdge.isel(nVertLevelsP1=inZIndex+1)
-            inTransportPerDepth = \
-                dsIn.transportPerDepth.isel(nVertLevels=inZIndex)
-
-            zt = numpy.minimum(zTop, z0)
-            zb = numpy.maximum(zBot, z1)
-            dz = numpy.maximum(zt - zb, 0.)
-
-            outTransport = outTransport + dz*inTransportPerDepth
-
-            dzSum = dzSum + dz
-
-        outTransport.compute()
-        dzSum.compute()
-
-        dsOut = xarray.Dataset()
-        dsOut['mask'] = dzSum > 0
-        dsOut['transport'] = outTransport
-        dsOut['transportVertSum'] = outTransport.sum('nzM1')
-        dsOut['transportVertSumCheck'] = \
-            dsIn.transportVertSum - dsOut.transportVertSum
-
-        dsOut = dsOut.transpose('nzM1', 'nInternalEdges')
-
-        write_netcdf(dsOut, fileName)
-
-        assert(numpy.abs(dsOut.transportVertSumCheck).max().values < 1e-9)
-
-        if show_progress:
-            bar.update(tIndex + 1)
-
-    if show_progress:
-        bar.finish()
-
-    dsOut = xarray.open_mfdataset(fileNames, concat_dim='Time',
-                                  combine='nested')
-
-    dsOut['xtime_startMonthly'] = ds.xtime_startMonthly
-    dsOut['xtime_endMonthly'] = ds.xtime_endMonthly
-    dsOut['z'] = z
-
-    dsOut = dsOut.transpose('Time', 'nzM1', 'nz', 'nInternalEdges')
-
-    print('caching transport on z-level grid:')
-    write_netcdf(dsOut, outFileName)
-
-
-def _vertical_cumsum_horizontal_transport(ds, outFileName):
-    """
-    compute the cumsum in the vertical of the horizontal transport
-    """
-
-    if file_complete(ds, outFileName):
-        return
-
-    chunks = {'Time': 1, 'nInternalEdges': 32768}
-    ds = ds.chunk(chunks)
-
-    nTime = ds.sizes['Time']
-    nInternalEdges = ds.sizes['nInternalEdges']
-    nz = ds.sizes['nz']
-
-    transport = ds.transport.rename({'nzM1': 'nz'})
-
-    transportSumTop = xarray.DataArray(
-        numpy.zeros((nTime, nInternalEdges, 1)),
-        dims=('Time', 'nInternalEdges', 'nz')).chunk(chunks)
-
-    # zeros on top and then the cumsum for the rest
-    transportSum = xarray.concat([transportSumTop,
-                                  transport.cumsum(dim='nz')], dim='nz')
-
-    # mask out locations on the output where no input-grid layers overlap
-    # with either the output layer above or the one below
-    mask = ds.mask.rename({'nzM1': 'nz'})
-    maskTop = mask.isel(nz=0)
-    maskBot = mask.isel(nz=nz-2)
-
-    outMask = xarray.concat([maskTop,
-                             numpy.logical_or(mask[:, 0:-1, :],
-                                              mask[:, 1:, :]),
-                             maskBot], dim='nz')
-
-    dsOut = xarray.Dataset()
-    dsOut['xtime_startMonthly'] = ds.xtime_startMonthly
-    dsOut['xtime_endMonthly'] = ds.xtime_endMonthly
-    dsOut['z'] = ds.z
-    dsOut['transportSum'] = transportSum
-    dsOut['mask'] = outMask
-
-    dsOut = dsOut.transpose('Time', 'nz', 'nInternalEdges')
-
-    print('compute and caching vertical transport sum on z-level grid:')
-    write_netcdf(dsOut, outFileName)
-
+    minLevelEdgeBot = numpy.maximum(minLevelCell[cell0], minLevelCell[cell1])
+    maxLevelEdgeTop = numpy.minimum(maxLevelCell[cell0], maxLevelCell[cell1])
 
-def _compute_region_boundary_edges(dsMesh, cellMask):
+    nVertLevels = dsMesh.sizes['nVertLevels']
+    vertIndex = numpy.arange(nVertLevels)
+
+    dsTime = ds.isel(Time=tIndex)
+    layerThickness = dsTime.timeMonthly_avg_layerThickness.values
+    normalVelocity = \
+        dsTime.timeMonthly_avg_normalVelocity.values[edgeIndices, :]
+
+    layerThicknessEdge = 0.5*(layerThickness[cell0, :] +
+                              layerThickness[cell1, :])
+    mask = numpy.logical_and(
+        vertIndex[numpy.newaxis, :] >= minLevelEdgeBot[:, numpy.newaxis],
+        vertIndex[numpy.newaxis, :] <= maxLevelEdgeTop[:, numpy.newaxis])
+    layerThicknessEdge = numpy.where(mask, layerThicknessEdge, 0.)
+
+    bottomDepthEdge = 0.5*(bottomDepth[cell0] + bottomDepth[cell1])
+    zSurface = layerThicknessEdge.sum(axis=1) - bottomDepthEdge
+    zInterfaceEdge = numpy.zeros((len(edgeIndices), nVertLevels + 1))
+    zInterfaceEdge[:, 0] = zSurface
+    zInterfaceEdge[:, 1:] = zSurface[:, numpy.newaxis] - \
+        numpy.cumsum(layerThicknessEdge, axis=1)
+
+    dvEdge = dsMesh.dvEdge.values[edgeIndices]
+    transportPerDepth = dvEdge[:, numpy.newaxis]*normalVelocity
+
+    # make sure we don't miss anything above the top or below the bottom z
+    # level
+    z0 = numpy.array(z[0:-1])
+    z1 = numpy.array(z[1:])
+    z0[0] = numpy.inf
+    z1[-1] = -numpy.inf
+
+    transport = numpy.zeros((len(edgeIndices), len(z) - 1))
+    dzSum = numpy.zeros((len(edgeIndices), len(z) - 1))
+    for inZIndex in range(nVertLevels):
+        zTop = zInterfaceEdge[:, inZIndex, numpy.newaxis]
+        zBot = zInterfaceEdge[:, inZIndex + 1, numpy.newaxis]
+        dz = numpy.maximum(numpy.minimum(zTop, z0) - numpy.maximum(zBot, z1),
+                           0.)
+        transport += dz*transportPerDepth[:, inZIndex, numpy.newaxis]
+        dzSum += dz
+
+    return transport, dzSum > 0.
+
+
+def _open_osf_file(osfFileName, x, z):
     """
-    Given a mask of cells in a region, find the indices and signs (indicating
-    fluxes into the masked region) of non-boundary edges
+    Open the OSF file, creating it if it doesn't exist (or if it can't be
+    appended to), and return the number of time levels already in the file
     """
-
-    cellsOnEdge = dsMesh.cellsOnEdge.values - 1
-    cellsOnEdgeMask = cellMask.values[cellsOnEdge]
-
-    # first, we only want interior edges, not boundary edges
-    edgeMask = numpy.logical_and(cellsOnEdge[:, 0] >= 0,
-                                 cellsOnEdge[:, 1] >= 0)
-
-    cellMask0 = cellsOnEdgeMask[:, 0][edgeMask]
-    cellMask1 = cellsOnEdgeMask[:, 1][edgeMask]
-
-    # second, we only want edges where one side is in the region and the other
-    # is not
-    edgeMask = cellMask0 != cellMask1
-
-    # convert from boolean mask to indices
-    edgeIndices = numpy.nonzero(edgeMask)[0]
-
-    if(len(edgeIndices) == 0):
-        return numpy.array([]), numpy.array([])
-    else:
-        # according to the mesh spec, normals point from cell 0 to cell 1 on a
-        # given edge:
-        # https://mpas-dev.github.io/files/documents/MPAS-MeshSpec.pdf
-        edgeSign = numpy.ones(len(edgeIndices), int)
-
-        # if the first cell on the edge is in the region, we need to reverse
-        # the edge direction to point into the region
-        mask = cellMask0[edgeIndices]
-        edgeSign[mask] = -1
-
-        return edgeIndices, edgeSign
-
-
-def _horizontally_bin_overturning_streamfunction(ds, dsMesh, x, osfFileName,
-                                                 cacheFileName, showProgress):
+    if os.path.exists(osfFileName):
+        with netCDF4.Dataset(osfFileName, 'r') as ncFile:
+            if 'Time' in ncFile.dimensions and \
+                    ncFile.dimensions['Time'].isunlimited():
+                return len(ncFile.dimensions['Time'])
+        # an older file that we can't append to, so start over
+        os.remove(osfFileName)
+
+    with netCDF4.Dataset(osfFileName, 'w', format='NETCDF4') as ncFile:
+        ncFile.createDimension('Time', None)
+        ncFile.createDimension('nz', len(z))
+        ncFile.createDimension('nx', len(x))
+        ncFile.createDimension('StrLen', 64)
+        for varName in ['xtime_startMonthly', 'xtime_endMonthly']:
+            var = ncFile.createVariable(varName, 'S1', ('Time', 'StrLen'))
+            # read and write strings rather than arrays of characters
+            var._Encoding = 'utf-8'
+        var = ncFile.createVariable('x', 'f8', ('nx',))
+        var[:] = x
+        var = ncFile.createVariable('z', 'f8', ('nz',))
+        var[:] = z
+        var = ncFile.createVariable(
+            'osf', 'f8', ('Time', 'nz', 'nx'),
+            fill_value=netCDF4.default_fillvals['f8'])
+        var.units = 'Sv'
+        var.description = 'overturning streamfunction '
+    return 0
+
+
+def _append_osf(osfFileName, tIndex, osf, xtimeStart, xtimeEnd):
     """
-    bin and sum the vertically cumsummed horizontal transport on the z-level
-    grid to get the OSF.
+    Write the OSF at a given time index to the OSF file
     """
-
-    chunks = {'Time': 1}
-    ds = ds.chunk(chunks)
-
-    nTime = ds.sizes['Time']
-    nz = ds.sizes['nz']
-    nx = len(x)
-    x = xarray.DataArray.from_dict({'dims': ('nx',), 'data': x})
-
-    if showProgress:
-        widgets = ['bin overturning streamfunction: ',
-                   progressbar.Percentage(), ' ', progressbar.Bar(), ' ',
-                   progressbar.ETA()]
-        bar = progressbar.ProgressBar(widgets=widgets, maxval=nx).start()
-    else:
-        bar = None
-
-    # sum up the transport into the region bounded by each x value
-    # on the output grid
-
-    fileNames = []
-
-    for xIndex in range(nx):
-        fileName = cacheFileName.replace('.nc', '_{}.nc'.format(xIndex))
-        fileNames.append(fileName)
-        if file_complete(ds, fileName):
-            continue
-
-        cellMask = dsMesh.xCell >= x[xIndex]
-        edgeIndices, edgeSigns = _compute_region_boundary_edges(dsMesh,
-                                                                cellMask)
-
-        if len(edgeIndices) == 0:
-
-            localOSF = numpy.nan*xarray.DataArray(numpy.ones((nTime, nz)),
-                                                  dims=('Time', 'nz'))
-        else:
-            # convert to Sv
-            transportSum = 1e-6 * \
-                edgeSigns*ds.transportSum.isel(nInternalEdges=edgeIndices)
-
-            localOSF = transportSum.sum(dim='nInternalEdges')
-
-            localMask = ds.mask.isel(nInternalEdges=edgeIndices).sum(
-                dim='nInternalEdges') > 0
-            localOSF = localOSF.where(localMask)
-
-        dsOSF = xarray.Dataset()
-        dsOSF['osf'] = localOSF
-        write_netcdf(dsOSF, fileName)
-
-        if showProgress:
-            bar.update(xIndex+1)
-
-    if showProgress:
-        bar.finish()
-
-    dsOSF = xarray.open_mfdataset(fileNames, concat_dim='nx', combine='nested')
-    dsOSF['xtime_startMonthly'] = ds.xtime_startMonthly
-    dsOSF['xtime_endMonthly'] = ds.xtime_endMonthly
-    dsOSF['x'] = x
-    dsOSF['z'] = ds.z
-    dsOSF.osf.attrs['units'] = 'Sv'
-    dsOSF.osf.attrs['description'] = 'overturning streamfunction '
-
-    dsOSF = dsOSF.transpose('Time', 'nz', 'nx')
-
-    write_netcdf(dsOSF, osfFileName)
+    with netCDF4.Dataset(osfFileName, 'a') as ncFile:
+        ncFile.variables['osf'][tIndex, :, :] = \
+            numpy.ma.masked_invalid(osf)
+        for varName, xtime in [('xtime_startMonthly', xtimeStart),
+                               ('xtime_endMonthly', xtimeEnd)]:
+            ncFile.variables[varName][tIndex] = \
+                numpy.array(xtime).astype('U64')
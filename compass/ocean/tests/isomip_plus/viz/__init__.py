@@ -1,12 +1,10 @@
 import xarray
 import os
 
-from mpas_tools.io import write_netcdf
-
 from compass.step import Step
 from compass.ocean.tests.isomip_plus.viz.plot import MoviePlotter, \
     TimeSeriesPlotter
-from compass.ocean.haney import compute_haney_number
+from compass.ocean.haney import write_haney_number
 
 
 class Viz(Step):
@@ -40,6 +38,14 @@ class Viz(Step):
         self.resolution = resolution
         self.experiment = experiment
 
+    def setup(self):
+        """
+        Set up the test case in the work directory, including downloading any
+        dependencies
+        """
+        self.cores = self.config.getint('isomip_plus_viz', 'cores')
+        self.min_cores = 1
+
     def run(self):
         """
         Run this step of the test case
@@ -49,8 +55,10 @@ class Viz(Step):
         section = config['isomip_plus_viz']
         plot_streamfunctions = section.getboolean('plot_streamfunctions')
         plot_haney = section.getboolean('plot_haney')
+        haney_time_chunk = section.getint('haney_time_chunk')
         frames_per_second = section.getint('frames_per_second')
         movie_format = section.get('movie_format')
+        stream_movies = section.getboolean('stream_movies')
         section_y = section.getfloat('section_y')
 
         # show progress only if we're not writing to a log file
@@ -59,6 +67,7 @@ class Viz(Step):
         sim_dir = '../simulation'
         streamfunction_dir = '../streamfunction'
         out_dir = '.'
+        movie_dir = '{}/movies'.format(out_dir)
         expt = self.experiment
 
         dsMesh = xarray.open_dataset('{}/init.nc'.format(sim_dir))
@@ -69,6 +78,7 @@ class Viz(Step):
 
         if plot_haney:
             _compute_and_write_haney_number(dsMesh, ds, out_dir,
+                                            timeChunk=haney_time_chunk,
                                             showProgress=show_progress)
 
         tsPlotter = TimeSeriesPlotter(inFolder=sim_dir,
@@ -86,7 +96,11 @@ class Viz(Step):
                                 outFolder='{}/plots'.format(out_dir),
                                 expt=expt, sectionY=section_y,
                                 dsMesh=dsMesh, ds=ds,
-                                showProgress=show_progress)
+                                showProgress=show_progress, cores=self.cores,
+                                movieFolder=movie_dir if stream_movies
+                                else None,
+                                framesPerSecond=frames_per_second,
+                                movieFormat=movie_format)
 
         mPlotter.plot_layer_interfaces()
 
@@ -103,9 +117,12 @@ class Viz(Step):
         mPlotter.plot_salinity()
         mPlotter.plot_potential_density()
 
-        mPlotter.images_to_movies(outFolder='{}/movies'.format(out_dir),
-                                  framesPerSecond=frames_per_second,
-                                  extension=movie_format)
+        if stream_movies:
+            mPlotter.finish_movies()
+        else:
+            mPlotter.images_to_movies(outFolder=movie_dir,
+                                      framesPerSecond=frames_per_second,
+                                      extension=movie_format)
 
 
 def file_complete(ds, fileName):
@@ -122,7 +139,8 @@ def file_complete(ds, fileName):
     return complete
 
 
-def _compute_and_write_haney_number(dsMesh, ds, folder, showProgress=False):
+def _compute_and_write_haney_number(dsMesh, ds, folder, timeChunk,
+                                    showProgress=False):
     """
     compute the Haney number rx1 for each edge, and interpolate it to cells.
     """
@@ -131,17 +149,8 @@ def _compute_and_write_haney_number(dsMesh, ds, folder, showProgress=False):
     if file_complete(ds, haneyFileName):
         return
 
-    haneyEdge, haneyCell = compute_haney_number(
+    write_haney_number(
         dsMesh, ds.timeMonthly_avg_layerThickness, ds.timeMonthly_avg_ssh,
-        showProgress)
-    dsHaney = xarray.Dataset()
-    dsHaney['xtime_startMonthly'] = ds.xtime_startMonthly
-    dsHaney['xtime_endMonthly'] = ds.xtime_endMonthly
-    dsHaney['haneyEdge'] = haneyEdge
-    dsHaney.haneyEdge.attrs['units'] = 'unitless'
-    dsHaney.haneyEdge.attrs['description'] = 'Haney number on edges'
-    dsHaney['haneyCell'] = haneyCell
-    dsHaney.haneyCell.attrs['units'] = 'unitless'
-    dsHaney.haneyCell.attrs['description'] = 'Haney number on cells'
-    dsHaney = dsHaney.transpose('Time', 'nCells', 'nEdges', 'nVertLevels')
-    write_netcdf(dsHaney, haneyFileName)
+        haneyFileName,
+        ds_time=ds[['xtime_startMonthly', 'xtime_endMonthly']],
+        show_progress=showProgress, time_chunk=timeChunk)
@@ -5,11 +5,14 @@ import copy
 import progressbar
 import subprocess
 import glob
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 import matplotlib.pyplot as plt
 import cmocean
-from matplotlib.patches import Polygon
-from matplotlib.collections import PatchCollection
+from matplotlib.collections import PolyCollection
+
+from compass.ocean.sections import find_section_cells
 
 
 class TimeSeriesPlotter(object):
@@ -174,10 +177,10 @@ class MoviePlotter(object):
     cavityMask : ``numpy.ndarray``
         A mask of cells that are in the sub-ice-shelf cavity
 
-    oceanPatches : ``PatchCollection``
+    oceanPatches : ``PolyCollection``
         A set of polygons covering ocean cells
 
-    cavityPatches : ``PatchCollection``
+    cavityPatches : ``PolyCollection``
         A set of polygons covering only cells in the cavity
 
     X, Z : ``numpy.ndarray``
@@ -187,12 +190,30 @@ class MoviePlotter(object):
         A mask for the cross section indicating where values are valid (i.e.
         above the bathymetry)
 
+    dates : list of str
+        The year and month of each time index in ``ds``
+
     showProgress : bool
         Whether to show a progressbar
+
+    cores : int
+        The number of processes used to render frames and the maximum number
+        of movies encoded at once
+
+    movieFolder : str
+        If not ``None``, the folder where movies are written with frames
+        piped directly to ffmpeg, rather than writing images to ``outFolder``
+
+    framesPerSecond : int
+        The frame rate of movies piped to ffmpeg
+
+    movieFormat : str
+        The file extension of movies piped to ffmpeg
     """
 
     def __init__(self, inFolder, streamfunctionFolder,  outFolder, expt,
-                 sectionY, dsMesh,  ds, showProgress):
+                 sectionY, dsMesh,  ds, showProgress, cores=1,
+                 movieFolder=None, framesPerSecond=30, movieFormat='mp4'):
         """
         Create a plotter object to hold on to some info needed for plotting
         images from ISOMIP+ simulation results
@@ -223,6 +244,22 @@ class MoviePlotter(object):
 
         showProgress : bool
             Whether to show a progressbar
+
+        cores : int, optional
+            The number of processes used to render frames and the maximum
+            number of movies encoded at once
+
+        movieFolder : str, optional
+            If provided, frames are piped directly to ffmpeg to make movies in
+            this folder, rather than being written as images to ``outFolder``.
+            Call :py:meth:`MoviePlotter.finish_movies()` once all plotting is
+            done.
+
+        framesPerSecond : int, optional
+            The frame rate of movies piped to ffmpeg
+
+        movieFormat : str, optional
+            The file extension of movies piped to ffmpeg
         """
         plt.switch_backend('Agg')
 
@@ -232,21 +269,37 @@ class MoviePlotter(object):
         self.expt = expt
         self.sectionY = sectionY
         self.showProgress = showProgress
+        self.cores = cores
+        self.movieFolder = movieFolder
+        self.framesPerSecond = framesPerSecond
+        self.movieFormat = movieFormat
 
         self.dsMesh = dsMesh
         self.ds = ds
+        self.dates = _get_dates(ds)
+        self.date = ''
 
         landIceMask = self.dsMesh.landIceFraction.isel(Time=0) > 0.01
         self.oceanMask = self.dsMesh.maxLevelCell-1 >= 0
         self.cavityMask = numpy.logical_and(self.oceanMask, landIceMask)
 
-        self.oceanPatches = _compute_cell_patches(
-            self.dsMesh, self.oceanMask)
-        self.cavityPatches = _compute_cell_patches(
-            self.dsMesh, self.cavityMask)
+        cellVertices = _get_cell_vertices(self.dsMesh, self.outFolder)
+        self.oceanPatches = _compute_cell_patches(cellVertices,
+                                                  self.oceanMask)
+        self.cavityPatches = _compute_cell_patches(cellVertices,
+                                                   self.cavityMask)
+
+        # the figure, axes and polygons for plotting horizontal fields, reused
+        # from one frame to the next
+        self._horizPlot = None
 
-        self.sectionCellIndices = _compute_section_cell_indices(self.sectionY,
-                                                                self.dsMesh)
+        # ffmpeg processes encoding movies from piped frames
+        self._encoders = []
+
+        xCell = self.dsMesh.xCell.values
+        self.sectionCellIndices = find_section_cells(
+            self.dsMesh, x=[numpy.amin(xCell), numpy.amax(xCell)],
+            y=[self.sectionY, self.sectionY])
 
         self._compute_section_x_z()
 
@@ -272,28 +325,15 @@ class MoviePlotter(object):
                 vmin = -0.5
                 vmax = 0.5
 
-        nTime = ds.sizes['Time']
-        if self.showProgress:
-            widgets = ['plotting barotropic streamfunction: ',
-                       progressbar.Percentage(), ' ',
-                       progressbar.Bar(), ' ', progressbar.ETA()]
-            bar = progressbar.ProgressBar(widgets=widgets,
-                                          maxval=nTime).start()
-        else:
-            bar = None
+        bsf = ds.bsfCell.values
 
-        for tIndex in range(nTime):
-            self.update_date(tIndex)
-            bsf = ds.bsfCell.isel(Time=tIndex)
-            outFileName = '{}/bsf/bsf_{:04d}.png'.format(
-                self.outFolder, tIndex+1)
-            self._plot_horiz_field(bsf, title='barotropic streamfunction (Sv)',
-                                   outFileName=outFileName, oceanDomain=True,
-                                   vmin=vmin, vmax=vmax, cmap='cmo.curl')
-            if self.showProgress:
-                bar.update(tIndex+1)
-        if self.showProgress:
-            bar.finish()
+        def plot_frame(tIndex):
+            return self._plot_horiz_field(
+                bsf[tIndex, :], title='barotropic streamfunction (Sv)',
+                oceanDomain=True, vmin=vmin, vmax=vmax, cmap='cmo.curl')
+
+        self._plot_series('bsf', ds.sizes['Time'], plot_frame,
+                          'barotropic streamfunction')
 
     def plot_overturning_streamfunction(self, vmin=-0.3, vmax=0.3):
         """
@@ -308,30 +348,18 @@ class MoviePlotter(object):
         ds = xarray.open_dataset('{}/overturningStreamfunction.nc'.format(
             self.streamfunctionFolder))
 
-        nTime = ds.sizes['Time']
-        if self.showProgress:
-            widgets = ['plotting overturning streamfunction: ',
-                       progressbar.Percentage(), ' ',
-                       progressbar.Bar(), ' ', progressbar.ETA()]
-            bar = progressbar.ProgressBar(widgets=widgets,
-                                          maxval=nTime).start()
-        else:
-            bar = None
+        osf = ds.osf.values
+        x = _interp_extrap_corner(ds.x.values)
+        z = _interp_extrap_corner(ds.z.values)
 
-        for tIndex in range(nTime):
-            self.update_date(tIndex)
-            osf = ds.osf.isel(Time=tIndex)
-            outFileName = '{}/osf/osf_{:04d}.png'.format(self.outFolder,
-                                                         tIndex+1)
-            x = _interp_extrap_corner(ds.x.values)
-            z = _interp_extrap_corner(ds.z.values)
-            self._plot_vert_field(
-                x, z, osf, title='overturning streamfunction (Sv)',
-                outFileName=outFileName, vmin=vmin, vmax=vmax, cmap='cmo.curl')
-            if self.showProgress:
-                bar.update(tIndex+1)
-        if self.showProgress:
-            bar.finish()
+        def plot_frame(tIndex):
+            return self._plot_vert_field(
+                x, z, osf[tIndex, :, :],
+                title='overturning streamfunction (Sv)', vmin=vmin, vmax=vmax,
+                cmap='cmo.curl')
+
+        self._plot_series('osf', ds.sizes['Time'], plot_frame,
+                          'overturning streamfunction')
 
     def plot_melt_rates(self, vmin=-100., vmax=100.):
         """
@@ -480,32 +508,19 @@ class MoviePlotter(object):
             A color map to plot
         """
 
-        nTime = self.ds.sizes['Time']
-        if self.showProgress:
-            widgets = ['plotting {}: '.format(nameInTitle),
-                       progressbar.Percentage(), ' ',
-                       progressbar.Bar(), ' ', progressbar.ETA()]
-            bar = progressbar.ProgressBar(widgets=widgets,
-                                          maxval=nTime).start()
+        fields = da.values
+        if units is None:
+            title = nameInTitle
         else:
-            bar = None
+            title = '{} ({})'.format(nameInTitle, units)
 
-        for tIndex in range(nTime):
-            self.update_date(tIndex)
-            field = da.isel(Time=tIndex).values
-            outFileName = '{}/{}/{}_{:04d}.png'.format(
-                self.outFolder, prefix, prefix, tIndex+1)
-            if units is None:
-                title = nameInTitle
-            else:
-                title = '{} ({})'.format(nameInTitle, units)
-            self._plot_horiz_field(field, title=title, outFileName=outFileName,
-                                   oceanDomain=oceanDomain, vmin=vmin,
-                                   vmax=vmax, cmap=cmap)
-            if self.showProgress:
-                bar.update(tIndex+1)
-        if self.showProgress:
-            bar.finish()
+        def plot_frame(tIndex):
+            return self._plot_horiz_field(
+                fields[tIndex, :], title=title, oceanDomain=oceanDomain,
+                vmin=vmin, vmax=vmax, cmap=cmap)
+
+        self._plot_series(prefix, self.ds.sizes['Time'], plot_frame,
+                          nameInTitle)
 
     def plot_3d_field_top_bot_section(self, da, nameInTitle, prefix,
                                       units=None, vmin=None, vmax=None,
@@ -583,38 +598,22 @@ class MoviePlotter(object):
                                'bot{}'.format(prefix), oceanDomain=True,
                                vmin=vmin, vmax=vmax, cmap=cmap)
 
-        daSection = da.isel(nCells=self.sectionCellIndices)
-
-        nTime = self.ds.sizes['Time']
-        if self.showProgress:
-            widgets = ['plotting {} section: '.format(nameInTitle),
-                       progressbar.Percentage(), ' ',
-                       progressbar.Bar(), ' ', progressbar.ETA()]
-            bar = progressbar.ProgressBar(widgets=widgets,
-                                          maxval=nTime).start()
+        sections = da.isel(nCells=self.sectionCellIndices).values
+        mask = numpy.logical_not(self.sectionMask)
+        if units is None:
+            title = nameInTitle
         else:
-            bar = None
+            title = '{} ({}) along section at y={:g} km'.format(
+                nameInTitle, units, 1e-3*self.sectionY)
 
-        for tIndex in range(nTime):
-            self.update_date(tIndex)
-            mask = numpy.logical_not(self.sectionMask)
-            field = numpy.ma.masked_array(daSection.isel(Time=tIndex).values.T,
-                                          mask=mask)
-            outFileName = '{}/section{}/section{}_{:04d}.png'.format(
-                self.outFolder, prefix, prefix, tIndex+1)
-            if units is None:
-                title = nameInTitle
-            else:
-                title = '{} ({}) along section at y={:g} km'.format(
-                    nameInTitle, units, 1e-3*self.sectionY)
-            self._plot_vert_field(self.X, self.Z[tIndex, :, :],
-                                  field, title=title,
-                                  outFileName=outFileName,
-                                  vmin=vmin, vmax=vmax, cmap=cmap)
-            if self.showProgress:
-                bar.update(tIndex+1)
-        if self.showProgress:
-            bar.finish()
+        def plot_frame(tIndex):
+            field = numpy.ma.masked_array(sections[tIndex, :, :].T, mask=mask)
+            return self._plot_vert_field(self.X, self.Z[tIndex, :, :],
+                                         field, title=title, vmin=vmin,
+                                         vmax=vmax, cmap=cmap)
+
+        self._plot_series('section{}'.format(prefix), self.ds.sizes['Time'],
+                          plot_frame, '{} section'.format(nameInTitle))
 
     def plot_layer_interfaces(self, figsize=(9, 5)):
         """
@@ -627,42 +626,19 @@ class MoviePlotter(object):
             The size of the figure
         """
 
-        nTime = self.Z.shape[0]
-
-        if self.showProgress:
-            widgets = ['plotting section of layer interfaces: ',
-                       progressbar.Percentage(), ' ',
-                       progressbar.Bar(), ' ', progressbar.ETA()]
-            bar = progressbar.ProgressBar(widgets=widgets,
-                                          maxval=nTime).start()
-        else:
-            bar = None
-
         z_mask = numpy.ones(self.X.shape)
         z_mask[0:-1, 0:-1] *= numpy.where(self.sectionMask, 1., numpy.nan)
         z_mask[1:, 0:-1] *= numpy.where(self.sectionMask, 1., numpy.nan)
         z_mask[0:-1, 1:] *= numpy.where(self.sectionMask, 1., numpy.nan)
         z_mask[1:, 1:] *= numpy.where(self.sectionMask, 1., numpy.nan)
 
-        for tIndex in range(nTime):
+        def plot_frame(tIndex):
             Z = numpy.array(self.Z[tIndex, :, :])
             ylim = [numpy.amin(Z), 20]
             Z *= z_mask
             X = self.X
-            self.update_date(tIndex)
-
-            outFileName = '{}/layers/layers_{:04d}.png'.format(self.outFolder,
-                                                               tIndex+1)
-
-            if os.path.exists(outFileName):
-                continue
-
-            try:
-                os.makedirs(os.path.dirname(outFileName))
-            except OSError:
-                pass
 
-            plt.figure(figsize=figsize)
+            fig = plt.figure(figsize=figsize)
             ax = plt.subplot(111)
 
             for z_index in range(1, X.shape[0]):
@@ -674,18 +650,16 @@ class MoviePlotter(object):
             plt.ylim(ylim)
             plt.title('{} {}'.format('layer interfaces', self.date))
             plt.tight_layout(pad=0.5)
-            plt.savefig(outFileName)
-            plt.close()
+            return fig
 
-            if self.showProgress:
-                bar.update(tIndex+1)
-        if self.showProgress:
-            bar.finish()
+        self._plot_series('layers', self.Z.shape[0], plot_frame,
+                          'section of layer interfaces')
 
     def images_to_movies(self, outFolder, framesPerSecond=30, extension='mp4',
                          overwrite=True):
         """
-        Convert all the image sequences into movies with ffmpeg
+        Convert all the image sequences into movies with ffmpeg, running up
+        to ``cores`` instances of ffmpeg at once
         """
         try:
             os.makedirs('{}/logs'.format(outFolder))
@@ -694,6 +668,8 @@ class MoviePlotter(object):
 
         framesPerSecond = '{}'.format(framesPerSecond)
 
+        allArgs = []
+        logFileNames = []
         for fileName in sorted(glob.glob(
                 '{}/*/*0001.png'.format(self.outFolder))):
             prefix = os.path.basename(fileName)[:-9]
@@ -704,75 +680,223 @@ class MoviePlotter(object):
             imageFileTemplate = '{}/{}/{}_%04d.png'.format(self.outFolder,
                                                            prefix, prefix)
             logFileName = '{}/logs/{}.log'.format(outFolder, prefix)
-            with open(logFileName, 'w') as logFile:
-                args = ['ffmpeg', '-y', '-r', framesPerSecond,
-                        '-i', imageFileTemplate, '-b:v', '32000k',
-                        '-r', framesPerSecond, '-pix_fmt', 'yuv420p',
-                        outFileName]
-                print('running {}'.format(' '.join(args)))
-                subprocess.check_call(args, stdout=logFile, stderr=logFile)
+            args = ['ffmpeg', '-y', '-r', framesPerSecond,
+                    '-i', imageFileTemplate, '-b:v', '32000k',
+                    '-r', framesPerSecond, '-pix_fmt', 'yuv420p',
+                    outFileName]
+            print('running {}'.format(' '.join(args)))
+            allArgs.append(args)
+            logFileNames.append(logFileName)
+
+        with ThreadPoolExecutor(max_workers=self.cores) as executor:
+            # list() makes sure any errors are raised
+            list(executor.map(_run_ffmpeg, allArgs, logFileNames))
+
+    def finish_movies(self):
+        """
+        Wait for ffmpeg to finish encoding the movies with frames that were
+        piped to it (if ``movieFolder`` was provided)
+        """
+        self._wait_for_encoders(maxRunning=0)
 
     def update_date(self, tIndex):
-        if 'xtime_startMonthly' in self.ds:
-            var = 'xtime_startMonthly'
-        elif 'xtime' in self.ds:
-            var = 'xtime'
-        else:
+        if len(self.dates) == 0:
             self.date = ''
+        else:
+            self.date = self.dates[tIndex]
+
+    def _plot_series(self, prefix, nTime, plotFrame, nameInProgress):
+        """
+        Plot a series of frames, each a figure returned by
+        ``plotFrame(tIndex)``.  The frames are written as images (skipping
+        those that already exist) or piped to ffmpeg if ``movieFolder`` was
+        provided.  If ``cores`` is more than 1, the frames are rendered in a
+        pool of processes.
+        """
+        if self.movieFolder is None:
+            tIndices = [tIndex for tIndex in range(nTime) if not
+                        os.path.exists(self._get_frame_file_name(prefix,
+                                                                 tIndex))]
+        else:
+            tIndices = list(range(nTime))
+
+        if len(tIndices) == 0:
             return
 
-        xtime = self.ds[var].isel(Time=tIndex).values
-        xtime = ''.join(str(xtime.astype('U'))).strip()
-        year = xtime[0:4]
-        month = xtime[5:7]
-        self.date = '{}-{}'.format(year, month)
+        if self.showProgress:
+            widgets = ['plotting {}: '.format(nameInProgress),
+                       progressbar.Percentage(), ' ',
+                       progressbar.Bar(), ' ', progressbar.ETA()]
+            bar = progressbar.ProgressBar(widgets=widgets,
+                                          maxval=len(tIndices)).start()
+        else:
+            bar = None
 
-    def _plot_horiz_field(self, field, title, outFileName, oceanDomain=True,
-                          vmin=None, vmax=None, figsize=(9, 3), cmap=None):
+        executor = None
+        if self.cores > 1 and len(tIndices) > 1:
+            # worker processes are forked so they inherit the plotter and the
+            # data for each frame, rather than having them pickled
+            global _seriesToPlot
+            _seriesToPlot = (self, prefix, plotFrame)
+            executor = ProcessPoolExecutor(
+                max_workers=min(self.cores, len(tIndices)),
+                mp_context=multiprocessing.get_context('fork'))
+            chunkSize = max(1, len(tIndices) // (4*self.cores))
+            frames = executor.map(_plot_frame_in_worker, tIndices,
+                                  chunksize=chunkSize)
+        else:
+            frames = (self._plot_frame(prefix, plotFrame, tIndex) for tIndex
+                      in tIndices)
 
+        encoder = None
         try:
-            os.makedirs(os.path.dirname(outFileName))
-        except OSError:
-            pass
+            for count, frame in enumerate(frames):
+                if frame is not None:
+                    if encoder is None:
+                        encoder = self._start_encoder(prefix, frame.shape)
+                    encoder.stdin.write(frame.tobytes())
+                if self.showProgress:
+                    bar.update(count+1)
+        finally:
+            if executor is not None:
+                # the workers must exit before we close ffmpeg's input
+                executor.shutdown()
+            self._close_horiz_plot()
+            if encoder is not None:
+                encoder.stdin.close()
 
-        if os.path.exists(outFileName):
-            return
+        if self.showProgress:
+            bar.finish()
 
-        if oceanDomain:
-            localPatches = copy.copy(self.oceanPatches)
-            localPatches.set_array(field[self.oceanMask])
+    def _plot_frame(self, prefix, plotFrame, tIndex):
+        """
+        Plot a frame and write it to an image file or, if the frame is to be
+        piped to ffmpeg, return its RGB pixels
+        """
+        self.update_date(tIndex)
+        fig = plotFrame(tIndex)
+        if self.movieFolder is None:
+            outFileName = self._get_frame_file_name(prefix, tIndex)
+            try:
+                os.makedirs(os.path.dirname(outFileName))
+            except OSError:
+                pass
+            fig.savefig(outFileName)
+            frame = None
         else:
-            localPatches = copy.copy(self.cavityPatches)
-            localPatches.set_array(field[self.cavityMask])
+            fig.canvas.draw()
+            frame = numpy.array(fig.canvas.buffer_rgba())[:, :, 0:3]
 
-        localPatches.set_edgecolor('face')
-        localPatches.set_clim(vmin=vmin, vmax=vmax)
-        if cmap is not None:
-            localPatches.set_cmap(cmap)
+        if self._horizPlot is None or fig is not self._horizPlot[1]:
+            plt.close(fig)
 
-        plt.figure(figsize=figsize)
-        ax = plt.subplot(111)
-        ax.add_collection(localPatches)
-        plt.colorbar(localPatches)
-        plt.axis([0, 500, 0, 1000])
-        ax.set_aspect('equal')
-        ax.autoscale(tight=True)
-        plt.title('{} {}'.format(title, self.date))
-        plt.tight_layout(pad=0.5)
-        plt.savefig(outFileName)
-        plt.close()
+        return frame
+
+    def _get_frame_file_name(self, prefix, tIndex):
+        """
+        The name of the image file for a frame
+        """
+        return '{}/{}/{}_{:04d}.png'.format(self.outFolder, prefix, prefix,
+                                            tIndex+1)
+
+    def _start_encoder(self, prefix, frameShape):
+        """
+        Start ffmpeg to encode a movie from raw RGB frames piped to it, first
+        waiting for earlier movies to finish if ``cores`` encoders are
+        already running
+        """
+        self._wait_for_encoders(maxRunning=self.cores-1)
 
-    def _plot_vert_field(self, inX, inZ, field, title, outFileName, vmin=None,
-                         vmax=None, figsize=(9, 5), cmap=None):
         try:
-            os.makedirs(os.path.dirname(outFileName))
+            os.makedirs('{}/logs'.format(self.movieFolder))
         except OSError:
             pass
 
-        if os.path.exists(outFileName):
-            return
+        framesPerSecond = '{}'.format(self.framesPerSecond)
+        height, width = frameShape[0:2]
+        outFileName = '{}/{}.{}'.format(self.movieFolder, prefix,
+                                        self.movieFormat)
+        logFileName = '{}/logs/{}.log'.format(self.movieFolder, prefix)
+        logFile = open(logFileName, 'w')
+        args = ['ffmpeg', '-y', '-f', 'rawvideo', '-pix_fmt', 'rgb24',
+                '-s', '{}x{}'.format(width, height), '-r', framesPerSecond,
+                '-i', '-', '-b:v', '32000k', '-r', framesPerSecond,
+                '-pix_fmt', 'yuv420p', outFileName]
+        print('running {}'.format(' '.join(args)))
+        encoder = subprocess.Popen(args, stdin=subprocess.PIPE,
+                                   stdout=logFile, stderr=logFile)
+        self._encoders.append((encoder, logFile, args))
+        return encoder
+
+    def _wait_for_encoders(self, maxRunning):
+        """
+        Wait for the oldest ffmpeg encoders until no more than
+        ``maxRunning`` are left
+        """
+        while len(self._encoders) > maxRunning:
+            encoder, logFile, args = self._encoders.pop(0)
+            encoder.wait()
+            logFile.close()
+            if encoder.returncode != 0:
+                raise subprocess.CalledProcessError(encoder.returncode, args)
 
-        plt.figure(figsize=figsize)
+    def _plot_horiz_field(self, field, title, oceanDomain=True, vmin=None,
+                          vmax=None, figsize=(9, 3), cmap=None):
+
+        if oceanDomain:
+            values = numpy.asarray(field[self.oceanMask])
+        else:
+            values = numpy.asarray(field[self.cavityMask])
+
+        # the cell geometry and the layout of the figure are the same from
+        # one frame to the next, so we only need to update the colors of the
+        # cells and the title unless the plot settings change
+        key = (oceanDomain, vmin, vmax, figsize, cmap)
+        if self._horizPlot is None or self._horizPlot[0] != key:
+            self._close_horiz_plot()
+            if oceanDomain:
+                localPatches = copy.copy(self.oceanPatches)
+            else:
+                localPatches = copy.copy(self.cavityPatches)
+
+            localPatches.set_array(values)
+            localPatches.set_edgecolor('face')
+            localPatches.set_clim(vmin=vmin, vmax=vmax)
+            if cmap is not None:
+                localPatches.set_cmap(cmap)
+
+            fig = plt.figure(figsize=figsize)
+            ax = plt.subplot(111)
+            ax.add_collection(localPatches)
+            plt.colorbar(localPatches)
+            plt.axis([0, 500, 0, 1000])
+            ax.set_aspect('equal')
+            ax.autoscale(tight=True)
+            plt.title('{} {}'.format(title, self.date))
+            plt.tight_layout(pad=0.5)
+            self._horizPlot = (key, fig, ax, localPatches)
+
+        _, fig, ax, localPatches = self._horizPlot
+        localPatches.set_array(values)
+        if vmin is None or vmax is None:
+            # autoscale the missing limits to this frame
+            localPatches.set_clim(
+                vmin=numpy.nanmin(values) if vmin is None else vmin,
+                vmax=numpy.nanmax(values) if vmax is None else vmax)
+        ax.set_title('{} {}'.format(title, self.date))
+        return fig
+
+    def _close_horiz_plot(self):
+        """
+        Close the figure used to plot horizontal fields (if any)
+        """
+        if self._horizPlot is not None:
+            plt.close(self._horizPlot[1])
+            self._horizPlot = None
+
+    def _plot_vert_field(self, inX, inZ, field, title, vmin=None, vmax=None,
+                         figsize=(9, 5), cmap=None):
+        fig = plt.figure(figsize=figsize)
         ax = plt.subplot(111)
         plt.pcolormesh(1e-3*inX, inZ, field, vmin=vmin, vmax=vmax, cmap=cmap)
         plt.colorbar()
@@ -780,8 +904,7 @@ class MoviePlotter(object):
         plt.ylim([numpy.amin(inZ), 20])
         plt.title('{} {}'.format(title, self.date))
         plt.tight_layout(pad=0.5)
-        plt.savefig(outFileName)
-        plt.close()
+        return fig
 
     def _compute_section_x_z(self):
         x = _interp_extrap_corner(self.dsMesh.xCell[self.sectionCellIndices])
@@ -822,43 +945,94 @@ class MoviePlotter(object):
                     layerThicknessSection
 
 
-def _compute_cell_patches(dsMesh, mask):
-    patches = []
-    nVerticesOnCell = dsMesh.nEdgesOnCell.values
+def _get_dates(ds):
+    """
+    Get the year and month of each time index in a data set
+    """
+    if 'xtime_startMonthly' in ds:
+        var = 'xtime_startMonthly'
+    elif 'xtime' in ds:
+        var = 'xtime'
+    else:
+        return []
+
+    dates = []
+    for xtime in ds[var].values:
+        xtime = ''.join(str(xtime.astype('U'))).strip()
+        year = xtime[0:4]
+        month = xtime[5:7]
+        dates.append('{}-{}'.format(year, month))
+    return dates
+
+
+# the plotter, prefix and function for plotting each frame of the series
+# being plotted by worker processes
+_seriesToPlot = None
+
+
+def _plot_frame_in_worker(tIndex):
+    """
+    Plot a frame of the series in ``_seriesToPlot`` in a worker process
+    """
+    plotter, prefix, plotFrame = _seriesToPlot
+    return plotter._plot_frame(prefix, plotFrame, tIndex)
+
+
+def _run_ffmpeg(args, logFileName):
+    """
+    Run ffmpeg, writing its output to a log file
+    """
+    with open(logFileName, 'w') as logFile:
+        subprocess.check_call(args, stdout=logFile, stderr=logFile)
+
+
+def _get_cell_vertices(dsMesh, cacheFolder):
+    """
+    Get the vertices (in km) of each cell, padded to the same number of
+    vertices for all cells by repeating the last vertex.  The vertices are
+    cached in ``cacheFolder`` and only recomputed if the mesh file has changed.
+    """
+    cacheFileName = None
+    meshKey = None
+    meshFileName = dsMesh.encoding.get('source')
+    if meshFileName is not None and os.path.exists(meshFileName):
+        meshStat = os.stat(meshFileName)
+        meshKey = '{} {} {}'.format(os.path.realpath(meshFileName),
+                                    meshStat.st_size, meshStat.st_mtime_ns)
+        cacheFileName = '{}/cell_vertices.npz'.format(cacheFolder)
+        if os.path.exists(cacheFileName):
+            with numpy.load(cacheFileName) as data:
+                if str(data['meshKey']) == meshKey:
+                    return data['vertices']
+
+    nEdgesOnCell = dsMesh.nEdgesOnCell.values
     verticesOnCell = dsMesh.verticesOnCell.values - 1
-    xVertex = dsMesh.xVertex.values
-    yVertex = dsMesh.yVertex.values
-    for iCell in range(dsMesh.sizes['nCells']):
-        if(not mask[iCell]):
-            continue
-        nVert = nVerticesOnCell[iCell]
-        vertexIndices = verticesOnCell[iCell, :nVert]
-        vertices = numpy.zeros((nVert, 2))
-        vertices[:, 0] = 1e-3*xVertex[vertexIndices]
-        vertices[:, 1] = 1e-3*yVertex[vertexIndices]
-
-        polygon = Polygon(vertices, True)
-        patches.append(polygon)
-
-    p = PatchCollection(patches, alpha=1.)
+    maxEdges = verticesOnCell.shape[1]
+    indices = numpy.minimum(numpy.arange(maxEdges)[numpy.newaxis, :],
+                            nEdgesOnCell[:, numpy.newaxis] - 1)
+    verticesOnCell = numpy.take_along_axis(verticesOnCell, indices, axis=1)
 
-    return p
+    vertices = numpy.zeros(verticesOnCell.shape + (2,))
+    vertices[:, :, 0] = 1e-3*dsMesh.xVertex.values[verticesOnCell]
+    vertices[:, :, 1] = 1e-3*dsMesh.yVertex.values[verticesOnCell]
+
+    if cacheFileName is not None:
+        try:
+            os.makedirs(cacheFolder)
+        except OSError:
+            pass
+        tempFileName = '{}.tmp.npz'.format(cacheFileName[:-4])
+        numpy.savez(tempFileName, meshKey=meshKey, vertices=vertices)
+        os.replace(tempFileName, cacheFileName)
+
+    return vertices
 
 
-def _compute_section_cell_indices(y, dsMesh):
-    xCell = dsMesh.xCell.values
-    yCell = dsMesh.yCell.values
-    xMin = numpy.amin(xCell)
-    xMax = numpy.amax(xCell)
-    xs = numpy.linspace(xMin, xMax, 10000)
-    cellIndices = []
-    for x in xs:
-        distanceSquared = (x - xCell)**2 + (y-yCell)**2
-        index = numpy.argmin(distanceSquared)
-        if len(cellIndices) == 0 or cellIndices[-1] != index:
-            cellIndices.append(index)
-
-    return numpy.array(cellIndices)
+def _compute_cell_patches(cellVertices, mask):
+    p = PolyCollection(cellVertices[numpy.asarray(mask)], closed=True,
+                       alpha=1.)
+
+    return p
 
 
 def _interp_extrap_corner(inField):
@@ -1,7 +1,8 @@
 import numpy
 import xarray
 
-from compass.ocean.vertical.zlevel import init_z_level_vertical_coord
+from compass.ocean.vertical.zlevel import init_z_level_vertical_coord, \
+    compute_level_mask
 from compass.ocean.vertical.zstar import init_z_star_vertical_coord
 
 
@@ -78,7 +79,7 @@ def init_vertical_coord(config, ds):
         raise ValueError('Unknown coordinate type {}'.format(coord_type))
 
     # recompute the cell mask since min/max indices may have changed
-    ds['cellMask'] = _compute_cell_mask(ds.minLevelCell, ds.maxLevelCell,
+    ds['cellMask'] = compute_level_mask(ds.minLevelCell, ds.maxLevelCell,
                                         ds.sizes['nVertLevels'])
 
     # mask layerThickness and restingThickness
@@ -99,20 +100,11 @@ def init_vertical_coord(config, ds):
     ds['maxLevelCell'] = ds.maxLevelCell+1
 
 
-def _compute_cell_mask(minLevelCell, maxLevelCell, nVertLevels):
-    cellMask = []
-    for zIndex in range(nVertLevels):
-        mask = numpy.logical_and(zIndex >= minLevelCell,
-                                 zIndex <= maxLevelCell)
-        cellMask.append(mask)
-    cellMask = xarray.concat(cellMask, dim='nVertLevels')
-    cellMask = cellMask.transpose('nCells', 'nVertLevels')
-    return cellMask
-
-
-def _compute_zmid_from_layer_thickness(layerThickness, ssh, cellMask):
+def _compute_zmid_from_layer_thickness(layerThickness, ssh, cellMask,
+                                       chunk_size=4096):
     """
-    Compute zMid from ssh and layerThickness for any vertical coordinate
+    Compute zMid from ssh and layerThickness for any vertical coordinate, for
+    chunks of cells small enough to stay in cache
 
     Parameters
     ----------
@@ -125,21 +117,30 @@ def _compute_zmid_from_layer_thickness(layerThickness, ssh, cellMask):
     cellMask : xarray.DataArray
         A boolean mask of where there are valid cells
 
+    chunk_size : int, optional
+        The number of cells to compute at once
+
     Returns
     -------
     zMid : xarray.DataArray
         The elevation of layer centers
     """
 
-    zTop = ssh.copy()
-    nVertLevels = layerThickness.sizes['nVertLevels']
-    zMid = []
-    for zIndex in range(nVertLevels):
-        mask = cellMask.isel(nVertLevels=zIndex)
-        thickness = layerThickness.isel(nVertLevels=zIndex).where(mask, 0.)
-        z = (zTop - 0.5*thickness).where(mask)
-        zMid.append(z)
-        zTop -= thickness
-    zMid = xarray.concat(zMid, dim='nVertLevels').transpose('Time', 'nCells',
-                                                            'nVertLevels')
-    return zMid
+    dims = ('Time', 'nCells', 'nVertLevels')
+    layerThickness = layerThickness.transpose(*dims).values
+    ssh = ssh.transpose('Time', 'nCells').values
+    cellMask = cellMask.transpose('nCells', 'nVertLevels').values
+
+    zMid = numpy.zeros(layerThickness.shape)
+    for start in range(0, layerThickness.shape[1], chunk_size):
+        cells = slice(start, start + chunk_size)
+        mask = cellMask[numpy.newaxis, cells, :]
+        thickness = numpy.where(mask, layerThickness[:, cells, :], 0.)
+        # the elevation of the top of each layer, found by subtracting the
+        # thicknesses of the layers above it from the ssh in order
+        zTop = numpy.zeros(thickness.shape)
+        zTop[:, :, 0] = ssh[:, cells]
+        zTop[:, :, 1:] = -thickness[:, :, 0:-1]
+        zTop = numpy.cumsum(zTop, axis=2)
+        zMid[:, cells, :] = numpy.where(mask, zTop - 0.5*thickness, numpy.nan)
+    return xarray.DataArray(zMid, dims=dims)
@@ -128,9 +128,11 @@ def compute_min_max_level_cell(refTopDepth, refBottomDepth, ssh, bottomDepth):
 
 
 def compute_z_level_layer_thickness(refTopDepth, refBottomDepth, ssh,
-                                    bottomDepth, minLevelCell, maxLevelCell):
+                                    bottomDepth, minLevelCell, maxLevelCell,
+                                    chunk_size=4096):
     """
-    Compute z-level layer thickness from ssh and bottomDepth
+    Compute z-level layer thickness from ssh and bottomDepth.  All levels are
+    computed at once for chunks of cells small enough to stay in cache.
 
     Parameters
     ----------
@@ -152,28 +154,37 @@ def compute_z_level_layer_thickness(refTopDepth, refBottomDepth, ssh,
     maxLevelCell : xarray.DataArray
         The zero-based index of the bottom valid level
 
+    chunk_size : int, optional
+        The number of cells to compute at once
+
     Returns
     -------
     layerThickness : xarray.DataArray
         The thickness of each layer (level)
     """
 
+    nCells = ssh.sizes['nCells']
     nVertLevels = refBottomDepth.sizes['nVertLevels']
-    layerThickness = []
-    for zIndex in range(nVertLevels):
-        mask = numpy.logical_and(zIndex >= minLevelCell,
-                                 zIndex <= maxLevelCell)
-        zTop = numpy.minimum(ssh, -refTopDepth[zIndex])
-        zBot = numpy.maximum(-bottomDepth, -refBottomDepth[zIndex])
-        thickness = (zTop - zBot).where(mask, 0.)
-        layerThickness.append(thickness)
-    layerThickness = xarray.concat(layerThickness, dim='nVertLevels')
-    layerThickness = layerThickness.transpose('nCells', 'nVertLevels')
-    return layerThickness
+    mask = compute_level_mask(minLevelCell, maxLevelCell, nVertLevels).values
+    refTopDepth = refTopDepth.values
+    refBottomDepth = refBottomDepth.values
+    ssh = ssh.values
+    bottomDepth = bottomDepth.values
+
+    layerThickness = numpy.zeros((nCells, nVertLevels))
+    for start in range(0, nCells, chunk_size):
+        cells = slice(start, start + chunk_size)
+        zTop = numpy.minimum(ssh[cells, numpy.newaxis], -refTopDepth)
+        zBot = numpy.maximum(-bottomDepth[cells, numpy.newaxis],
+                             -refBottomDepth)
+        layerThickness[cells, :] = numpy.where(mask[cells, :], zTop - zBot,
+                                               0.)
+    return xarray.DataArray(layerThickness, dims=('nCells', 'nVertLevels'))
 
 
 def compute_z_level_resting_thickness(layerThickness, ssh, bottomDepth,
-                                      minLevelCell, maxLevelCell):
+                                      minLevelCell, maxLevelCell,
+                                      chunk_size=4096):
     """
     Compute z-level resting thickness by "unstretching" layerThickness
     based on ssh and bottomDepth
@@ -195,23 +206,92 @@ def compute_z_level_resting_thickness(layerThickness, ssh, bottomDepth,
     maxLevelCell : xarray.DataArray
         The zero-based index of the bottom valid level
 
+    chunk_size : int, optional
+        The number of cells to compute at once
+
     Returns
     -------
     restingThickness : xarray.DataArray
         The thickness of z-star layers when ssh = 0
     """
 
+    layerStretch = bottomDepth / (ssh + bottomDepth)
+    return stretch_layer_thickness(layerThickness, layerStretch, minLevelCell,
+                                   maxLevelCell, chunk_size)
+
+
+def stretch_layer_thickness(layerThickness, layerStretch, minLevelCell,
+                            maxLevelCell, chunk_size=4096):
+    """
+    Stretch the thickness of each valid layer by a factor for each cell, for
+    chunks of cells small enough to stay in cache
+
+    Parameters
+    ----------
+    layerThickness : xarray.DataArray
+        The thickness of each layer (level)
+
+    layerStretch : xarray.DataArray
+        The factor to multiply layer thicknesses by in each cell
+
+    minLevelCell : xarray.DataArray
+        The zero-based index of the top valid level
+
+    maxLevelCell : xarray.DataArray
+        The zero-based index of the bottom valid level
+
+    chunk_size : int, optional
+        The number of cells to compute at once
+
+    Returns
+    -------
+    stretchedThickness : xarray.DataArray
+        The stretched thickness of each layer, which is zero for invalid
+        layers
+    """
+    nCells = layerThickness.sizes['nCells']
     nVertLevels = layerThickness.sizes['nVertLevels']
-    restingThickness = []
+    mask = compute_level_mask(minLevelCell, maxLevelCell, nVertLevels).values
+    layerThickness = layerThickness.transpose('nCells', 'nVertLevels').values
+    layerStretch = layerStretch.values
+
+    stretchedThickness = numpy.zeros((nCells, nVertLevels))
+    for start in range(0, nCells, chunk_size):
+        cells = slice(start, start + chunk_size)
+        # the stretch may be infinite in dry cells, but they are masked out
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            stretched = \
+                layerStretch[cells, numpy.newaxis] * layerThickness[cells, :]
+        stretchedThickness[cells, :] = numpy.where(mask[cells, :], stretched,
+                                                   0.)
+    return xarray.DataArray(stretchedThickness,
+                            dims=('nCells', 'nVertLevels'))
+
+
+def compute_level_mask(minLevelCell, maxLevelCell, nVertLevels):
+    """
+    Compute a mask of the valid levels in each cell in a single broadcast
+    operation
 
-    layerStretch = bottomDepth / (ssh + bottomDepth)
-    for zIndex in range(nVertLevels):
-        mask = numpy.logical_and(zIndex >= minLevelCell,
-                                 zIndex <= maxLevelCell)
-        thickness = layerStretch * layerThickness.isel(
-            nVertLevels=zIndex)
-        thickness = thickness.where(mask, 0.)
-        restingThickness.append(thickness)
-    restingThickness = xarray.concat(restingThickness, dim='nVertLevels')
-    restingThickness = restingThickness.transpose('nCells', 'nVertLevels')
-    return restingThickness
+    Parameters
+    ----------
+    minLevelCell : xarray.DataArray
+        The zero-based index of the top valid level
+
+    maxLevelCell : xarray.DataArray
+        The zero-based index of the bottom valid level
+
+    nVertLevels : int
+        The number of vertical levels
+
+    Returns
+    -------
+    mask : xarray.DataArray
+        A boolean mask of the levels between ``minLevelCell`` and
+        ``maxLevelCell`` (inclusive) in each cell
+    """
+    zIndex = numpy.arange(nVertLevels)
+    mask = numpy.logical_and(
+        minLevelCell.values[:, numpy.newaxis] <= zIndex,
+        zIndex <= maxLevelCell.values[:, numpy.newaxis])
+    return xarray.DataArray(mask, dims=('nCells', 'nVertLevels'))
@@ -1,10 +1,9 @@
 import xarray
-import numpy
 
 from compass.ocean.vertical.grid_1d import add_1d_grid
 from compass.ocean.vertical.partial_cells import alter_bottom_depth
 from compass.ocean.vertical.zlevel import compute_z_level_layer_thickness, \
-    compute_min_max_level_cell
+    compute_min_max_level_cell, stretch_layer_thickness
 
 
 def init_z_star_vertical_coord(config, ds):
@@ -108,16 +107,6 @@ def _compute_z_star_layer_thickness(restingThickness, ssh, bottomDepth,
         The thickness of each layer (level)
     """
 
-    nVertLevels = restingThickness.sizes['nVertLevels']
-    layerThickness = []
-
     layerStretch = (ssh + bottomDepth) / bottomDepth
-    for zIndex in range(nVertLevels):
-        mask = numpy.logical_and(zIndex >= minLevelCell,
-                                 zIndex <= maxLevelCell)
-        thickness = layerStretch*restingThickness.isel(nVertLevels=zIndex)
-        thickness = thickness.where(mask, 0.)
-        layerThickness.append(thickness)
-    layerThickness = xarray.concat(layerThickness, dim='nVertLevels')
-    layerThickness = layerThickness.transpose('nCells', 'nVertLevels')
-    return layerThickness
+    return stretch_layer_thickness(restingThickness, layerStretch,
+                                   minLevelCell, maxLevelCell)
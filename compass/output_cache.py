@@ -0,0 +1,253 @@
+import os
+import json
+import shutil
+import stat
+import hashlib
+import tempfile
+from lxml import etree
+
+import compass
+from compass.io import get_file_hash
+
+
+def get_output_cache_dir(config, base_work_dir):
+    """
+    Get the directory for caching step outputs if the output cache is enabled
+
+    Parameters
+    ----------
+    config : configparser.ConfigParser
+        Configuration options for the test case
+
+    base_work_dir : str
+        The base work directory, used if the cache directory is a relative
+        path
+
+    Returns
+    -------
+    cache_dir : str
+        The absolute path to the output cache, or ``None`` if the cache is not
+        enabled
+    """
+    if not config.has_section('output_cache') or \
+            not config.getboolean('output_cache', 'enabled'):
+        return None
+
+    cache_dir = config.get('output_cache', 'cache_dir')
+    return os.path.abspath(os.path.join(base_work_dir, cache_dir))
+
+
+def compute_step_hash(step):
+    """
+    Compute a hash of everything that determines the outputs of a step: the
+    contents of its input files (including the model executable), its
+    namelist and streams files as generated from the defaults, the config
+    options, the source code of the framework and the step's MPAS core, and the
+    step's path and number of cores and threads
+
+    Parameters
+    ----------
+    step : compass.Step
+        The step, which must have been set up
+
+    Returns
+    -------
+    step_hash : str
+        A SHA-256 hash as a hexadecimal string
+    """
+    sha = hashlib.sha256()
+
+    _add_to_hash(sha, 'compass', compass.__version__)
+    _add_to_hash(sha, 'path', step.path)
+    _add_to_hash(sha, 'cores', '{} {}'.format(step.cores, step.threads))
+
+    # the outputs may depend on any helper module in the MPAS core (e.g.
+    # compass.ocean.vertical) or in the framework, not just the step's class
+    compass_dir = os.path.dirname(compass.__file__)
+    for filename in sorted(os.listdir(compass_dir)):
+        if filename.endswith('.py'):
+            _add_to_hash(sha, 'source', filename)
+            _add_to_hash(sha, 'source', get_file_hash(
+                os.path.join(compass_dir, filename)))
+    core_dir = os.path.join(compass_dir, step.mpas_core.name)
+    for root, dirs, files in os.walk(core_dir):
+        dirs.sort()
+        for filename in sorted(files):
+            if filename.endswith('.py'):
+                filename = os.path.join(root, filename)
+                _add_to_hash(sha, 'source', os.path.relpath(filename,
+                                                            compass_dir))
+                _add_to_hash(sha, 'source', get_file_hash(filename))
+
+    config = step.config
+    for section in sorted(config.sections()):
+        if section in ['test_case', 'output_cache']:
+            # these options don't affect the outputs of the step
+            continue
+        for option, value in sorted(config.items(section)):
+            _add_to_hash(sha, 'config', '{}:{} = {}'.format(section, option,
+                                                            value))
+
+    for input_file in step.inputs:
+        _add_to_hash(sha, 'input', os.path.basename(input_file))
+        if os.path.isdir(input_file):
+            for root, dirs, files in os.walk(input_file):
+                dirs.sort()
+                for filename in sorted(files):
+                    filename = os.path.join(root, filename)
+                    _add_to_hash(sha, 'input', os.path.relpath(filename,
+                                                               input_file))
+                    _add_to_hash(sha, 'input', get_file_hash(filename))
+        else:
+            _add_to_hash(sha, 'input', get_file_hash(input_file))
+
+    if not step.cached:
+        for out_name in sorted(step.namelist_data):
+            namelist = step._build_namelist(out_name)
+            _add_to_hash(sha, 'namelist', out_name)
+            for record in namelist:
+                for option, value in namelist[record].items():
+                    _add_to_hash(sha, 'namelist', '{}:{} = {}'.format(
+                        record, option.strip(), value.strip()))
+
+        for out_name in sorted(step.streams_data):
+            tree = step._build_streams(out_name)
+            _add_to_hash(sha, 'streams', out_name)
+            _add_to_hash(sha, 'streams', etree.tostring(tree))
+
+    return sha.hexdigest()
+
+
+def restore_outputs(step, step_hash, cache_dir):
+    """
+    Restore the outputs of a step from the output cache if a previous run of
+    the step with the same hash was cached.  The outputs are copies of the
+    files in the cache, so they can be modified without affecting the cache.
+    Steps without any outputs are never restored, since there is nothing to
+    show that they have been run.
+
+    Parameters
+    ----------
+    step : compass.Step
+        The step
+
+    step_hash : str
+        The hash of the step from
+        :py:func:`compass.output_cache.compute_step_hash()`
+
+    cache_dir : str
+        The directory where step outputs are cached
+
+    Returns
+    -------
+    restored : bool
+        Whether the outputs were found in the cache and restored
+    """
+    if len(step.outputs) == 0:
+        return False
+
+    entry_dir = _get_entry_dir(step_hash, cache_dir)
+    manifest_filename = os.path.join(entry_dir, 'manifest.json')
+    if not os.path.exists(manifest_filename):
+        return False
+
+    with open(manifest_filename) as data_file:
+        manifest = json.load(data_file)
+
+    cached_outputs = manifest['outputs']
+    sources = dict()
+    for output in step.outputs:
+        relative = os.path.relpath(output, step.work_dir)
+        if relative not in cached_outputs:
+            return False
+        source = os.path.join(entry_dir, cached_outputs[relative])
+        if not os.path.exists(source):
+            return False
+        sources[output] = source
+
+    for output, source in sources.items():
+        directory = os.path.dirname(output)
+        try:
+            os.makedirs(directory)
+        except OSError:
+            pass
+        if os.path.lexists(output):
+            os.remove(output)
+        shutil.copyfile(source, output)
+
+    return True
+
+
+def store_outputs(step, step_hash, cache_dir):
+    """
+    Store the outputs of a step that has run successfully in the output cache.
+    The outputs are copied into the cache and made read-only, so later changes
+    to the files in the work directory don't affect the cache.  Steps without
+    any outputs are not cached.
+
+    Parameters
+    ----------
+    step : compass.Step
+        The step
+
+    step_hash : str
+        The hash of the step from
+        :py:func:`compass.output_cache.compute_step_hash()`
+
+    cache_dir : str
+        The directory where step outputs are cached
+    """
+    if len(step.outputs) == 0:
+        return
+
+    entry_dir = _get_entry_dir(step_hash, cache_dir)
+    if os.path.exists(entry_dir):
+        return
+
+    for output in step.outputs:
+        if os.path.isdir(output):
+            # we only know how to cache files
+            return
+
+    parent_dir = os.path.dirname(entry_dir)
+    try:
+        os.makedirs(parent_dir)
+    except OSError:
+        pass
+
+    # write to a temporary directory and rename it when we're done, so
+    # partial entries are never used
+    temp_dir = tempfile.mkdtemp(dir=parent_dir)
+    cached_outputs = dict()
+    for index, output in enumerate(step.outputs):
+        relative = os.path.relpath(output, step.work_dir)
+        cached_name = '{}_{}'.format(index, os.path.basename(output))
+        source = os.path.realpath(output)
+        destination = os.path.join(temp_dir, cached_name)
+        shutil.copyfile(source, destination)
+        os.chmod(destination, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+        cached_outputs[relative] = cached_name
+
+    manifest = {'step': step.path,
+                'outputs': cached_outputs}
+    with open(os.path.join(temp_dir, 'manifest.json'), 'w') as data_file:
+        json.dump(manifest, data_file, indent=4)
+
+    try:
+        os.rename(temp_dir, entry_dir)
+    except OSError:
+        # another process must have cached the same outputs first
+        shutil.rmtree(temp_dir)
+
+
+def _get_entry_dir(step_hash, cache_dir):
+    """ The directory in the cache for the step with the given hash """
+    return os.path.join(cache_dir, step_hash[0:2], step_hash)
+
+
+def _add_to_hash(sha, tag, value):
+    """ Add a tagged string or bytes to a hash """
+    if isinstance(value, str):
+        value = value.encode('utf-8')
+    sha.update('{}:{}:'.format(tag, len(value)).encode('utf-8'))
+    sha.update(value)
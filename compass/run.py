@@ -5,13 +5,16 @@ import pickle
 import configparser
 import time
 import glob
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 
 from mpas_tools.logging import LoggingContext
 import mpas_tools.io
-from compass.parallel import check_parallel_system
+from compass.parallel import check_parallel_system, \
+    get_available_cores_and_nodes
+from compass.dag import build_dag, get_test_case_dependencies
 
 
-def run_suite(suite_name, quiet=False):
+def run_suite(suite_name, quiet=False, parallel=False):
     """
     Run the given test suite
 
@@ -24,15 +27,14 @@ def run_suite(suite_name, quiet=False):
         Whether step names are not included in the output as the test suite
         progresses
 
+    parallel : bool, optional
+        Whether to run test cases concurrently, as long as the test cases they
+        depend on have finished and the cores they need are available.  Step
+        names are never included in the output in parallel mode.
     """
-    # ANSI fail text: https://stackoverflow.com/a/287944/7728169
-    start_fail = '\033[91m'
-    start_pass = '\033[92m'
-    end = '\033[0m'
-    pass_str = '{}PASS{}'.format(start_pass, end)
-    success_str = '{}SUCCESS{}'.format(start_pass, end)
-    fail_str = '{}FAIL{}'.format(start_fail, end)
-    error_str = '{}ERROR{}'.format(start_fail, end)
+    status_strings = _get_status_strings()
+    pass_str = status_strings['pass']
+    fail_str = status_strings['fail']
 
     # Allow a suite name to either include or not the .pickle suffix
     if suite_name.endswith('.pickle'):
@@ -69,99 +71,27 @@ def run_suite(suite_name, quiet=False):
         suite_start = time.time()
         test_times = dict()
         success = dict()
-        for test_name in test_suite['test_cases']:
-            test_case = test_suite['test_cases'][test_name]
-
-            logger.info('{}'.format(test_name))
-
-            test_name = test_case.path.replace('/', '_')
-            log_filename = '{}/case_outputs/{}.log'.format(cwd, test_name)
-            with LoggingContext(test_name, log_filename=log_filename) as \
-                    test_logger:
-                if quiet:
-                    # just log the step names and any failure messages to the
-                    # log file
-                    test_case.stdout_logger = test_logger
-                else:
-                    # log steps to stdout
-                    test_case.stdout_logger = logger
-                test_case.logger = test_logger
-                test_case.log_filename = log_filename
-                test_case.new_step_log_file = False
-
-                os.chdir(test_case.work_dir)
-
-                config = configparser.ConfigParser(
-                    interpolation=configparser.ExtendedInterpolation())
-                config.read(test_case.config_filename)
-                test_case.config = config
-
-                mpas_tools.io.default_format = config.get('io', 'format')
-                mpas_tools.io.default_engine = config.get('io', 'engine')
-
-                test_case.steps_to_run = config.get(
-                    'test_case', 'steps_to_run').replace(',', ' ').split()
-
-                test_start = time.time()
-                try:
-                    test_case.run()
-                    run_status = success_str
-                    test_pass = True
-                except BaseException:
-                    run_status = error_str
-                    test_pass = False
-                    test_logger.exception('Exception raised in run()')
-
-                if test_pass:
-                    try:
-                        test_case.validate()
-                    except BaseException:
-                        run_status = error_str
-                        test_pass = False
-                        test_logger.exception('Exception raised in validate()')
-
-                baseline_status = None
-                internal_status = None
-                if test_case.validation is not None:
-                    internal_pass = test_case.validation['internal_pass']
-                    baseline_pass = test_case.validation['baseline_pass']
-
-                    if internal_pass is not None:
-                        if internal_pass:
-                            internal_status = pass_str
-                        else:
-                            internal_status = fail_str
-                            test_logger.exception(
-                                'Internal test case validation failed')
-                            test_pass = False
-
-                    if baseline_pass is not None:
-                        if baseline_pass:
-                            baseline_status = pass_str
-                        else:
-                            baseline_status = fail_str
-                            test_logger.exception('Baseline validation failed')
-                            test_pass = False
-
-                status = '  test execution:      {}'.format(run_status)
-                if internal_status is not None:
-                    status = '{}\n  test validation:     {}'.format(
-                        status, internal_status)
-                if baseline_status is not None:
-                    status = '{}\n  baseline comparison: {}'.format(
-                        status, baseline_status)
-
-                if test_pass:
-                    logger.info(status)
-                    success[test_name] = pass_str
-                else:
-                    logger.error(status)
-                    logger.error('  see: case_outputs/{}.log'.format(
-                        test_name))
-                    success[test_name] = fail_str
-                    failures += 1
-
-                test_times[test_name] = time.time() - test_start
+        if parallel:
+            available_cores, _ = get_available_cores_and_nodes(config)
+            if 'dag' in test_suite:
+                dag = test_suite['dag']
+            else:
+                # the suite was set up before the DAG was added
+                dag = build_dag(test_suite['test_cases'])
+            results = _run_tests_in_parallel(test_suite['test_cases'], dag,
+                                             available_cores, logger, cwd)
+        else:
+            results = _run_tests_in_serial(test_suite['test_cases'], logger,
+                                           quiet, cwd)
+
+        for test_name, (test_pass, test_time) in results.items():
+            if test_pass:
+                success[test_name] = pass_str
+            else:
+                success[test_name] = fail_str
+                failures += 1
+
+            test_times[test_name] = test_time
 
         suite_time = time.time() - suite_start
 
@@ -298,9 +228,15 @@ def main():
                              "output as the test suite progresses.  Has no "
                              "effect when running test cases or steps on "
                              "their own.")
+    parser.add_argument("--parallel", dest="parallel", action="store_true",
+                        help="If set, test cases in a test suite are run "
+                             "concurrently when the test cases they depend "
+                             "on have finished and enough cores are "
+                             "available.  Has no effect when running test "
+                             "cases or steps on their own.")
     args = parser.parse_args(sys.argv[2:])
     if args.suite is not None:
-        run_suite(args.suite, quiet=args.quiet)
+        run_suite(args.suite, quiet=args.quiet, parallel=args.parallel)
     elif os.path.exists('test_case.pickle'):
         run_test_case(args.steps, args.no_steps)
     elif os.path.exists('step.pickle'):
@@ -309,10 +245,243 @@ def main():
         pickles = glob.glob('*.pickle')
         if len(pickles) == 1:
             suite = os.path.splitext(os.path.basename(pickles[0]))[0]
-            run_suite(suite, quiet=args.quiet)
+            run_suite(suite, quiet=args.quiet, parallel=args.parallel)
         elif len(pickles) == 0:
             raise OSError('No pickle files were found. Are you sure this is '
                           'a compass suite, test-case or step work directory?')
         else:
             raise ValueError('More than one suite was found. Please specify '
                              'which to run: compass run <suite>')
+
+
+def _run_tests_in_serial(test_cases, logger, quiet, cwd):
+    """
+    Run the test cases in a suite one after another, returning whether each
+    passed and how long it took
+    """
+    results = dict()
+    for test_name in test_cases:
+        test_case = test_cases[test_name]
+
+        logger.info('{}'.format(test_name))
+
+        test_name = test_case.path.replace('/', '_')
+        log_filename = '{}/case_outputs/{}.log'.format(cwd, test_name)
+        with LoggingContext(test_name, log_filename=log_filename) as \
+                test_logger:
+            if quiet:
+                # just log the step names and any failure messages to the
+                # log file
+                stdout_logger = test_logger
+            else:
+                # log steps to stdout
+                stdout_logger = logger
+
+            test_start = time.time()
+            test_pass, status = _run_test(test_case, test_logger,
+                                          stdout_logger, log_filename)
+            _log_test_status(logger, test_name, test_pass, status)
+
+            results[test_name] = (test_pass, time.time() - test_start)
+
+    return results
+
+
+def _run_tests_in_parallel(test_cases, dag, available_cores, logger, cwd):
+    """
+    Run the test cases in a suite in separate processes, starting each test
+    case (in the order of the suite) as soon as the test cases it depends on
+    have finished and enough of the available cores are free.  Returns whether
+    each test case passed and how long it took, in the order of the suite
+    """
+    # only depend on earlier test cases in the suite, as when running in
+    # serial
+    all_dependencies = get_test_case_dependencies(dag)
+    dependencies = dict()
+    previous = list()
+    for path in test_cases:
+        dependencies[path] = [other for other in
+                              all_dependencies.get(path, list()) if
+                              other in previous]
+        previous.append(path)
+
+    required_cores = dict()
+    for path, test_case in test_cases.items():
+        required_cores[path] = min(_get_test_case_cores(test_case),
+                                   available_cores)
+
+    pending = list(test_cases)
+    finished = set()
+    running = dict()
+    free_cores = available_cores
+    results = dict()
+    max_workers = max(1, min(available_cores, len(test_cases)))
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        while len(pending) > 0 or len(running) > 0:
+            for path in list(pending):
+                ready = all([dependency in finished for dependency in
+                             dependencies[path]])
+                if ready and required_cores[path] <= free_cores:
+                    pending.remove(path)
+                    free_cores -= required_cores[path]
+                    future = executor.submit(_run_test_in_subprocess,
+                                             test_cases[path], cwd)
+                    running[future] = path
+
+            if len(running) == 0:
+                raise ValueError('None of the remaining test cases can be '
+                                 'run: {}'.format(', '.join(pending)))
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                path = running.pop(future)
+                free_cores += required_cores[path]
+                finished.add(path)
+
+                test_name = test_cases[path].path.replace('/', '_')
+                logger.info('{}'.format(path))
+                try:
+                    test_pass, status, test_time = future.result()
+                except BaseException:
+                    logger.exception('Exception raised while running the '
+                                     'test case in a separate process')
+                    test_pass = False
+                    status = '  test execution:      {}'.format(
+                        _get_status_strings()['error'])
+                    test_time = 0.
+                _log_test_status(logger, test_name, test_pass, status)
+                results[test_name] = (test_pass, test_time)
+
+    # report the results in the order of the suite, not the order of
+    # completion
+    ordered_results = dict()
+    for test_case in test_cases.values():
+        test_name = test_case.path.replace('/', '_')
+        ordered_results[test_name] = results[test_name]
+
+    return ordered_results
+
+
+def _run_test_in_subprocess(test_case, cwd):
+    """
+    Run a test case in a worker process, logging everything (including step
+    names) to the test case's log file in ``case_outputs``
+    """
+    test_name = test_case.path.replace('/', '_')
+    log_filename = '{}/case_outputs/{}.log'.format(cwd, test_name)
+    test_start = time.time()
+    with LoggingContext(test_name, log_filename=log_filename) as test_logger:
+        test_pass, status = _run_test(test_case, test_logger, test_logger,
+                                      log_filename)
+    return test_pass, status, time.time() - test_start
+
+
+def _run_test(test_case, test_logger, stdout_logger, log_filename):
+    """
+    Run and validate a test case within a test suite, returning whether it
+    passed and a summary of the status of execution and validation
+    """
+    status_strings = _get_status_strings()
+    pass_str = status_strings['pass']
+    success_str = status_strings['success']
+    fail_str = status_strings['fail']
+    error_str = status_strings['error']
+
+    test_case.stdout_logger = stdout_logger
+    test_case.logger = test_logger
+    test_case.log_filename = log_filename
+    test_case.new_step_log_file = False
+
+    os.chdir(test_case.work_dir)
+
+    config = configparser.ConfigParser(
+        interpolation=configparser.ExtendedInterpolation())
+    config.read(test_case.config_filename)
+    test_case.config = config
+
+    mpas_tools.io.default_format = config.get('io', 'format')
+    mpas_tools.io.default_engine = config.get('io', 'engine')
+
+    test_case.steps_to_run = config.get(
+        'test_case', 'steps_to_run').replace(',', ' ').split()
+
+    try:
+        test_case.run()
+        run_status = success_str
+        test_pass = True
+    except BaseException:
+        run_status = error_str
+        test_pass = False
+        test_logger.exception('Exception raised in run()')
+
+    if test_pass:
+        try:
+            test_case.validate()
+        except BaseException:
+            run_status = error_str
+            test_pass = False
+            test_logger.exception('Exception raised in validate()')
+
+    baseline_status = None
+    internal_status = None
+    if test_case.validation is not None:
+        internal_pass = test_case.validation['internal_pass']
+        baseline_pass = test_case.validation['baseline_pass']
+
+        if internal_pass is not None:
+            if internal_pass:
+                internal_status = pass_str
+            else:
+                internal_status = fail_str
+                test_logger.exception(
+                    'Internal test case validation failed')
+                test_pass = False
+
+        if baseline_pass is not None:
+            if baseline_pass:
+                baseline_status = pass_str
+            else:
+                baseline_status = fail_str
+                test_logger.exception('Baseline validation failed')
+                test_pass = False
+
+    status = '  test execution:      {}'.format(run_status)
+    if internal_status is not None:
+        status = '{}\n  test validation:     {}'.format(
+            status, internal_status)
+    if baseline_status is not None:
+        status = '{}\n  baseline comparison: {}'.format(
+            status, baseline_status)
+
+    return test_pass, status
+
+
+def _log_test_status(logger, test_name, test_pass, status):
+    """ Log the status of a test case that has finished running """
+    if test_pass:
+        logger.info(status)
+    else:
+        logger.error(status)
+        logger.error('  see: case_outputs/{}.log'.format(test_name))
+
+
+def _get_status_strings():
+    """ Get colored strings for the status of a test case """
+    # ANSI fail text: https://stackoverflow.com/a/287944/7728169
+    start_fail = '\033[91m'
+    start_pass = '\033[92m'
+    end = '\033[0m'
+    return {'pass': '{}PASS{}'.format(start_pass, end),
+            'success': '{}SUCCESS{}'.format(start_pass, end),
+            'fail': '{}FAIL{}'.format(start_fail, end),
+            'error': '{}ERROR{}'.format(start_fail, end)}
+
+
+def _get_test_case_cores(test_case):
+    """ The number of cores needed by the largest step in a test case """
+    cores = 1
+    for step_name in test_case.steps_to_run:
+        step = test_case.steps[step_name]
+        if not step.cached:
+            cores = max(cores, step.cores)
+    return cores
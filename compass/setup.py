@@ -10,8 +10,9 @@ from mache import MachineInfo, discover_machine
 from compass.mpas_cores import get_mpas_cores
 from compass.config import add_config, merge_other_config, \
     ensure_absolute_paths
-from compass.io import symlink
+from compass.io import symlink, DownloadManager
 from compass import provenance
+from compass.dag import build_dag, get_subgraph
 
 
 def setup_cases(tests=None, numbers=None, config_file=None, machine=None,
@@ -139,15 +140,37 @@ def setup_cases(tests=None, numbers=None, config_file=None, machine=None,
                      config_filename=config_file,
                      mpas_model_path=mpas_model_path)
 
+    # downloads are queued while test cases are set up and then performed
+    # concurrently
+    download_manager = DownloadManager()
+
     print('Setting up test cases:')
     for path, test_case in test_cases.items():
         setup_case(path, test_case, config_file, machine, machine_info,
                    work_dir, baseline_dir, mpas_model_path,
-                   cached_steps=cached_steps[path])
+                   cached_steps=cached_steps[path],
+                   download_manager=download_manager)
+
+    if len(download_manager.downloads) > 0:
+        config = test_cases[first_path].config
+        download_manager.threads = config.getint('download', 'threads')
+        print('Downloading {} files:'.format(
+            len(download_manager.downloads)))
+    download_manager.download_all()
+
+    # now that all the steps have been set up, we can find the dependencies
+    # between them (including across test cases)
+    dag = build_dag(test_cases)
+    for path, test_case in test_cases.items():
+        pickle_filename = os.path.join(test_case.work_dir, 'dag.pickle')
+        with open(pickle_filename, 'wb') as handle:
+            pickle.dump(get_subgraph(dag, path), handle,
+                        protocol=pickle.HIGHEST_PROTOCOL)
 
     test_suite = {'name': suite_name,
                   'test_cases': test_cases,
-                  'work_dir': work_dir}
+                  'work_dir': work_dir,
+                  'dag': dag}
 
     # pickle the test or step dictionary for use at runtime
     pickle_file = os.path.join(test_suite['work_dir'],
@@ -169,7 +192,8 @@ def setup_cases(tests=None, numbers=None, config_file=None, machine=None,
 
 
 def setup_case(path, test_case, config_file, machine, machine_info, work_dir,
-               baseline_dir, mpas_model_path, cached_steps):
+               baseline_dir, mpas_model_path, cached_steps,
+               download_manager=None):
     """
     Set up one or more test cases
 
@@ -206,6 +230,10 @@ def setup_case(path, test_case, config_file, machine, machine_info, work_dir,
     cached_steps : list of str
         Which steps (if any) should be cached.  If all steps should be cached,
          the first entry is "_all"
+
+    download_manager : compass.io.DownloadManager, optional
+        A download manager to queue downloads with.  If none is provided,
+        files are downloaded as each step is set up.
     """
 
     print('  {}'.format(path))
@@ -308,7 +336,7 @@ def setup_case(path, test_case, config_file, machine, machine_info, work_dir,
         step.setup()
 
         # process input, output, namelist and streams files
-        step.process_inputs_and_outputs()
+        step.process_inputs_and_outputs(download_manager=download_manager)
 
     # wait until we've set up all the steps before pickling because steps may
     # need other steps to be set up
@@ -458,7 +458,7 @@ class Step:
             dict(package=package, streams=streams,
                  replacements=template_replacements, mode=mode))
 
-    def process_inputs_and_outputs(self):
+    def process_inputs_and_outputs(self, download_manager=None):
         """
         Process the inputs to and outputs from a step added with
         :py:meth:`compass.Step.add_input_file` and
@@ -467,6 +467,16 @@ class Step:
         paths.
 
         Also generates namelist and streams files
+
+        Parameters
+        ----------
+        download_manager : compass.io.DownloadManager, optional
+            A download manager to queue downloads with, so they can be
+            performed concurrently with those of other steps once all steps
+            have been set up.  Symlinks to files that are queued are created
+            right away.  Files that need to be copied into the step's work
+            directory are downloaded immediately.  By default, files are
+            downloaded immediately.
        """
         mpas_core = self.mpas_core.name
         step_dir = self.work_dir
@@ -519,6 +529,7 @@ class Step:
                 download_target = filename
 
             download_path = None
+            database_dir = None
 
             if database is not None:
                 # we're downloading a file to a cache of a database (if it's
@@ -532,16 +543,20 @@ class Step:
 
                 database_root = config.get(
                     'paths', '{}_database_root'.format(mpas_core))
-                download_path = os.path.join(database_root, database,
-                                             download_target)
+                database_dir = os.path.join(database_root, database)
+                download_path = os.path.join(database_dir, download_target)
                 if not os.path.exists(download_path):
-                    database_subdir = os.path.join(database_root, database)
-                    databases_with_downloads.add(database_subdir)
+                    databases_with_downloads.add(database_dir)
             elif url is not None:
                 download_path = download_target
 
             if url is not None:
-                download_target = download(url, download_path, config)
+                if download_manager is not None and not copy:
+                    download_target = download_manager.add(
+                        url, download_path, config, database_dir=database_dir)
+                else:
+                    download_target = download(url, download_path, config,
+                                               database_dir=database_dir)
                 if target is not None:
                     # this is the absolute path that we presumably want
                     target = download_target
@@ -557,7 +572,11 @@ class Step:
                 inputs.append(filename)
 
         if len(databases_with_downloads) > 0:
-            self._fix_permissions(databases_with_downloads)
+            if download_manager is not None:
+                download_manager.add_callback(self._fix_permissions,
+                                              databases_with_downloads)
+            else:
+                self._fix_permissions(databases_with_downloads)
 
         # convert inputs and outputs to absolute paths
         self.inputs = [os.path.abspath(os.path.join(step_dir, filename)) for
@@ -580,33 +599,11 @@ class Step:
             return
 
         step_work_dir = self.work_dir
-        config = self.config
 
         for out_name in self.namelist_data:
-
-            replacements = dict()
-
-            mode = None
-
-            for entry in self.namelist_data[out_name]:
-                if mode is None:
-                    mode = entry['mode']
-                else:
-                    assert mode == entry['mode']
-                if 'options' in entry:
-                    # this is a dictionary of replacement namelist options
-                    options = entry['options']
-                else:
-                    options = compass.namelist.parse_replacements(
-                        entry['package'], entry['namelist'])
-                replacements.update(options)
-
-            defaults_filename = config.get('namelists', mode)
             out_filename = '{}/{}'.format(step_work_dir, out_name)
 
-            namelist = compass.namelist.ingest(defaults_filename)
-
-            namelist = compass.namelist.replace(namelist, replacements)
+            namelist = self._build_namelist(out_name)
 
             compass.namelist.write(namelist, out_filename)
 
@@ -620,48 +617,90 @@ class Step:
             return
 
         step_work_dir = self.work_dir
-        config = self.config
 
         for out_name in self.streams_data:
+            out_filename = '{}/{}'.format(step_work_dir, out_name)
 
-            # generate the streams file
-            tree = None
+            defaults_tree = self._build_streams(out_name)
 
-            mode = None
+            compass.streams.write(defaults_tree, out_filename)
 
-            for entry in self.streams_data[out_name]:
-                if mode is None:
-                    mode = entry['mode']
-                else:
-                    assert mode == entry['mode']
+    def _build_namelist(self, out_name):
+        """
+        Build a namelist from the defaults with new values given by parsing
+        the files and dictionaries in the step's ``namelist_data``.
+        """
+        config = self.config
 
-                tree = compass.streams.read(
-                    package=entry['package'],
-                    streams_filename=entry['streams'],
-                    replacements=entry['replacements'], tree=tree)
+        replacements = dict()
 
-            defaults_filename = config.get('streams', mode)
-            out_filename = '{}/{}'.format(step_work_dir, out_name)
+        mode = None
+
+        for entry in self.namelist_data[out_name]:
+            if mode is None:
+                mode = entry['mode']
+            else:
+                assert mode == entry['mode']
+            if 'options' in entry:
+                # this is a dictionary of replacement namelist options
+                options = entry['options']
+            else:
+                options = compass.namelist.parse_replacements(
+                    entry['package'], entry['namelist'])
+            replacements.update(options)
+
+        defaults_filename = config.get('namelists', mode)
+
+        namelist = compass.namelist.ingest(defaults_filename)
+
+        namelist = compass.namelist.replace(namelist, replacements)
+
+        return namelist
+
+    def _build_streams(self, out_name):
+        """
+        Build a streams XML tree from the defaults with new values given by
+        parsing the files and dictionaries in the step's ``streams_data``.
+        """
+        config = self.config
+
+        # generate the streams file
+        tree = None
+
+        mode = None
+
+        for entry in self.streams_data[out_name]:
+            if mode is None:
+                mode = entry['mode']
+            else:
+                assert mode == entry['mode']
+
+            tree = compass.streams.read(
+                package=entry['package'],
+                streams_filename=entry['streams'],
+                replacements=entry['replacements'], tree=tree)
+
+        defaults_filename = config.get('streams', mode)
 
-            defaults_tree = etree.parse(defaults_filename)
+        defaults_tree = etree.parse(defaults_filename)
 
-            defaults = next(defaults_tree.iter('streams'))
-            streams = next(tree.iter('streams'))
+        defaults = next(defaults_tree.iter('streams'))
+        streams = next(tree.iter('streams'))
 
+        for stream in streams:
+            compass.streams.update_defaults(stream, defaults)
+
+        # remove any streams that aren't requested
+        for default in defaults:
+            found = False
             for stream in streams:
-                compass.streams.update_defaults(stream, defaults)
-
-            # remove any streams that aren't requested
-            for default in defaults:
-                found = False
-                for stream in streams:
-                    if stream.attrib['name'] == default.attrib['name']:
-                        found = True
-                        break
-                if not found:
-                    defaults.remove(default)
+                if stream.attrib['name'] == default.attrib['name']:
+                    found = True
+                    break
+            if not found:
+                defaults.remove(default)
 
-            compass.streams.write(defaults_tree, out_filename)
+        return defaults_tree
 
     def _fix_permissions(self, databases):
         """
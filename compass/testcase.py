@@ -3,6 +3,8 @@ import configparser
 
 from mpas_tools.logging import LoggingContext
 from compass.parallel import get_available_cores_and_nodes
+from compass.output_cache import get_output_cache_dir, compute_step_hash, \
+    restore_outputs, store_outputs
 
 
 class TestCase:
@@ -260,6 +262,13 @@ class TestCase:
                     step.name, step.mpas_core.name, step.test_group.name,
                     step.test_case.subdir, missing_files))
 
+        cache_dir = get_output_cache_dir(config, step.base_work_dir)
+        if cache_dir is not None:
+            step_hash = compute_step_hash(step)
+            if restore_outputs(step, step_hash, cache_dir):
+                self._print_to_stdout('      Restored outputs from cache')
+                return
+
         test_name = step.path.replace('/', '_')
         if new_log_file:
             log_filename = '{}/{}.log'.format(cwd, step.name)
@@ -284,3 +293,6 @@ class TestCase:
                 'output file(s) missing in step {} of {}/{}/{}: {}'.format(
                     step.name, step.mpas_core.name, step.test_group.name,
                     step.test_case.subdir, missing_files))
+
+        if cache_dir is not None:
+            store_outputs(step, step_hash, cache_dir)
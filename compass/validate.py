@@ -1,8 +1,15 @@
 import os
+import io
 import numpy
 import xarray
 import re
 import fnmatch
+from concurrent.futures import ThreadPoolExecutor
+
+
+# the maximum number of values of a variable to read at once when computing
+# norms
+_chunk_size = 2**22
 
 
 def compare_variables(test_case, variables, filename1, filename2=None,
@@ -120,38 +127,54 @@ def compare_variables(test_case, variables, filename1, filename2=None,
         validation = {'internal_pass': None,
                       'baseline_pass': None}
 
-    if filename2 is not None:
-        internal_pass = _compare_variables(
-            variables, path1, path2, l1_norm, l2_norm, linf_norm, quiet)
-
-        if validation['internal_pass'] is None:
-            validation['internal_pass'] = internal_pass
-        else:
-            validation['internal_pass'] = \
-                validation['internal_pass'] and internal_pass
+    config = test_case.config
+    threads = 1
+    if config is not None and config.has_option('parallel',
+                                                'validation_threads'):
+        threads = config.getint('parallel', 'validation_threads')
 
-    if test_case.baseline_dir is not None:
-        baseline_root = test_case.baseline_dir
-        baseline_pass = True
+    # the comparisons of each variable in each pair of files are performed
+    # concurrently, but the results are reported in order once they are done
+    with ThreadPoolExecutor(max_workers=max(1, threads)) as executor:
+        internal_futures = None
+        if filename2 is not None:
+            internal_futures = _submit_comparisons(
+                executor, variables, path1, path2, l1_norm, l2_norm,
+                linf_norm, quiet)
+
+        baseline_futures = list()
+        if test_case.baseline_dir is not None:
+            baseline_root = test_case.baseline_dir
+            filenames = [filename1]
+            if filename2 is not None:
+                filenames.append(filename2)
+            for filename in filenames:
+                baseline_futures.append(_submit_comparisons(
+                    executor, variables, os.path.join(work_dir, filename),
+                    os.path.join(baseline_root, filename), l1_norm=0.0,
+                    l2_norm=0.0, linf_norm=0.0, quiet=quiet,
+                    exit_early=True))
+
+        if internal_futures is not None:
+            internal_pass = _collect_comparisons(internal_futures)
+
+            if validation['internal_pass'] is None:
+                validation['internal_pass'] = internal_pass
+            else:
+                validation['internal_pass'] = \
+                    validation['internal_pass'] and internal_pass
 
-        result = _compare_variables(
-            variables, os.path.join(work_dir, filename1),
-            os.path.join(baseline_root, filename1), l1_norm=0.0, l2_norm=0.0,
-            linf_norm=0.0, quiet=quiet)
-        baseline_pass = baseline_pass and result
+        if len(baseline_futures) > 0:
+            baseline_pass = True
+            for futures in baseline_futures:
+                result = _collect_comparisons(futures)
+                baseline_pass = baseline_pass and result
 
-        if filename2 is not None:
-            result = _compare_variables(
-                variables, os.path.join(work_dir, filename2),
-                os.path.join(baseline_root, filename2), l1_norm=0.0,
-                l2_norm=0.0, linf_norm=0.0, quiet=quiet)
-            baseline_pass = baseline_pass and result
-
-        if validation['baseline_pass'] is None:
-            validation['baseline_pass'] = baseline_pass
-        else:
-            validation['baseline_pass'] = \
-                validation['baseline_pass'] and baseline_pass
+            if validation['baseline_pass'] is None:
+                validation['baseline_pass'] = baseline_pass
+            else:
+                validation['baseline_pass'] = \
+                    validation['baseline_pass'] and baseline_pass
 
     test_case.validation = validation
 
@@ -199,122 +222,273 @@ def compare_timers(test_case, timers, rundir1, rundir2=None):
                             os.path.join(work_dir, rundir2), timers)
 
 
-def _compare_variables(variables, filename1, filename2, l1_norm, l2_norm,
-                       linf_norm, quiet):
-    """ compare fields in the two files """
+def _submit_comparisons(executor, variables, filename1, filename2, l1_norm,
+                        l2_norm, linf_norm, quiet, exit_early=False):
+    """
+    Submit the comparison of each variable in two files to an executor,
+    returning a list of futures
+    """
 
     for filename in [filename1, filename2]:
         if not os.path.exists(filename):
             raise OSError('File {} does not exist.'.format(filename))
 
-    ds1 = xarray.open_dataset(filename1)
-    ds2 = xarray.open_dataset(filename2)
+    futures = list()
+    for variable in variables:
+        futures.append(executor.submit(
+            _compare_variable, variable, filename1, filename2, l1_norm,
+            l2_norm, linf_norm, quiet, exit_early))
+
+    return futures
+
 
+def _collect_comparisons(futures):
+    """
+    Print the output from comparing variables in the order they were
+    submitted and return whether they all passed
+    """
     all_pass = True
+    for future in futures:
+        variable_pass, output = future.result()
+        print(output, end='')
+        all_pass = all_pass and variable_pass
+    return all_pass
 
-    for variable in variables:
-        for ds, filename in [(ds1, filename1), (ds2, filename2)]:
-            if variable not in ds:
-                raise ValueError('Variable {} not in {}.'.format(
-                    variable, filename))
 
-        da1 = ds1[variable]
-        da2 = ds2[variable]
+def _compare_variable(variable, filename1, filename2, l1_norm, l2_norm,
+                      linf_norm, quiet, exit_early):
+    """
+    compare a field in two files, returning whether the comparison passed and
+    the output to print
+    """
+    output = io.StringIO()
+
+    # if no differences are allowed, we first check if the raw data in the
+    # files is identical, in which case we don't need to compute norms
+    bitwise = all([norm is None or norm == 0. for norm in
+                   [l1_norm, l2_norm, linf_norm]])
+
+    with xarray.open_dataset(filename1) as ds1, \
+            xarray.open_dataset(filename2) as ds2, \
+            xarray.open_dataset(filename1, decode_cf=False) as raw_ds1, \
+            xarray.open_dataset(filename2, decode_cf=False) as raw_ds2:
+
+        if not bitwise:
+            raw_ds1 = None
+            raw_ds2 = None
+
+        variable_pass = _compare_datasets(
+            variable, ds1, ds2, raw_ds1, raw_ds2, filename1, filename2,
+            l1_norm, l2_norm, linf_norm, quiet, exit_early, output)
+
+    return variable_pass, output.getvalue()
+
 
-        if not numpy.all(da1.dims == da2.dims):
-            raise ValueError("Dimensions for variable {} don't match between "
+def _compare_datasets(variable, ds1, ds2, raw_ds1, raw_ds2, filename1,
+                      filename2, l1_norm, l2_norm, linf_norm, quiet,
+                      exit_early, output):
+    """
+    compare a field in two data sets, first checking if the raw data is
+    bitwise identical if raw data sets are provided
+    """
+    for ds, filename in [(ds1, filename1), (ds2, filename2)]:
+        if variable not in ds:
+            raise ValueError('Variable {} not in {}.'.format(
+                variable, filename))
+
+    da1 = ds1[variable]
+    da2 = ds2[variable]
+
+    if not numpy.all(da1.dims == da2.dims):
+        raise ValueError("Dimensions for variable {} don't match between "
+                         "files {} and {}.".format(
+                             variable, filename1, filename2))
+
+    for dim in da1.sizes:
+        if da1.sizes[dim] != da2.sizes[dim]:
+            raise ValueError("Field sizes for variable {} don't match "
                              "files {} and {}.".format(
                                  variable, filename1, filename2))
 
-        for dim in da1.sizes:
-            if da1.sizes[dim] != da2.sizes[dim]:
-                raise ValueError("Field sizes for variable {} don't match "
-                                 "files {} and {}.".format(
-                                     variable, filename1, filename2))
-
-        if not quiet:
-            print("    Pass thresholds are:")
-            if l1_norm is not None:
-                print("       L1: {:16.14e}".format(l1_norm))
-            if l2_norm is not None:
-                print("       L2: {:16.14e}".format(l2_norm))
-            if linf_norm is not None:
-                print("       L_Infinity: {:16.14e}".format(
-                    linf_norm))
-        variable_pass = True
-        if 'Time' in da1.dims:
-            time_range = range(0, da1.sizes['Time'])
-            time_str = ', '.join(['{}'.format(j) for j in time_range])
-            print('{} Time index: {}'.format(variable.ljust(20), time_str))
-            for time_index in time_range:
-                slice1 = da1.isel(Time=time_index)
-                slice2 = da2.isel(Time=time_index)
+    if not quiet:
+        print("    Pass thresholds are:", file=output)
+        if l1_norm is not None:
+            print("       L1: {:16.14e}".format(l1_norm), file=output)
+        if l2_norm is not None:
+            print("       L2: {:16.14e}".format(l2_norm), file=output)
+        if linf_norm is not None:
+            print("       L_Infinity: {:16.14e}".format(
+                linf_norm), file=output)
+    if raw_ds1 is not None and raw_ds2 is not None:
+        raw1 = raw_ds1[variable]
+        raw2 = raw_ds2[variable]
+    else:
+        raw1 = None
+        raw2 = None
+
+    variable_pass = True
+    if 'Time' in da1.dims:
+        time_range = range(0, da1.sizes['Time'])
+        time_str = ', '.join(['{}'.format(j) for j in time_range])
+        print('{} Time index: {}'.format(variable.ljust(20), time_str),
+              file=output)
+        for time_index in time_range:
+            slice1 = da1.isel(Time=time_index)
+            slice2 = da2.isel(Time=time_index)
+            if raw1 is not None and _is_bitwise_identical(
+                    raw1.isel(Time=time_index), raw2.isel(Time=time_index)):
+                result = _report_identical(quiet, output,
+                                           time_index=time_index)
+            else:
                 result = _compute_norms(slice1, slice2, quiet, l1_norm,
-                                        l2_norm, linf_norm,
-                                        time_index=time_index)
-                variable_pass = variable_pass and result
-
-        else:
-            print('{}'.format(variable))
-            result = _compute_norms(da1, da2, quiet, l1_norm, l2_norm,
-                                    linf_norm)
+                                        l2_norm, linf_norm, output,
+                                        time_index=time_index,
+                                        exit_early=exit_early)
             variable_pass = variable_pass and result
+            if exit_early and not variable_pass:
+                break
 
-        # ANSI fail text: https://stackoverflow.com/a/287944/7728169
-        start_fail = '\033[91m'
-        start_pass = '\033[92m'
-        end = '\033[0m'
-        pass_str = '{}PASS{}'.format(start_pass, end)
-        fail_str = '{}FAIL{}'.format(start_fail, end)
-
-        if variable_pass:
-            print('  {} {}\n'.format(pass_str, filename1))
+    else:
+        print('{}'.format(variable), file=output)
+        if raw1 is not None and _is_bitwise_identical(raw1, raw2):
+            result = _report_identical(quiet, output)
         else:
-            print('  {} {}\n'.format(fail_str, filename1))
-        print('       {}\n'.format(filename2))
-        all_pass = all_pass and variable_pass
+            result = _compute_norms(da1, da2, quiet, l1_norm, l2_norm,
+                                    linf_norm, output, exit_early=exit_early)
+        variable_pass = variable_pass and result
+
+    # ANSI fail text: https://stackoverflow.com/a/287944/7728169
+    start_fail = '\033[91m'
+    start_pass = '\033[92m'
+    end = '\033[0m'
+    pass_str = '{}PASS{}'.format(start_pass, end)
+    fail_str = '{}FAIL{}'.format(start_fail, end)
+
+    if variable_pass:
+        print('  {} {}\n'.format(pass_str, filename1), file=output)
+    else:
+        print('  {} {}\n'.format(fail_str, filename1), file=output)
+    print('       {}\n'.format(filename2), file=output)
 
-    return all_pass
+    return variable_pass
 
 
 def _compute_norms(da1, da2, quiet, max_l1_norm, max_l2_norm, max_linf_norm,
-                   time_index=None):
-    """ Compute norms between variables in two DataArrays """
+                   output, time_index=None, exit_early=False):
+    """
+    Compute norms between variables in two DataArrays, reading and
+    accumulating the norms over chunks along the first dimension so the full
+    difference is never held in memory.  If ``exit_early``, stop as soon as
+    any of the norms exceeds its maximum, in which case the norms that are
+    reported are lower bounds.
+    """
 
     da1 = _rename_duplicate_dims(da1)
     da2 = _rename_duplicate_dims(da2)
 
-    result = True
-    diff = numpy.abs(da1 - da2).values.ravel()
+    l1_norm = 0.
+    l2_norm_squared = 0.
+    linf_norm = 0.
+    complete = True
+    for chunk1, chunk2 in _iterate_chunks(da1, da2):
+        diff = numpy.abs(chunk1 - chunk2).ravel().astype(float)
+
+        l1_norm += numpy.sum(diff)
+        l2_norm_squared += numpy.dot(diff, diff)
+        linf_norm = max(linf_norm, numpy.amax(diff, initial=0.))
+
+        if exit_early and not _check_norms(
+                l1_norm, numpy.sqrt(l2_norm_squared), linf_norm,
+                max_l1_norm, max_l2_norm, max_linf_norm):
+            complete = False
+            break
+
+    l2_norm = numpy.sqrt(l2_norm_squared)
+
+    result = _check_norms(l1_norm, l2_norm, linf_norm, max_l1_norm,
+                          max_l2_norm, max_linf_norm)
+
+    if not quiet or not result:
+        print(_format_norms(l1_norm, l2_norm, linf_norm, time_index,
+                            complete), file=output)
+
+    return result
+
+
+def _report_identical(quiet, output, time_index=None):
+    """
+    Report zero norms for variables that are bitwise identical, which always
+    pass
+    """
+    if not quiet:
+        print(_format_norms(0., 0., 0., time_index, complete=True),
+              file=output)
+    return True
 
-    l1_norm = numpy.linalg.norm(diff, ord=1)
-    l2_norm = numpy.linalg.norm(diff, ord=2)
-    linf_norm = numpy.linalg.norm(diff, ord=numpy.inf)
 
+def _is_bitwise_identical(da1, da2):
+    """
+    Check if the raw (undecoded) data in two DataArrays is bitwise identical,
+    reading them in chunks
+    """
+    da1 = _rename_duplicate_dims(da1)
+    da2 = _rename_duplicate_dims(da2)
+    if da1.dtype != da2.dtype:
+        return False
+    for chunk1, chunk2 in _iterate_chunks(da1, da2):
+        if chunk1.tobytes() != chunk2.tobytes():
+            return False
+    return True
+
+
+def _format_norms(l1_norm, l2_norm, linf_norm, time_index, complete):
+    """
+    Format the norms for printing, noting if they are lower bounds because
+    they are incomplete
+    """
     if time_index is None:
         diff_str = ''
     else:
         diff_str = '{:d}: '.format(time_index)
 
-    if max_l1_norm is not None:
-        if max_l1_norm < l1_norm:
-            result = False
-    diff_str = '{} l1: {:16.14e} '.format(diff_str, l1_norm)
+    if complete:
+        comparison = ':'
+    else:
+        comparison = ' >='
+
+    diff_str = '{} l1{} {:16.14e} '.format(diff_str, comparison, l1_norm)
+    diff_str = '{} l2{} {:16.14e} '.format(diff_str, comparison, l2_norm)
+    diff_str = '{} linf{} {:16.14e} '.format(diff_str, comparison, linf_norm)
+    return diff_str
 
-    if max_l2_norm is not None:
-        if max_l2_norm < l2_norm:
-            result = False
-    diff_str = '{} l2: {:16.14e} '.format(diff_str, l2_norm)
 
-    if max_linf_norm is not None:
-        if max_linf_norm < linf_norm:
+def _check_norms(l1_norm, l2_norm, linf_norm, max_l1_norm, max_l2_norm,
+                 max_linf_norm):
+    """ Check whether norms are within their maximum allowed values """
+    result = True
+    for norm, max_norm in [(l1_norm, max_l1_norm), (l2_norm, max_l2_norm),
+                           (linf_norm, max_linf_norm)]:
+        if max_norm is not None and max_norm < norm:
             result = False
-    diff_str = '{} linf: {:16.14e} '.format(diff_str, linf_norm)
+    return result
 
-    if not quiet or not result:
-        print(diff_str)
 
-    return result
+def _iterate_chunks(da1, da2):
+    """
+    Read the values of two DataArrays of the same shape in chunks of at most
+    ``_chunk_size`` values (but at least one index) along the first dimension
+    """
+    if da1.ndim == 0 or da1.size == 0:
+        yield da1.values, da2.values
+        return
+
+    dim = da1.dims[0]
+    dim_size = da1.sizes[dim]
+    stride = da1.size // dim_size
+    indices_per_chunk = max(1, _chunk_size // stride)
+    for start in range(0, dim_size, indices_per_chunk):
+        indices = slice(start, min(start + indices_per_chunk, dim_size))
+        yield da1.isel({dim: indices}).values, da2.isel({dim: indices}).values
 
 
 def _compute_timers(base_directory, comparison_directory, timers):